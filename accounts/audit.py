@@ -0,0 +1,231 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+from accounts import models
+from pathlib import Path
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+
+
+
+logger = logging.getLogger("audit")
+
+SPOOL_PATTERN = "audit-{pid}-{token}-{segment:06d}.jsonl"
+
+
+
+def _entry_to_log(entry,existing_users):
+    user_id = entry["user_id"] if entry["user_id"] in existing_users else None
+
+    return models.AuditLog(user_id    = user_id,
+                           action     = entry["action"],
+                           model      = entry["model"],
+                           object_id  = entry["object_id"],
+                           message    = entry["message"],
+                           changes    = entry["changes"],
+                           created_at = parse_datetime(entry["created_at"])
+                          )
+
+
+
+# bulk inserts spooled entries. users deleted since the entry was queued are written as null,
+# the same thing SET_NULL would have done to a row that was already there.
+
+def write_entries(entries):
+    if not entries:
+        return 0
+
+    user_ids = {entry["user_id"] for entry in entries if entry["user_id"] is not None}
+    existing = set(models.User.objects.filter(id__in=user_ids).values_list("id",flat=True)) if user_ids else set()
+
+    logs = [_entry_to_log(entry,existing) for entry in entries]
+    models.AuditLog.objects.bulk_create(logs, batch_size=settings.AUDIT_LOG_BATCH_SIZE)
+
+    return len(logs)
+
+
+
+def read_segment(path):
+    entries = []
+    with open(path,encoding="utf-8") as spool:
+        for line in spool:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:     # torn last line of a crashed process
+                logger.warning("Skipping unreadable audit spool line in %s", path)
+    return entries
+
+
+
+
+# in-process audit queue. every entry is appended to a spool file before it is buffered, so a crash
+# loses nothing: segments are deleted only after their rows are committed. the writer keeps an flock on
+# every segment it owns, segments nobody holds a lock on belong to dead processes and are replayed
+# (at startup and by the replay_audit_spool command).
+# delivery is at least once, a crash between the insert and the unlink writes that batch twice.
+
+class BufferedAuditWriter:
+
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.flushing = threading.Lock()
+        self.wakeup   = threading.Event()
+        self.pid      = None
+
+
+    def _start(self):
+        self.pid      = os.getpid()
+        self.token    = uuid.uuid4().hex[:8]
+        self.spool    = Path(settings.AUDIT_LOG_SPOOL_DIR)
+        self.segment  = 0
+        self.file     = None
+        self.buffer   = []
+        self.pending  = []      # (segment path, locked file, entries) rotated but not written yet
+
+        self.spool.mkdir(parents=True, exist_ok=True)
+        self._open_segment()
+
+        thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        thread.start()
+
+        atexit.register(self.shutdown)
+
+
+    # the segment is created and locked under a name the replayer does not look at, then renamed into place.
+    # opened under its final name, a replayer could lock it in between, find it empty and unlink it.
+    def _open_segment(self):
+        self.segment += 1
+        self.path = self.spool / SPOOL_PATTERN.format(pid=self.pid, token=self.token, segment=self.segment)
+        creating  = self.path.with_name(f".{self.path.name}.tmp")
+
+        self.file = open(creating,"a",encoding="utf-8")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        os.replace(creating,self.path)
+
+
+    def enqueue(self,entry):
+        line = json.dumps(entry, cls=DjangoJSONEncoder)
+
+        with self.lock:
+            if self.pid != os.getpid():     # first use, or a forked worker that inherited the parent's writer
+                self._start()
+
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.buffer.append(entry)
+
+            full = len(self.buffer) >= settings.AUDIT_LOG_BUFFER_SIZE
+
+        if full:
+            self.wakeup.set()
+
+
+    def _rotate(self):
+        with self.lock:
+            if self.buffer:
+                self.pending.append((self.path,self.file,self.buffer))
+                self.buffer = []
+                self._open_segment()
+
+            return list(self.pending)
+
+
+    def flush(self):
+        if self.pid != os.getpid():
+            return 0
+
+        written = 0
+        with self.flushing:
+            for path,spool,entries in self._rotate():
+                try:
+                    with transaction.atomic():
+                        written += write_entries(entries)
+                except Exception:
+                    logger.exception("Audit log flush failed, %s entries stay spooled in %s", len(entries), path)
+                    break
+
+                with self.lock:
+                    self.pending.pop(0)
+
+                path.unlink(missing_ok=True)
+                spool.close()
+
+        return written
+
+
+    def shutdown(self):
+        self.flush()
+
+        with self.lock:
+            if self.pid == os.getpid() and not self.buffer:
+                self.path.unlink(missing_ok=True)
+                self.file.close()
+
+
+    def _run(self):
+        replay_orphaned_segments()
+
+        while True:
+            self.wakeup.wait(settings.AUDIT_LOG_FLUSH_INTERVAL)
+            self.wakeup.clear()
+
+            close_old_connections()
+            self.flush()
+
+
+writer = BufferedAuditWriter()
+
+
+
+
+# writes and removes the spool segments of processes that are no longer running
+
+def replay_orphaned_segments(spool_dir=None):
+    spool = Path(spool_dir or settings.AUDIT_LOG_SPOOL_DIR)
+    if not spool.is_dir():
+        return 0
+
+    written = 0
+    for path in sorted(spool.glob("audit-*.jsonl")):
+        try:
+            segment = open(path,encoding="utf-8")
+        except FileNotFoundError:     # written and removed by its owner meanwhile
+            continue
+
+        with segment:
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:     # owned by a live writer
+                continue
+
+            if not path.exists():
+                continue
+
+            try:
+                with transaction.atomic():
+                    written += write_entries(read_segment(path))
+            except Exception:
+                logger.exception("Replaying audit spool segment %s failed", path)
+                continue
+
+            path.unlink(missing_ok=True)
+
+    return written
+
+
+
+
+# entries are only queued once the surrounding transaction commits, a rolled back admin write
+# leaves no audit row behind, same as the synchronous insert did.
+
+def record(entry):
+    transaction.on_commit(lambda: writer.enqueue(entry))
@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router, transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from common.cache import get_generation, bump_generations, cache_is_shared
+from collections import OrderedDict
+import threading
+import time
+
+
+
+USER_KEY = "auth:user:{}:{}"
+
+PASSWORD_DIGEST = "_password_digest"
+
+
+
+def token_version_namespace(user_id):
+    return f"token_version:{user_id}"
+
+
+
+# per process LRU of {user id: (expires at, entry)}. entries live AUTH_USER_LOCAL_TTL seconds, so a change made
+# through another process shows up here at most that late, changes made through this one evict right away.
+
+class LocalUserCache:
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.entries = OrderedDict()
+
+
+    def get(self,user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+
+            if entry[0] < time.monotonic():
+                del self.entries[user_id]
+                return None
+
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+
+    def set(self,user_id,entry):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + settings.AUTH_USER_LOCAL_TTL, entry)
+            self.entries.move_to_end(user_id)
+
+            while len(self.entries) > settings.AUTH_USER_LOCAL_SIZE:
+                self.entries.popitem(last=False)
+
+
+    def evict(self,user_id):
+        with self.lock:
+            self.entries.pop(user_id,None)
+
+
+local_users = LocalUserCache()
+
+
+
+
+# what the caches hold for a user: every concrete field but the password hash. the token revocation check
+# only needs the digest simplejwt compares against, it is kept instead of the hash and only when the check is on.
+
+def to_entry(user):
+    entry = {field.attname:getattr(user,field.attname) for field in user._meta.concrete_fields if field.attname != "password"}
+
+    if api_settings.CHECK_REVOKE_TOKEN:
+        entry[PASSWORD_DIGEST] = get_md5_hash_password(user.password)
+
+    return entry
+
+
+# a fresh instance per call with password deferred, reading it (check_password for example) loads it from the database
+
+def from_entry(entry):
+    model  = get_user_model()
+    fields = [name for name in entry if name != PASSWORD_DIGEST]
+
+    return model.from_db(router.db_for_read(model), fields, [entry[name] for name in fields])
+
+
+
+
+# the local LRU first, then the shared cache under the user's current token version, then the database.
+# the version is read before the row, so a row loaded ahead of a concurrent change is stored under a version
+# that the change has already retired. without a shared cache (no REDIS_URL) that tier is skipped: it would be
+# a second per process copy that outlives AUTH_USER_LOCAL_TTL and that invalidations in other processes never reach.
+# None when the user does not exist.
+
+def get_user_entry(user_id):
+    user_id = str(user_id)     # the claim may be a string, the primary key is not
+    entry   = local_users.get(user_id)
+    if entry is not None:
+        return entry
+
+    key   = USER_KEY.format(user_id, get_generation(token_version_namespace(user_id))) if cache_is_shared() else None
+    entry = cache.get(key) if key else None
+
+    if entry is None:
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD:user_id}).first()
+        if user is None:
+            return None
+
+        entry = to_entry(user)
+        if key:
+            cache.set(key, entry, settings.AUTH_USER_CACHE_TIMEOUT)
+
+    local_users.set(user_id,entry)
+    return entry
+
+
+# every caller gets its own instance, views are free to modify request.user. writes through it must name their
+# update_fields: another process may hand out a copy up to AUTH_USER_LOCAL_TTL seconds old.
+
+def get_cached_user(user_id):
+    entry = get_user_entry(user_id)
+    return from_entry(entry) if entry is not None else None
+
+
+
+# retires the cached copies of a user once the surrounding transaction commits: the token version moves on,
+# so the shared entry is no longer addressed, and this process drops its local one
+
+def invalidate_user(user_id):
+    user_id = str(user_id)
+    bump_generations(token_version_namespace(user_id))
+    transaction.on_commit(lambda: local_users.evict(user_id))
+
+
+
+
+# JWTAuthentication with the user row served from get_cached_user() instead of one query per request
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self,validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        entry = get_user_entry(user_id)
+
+        if entry is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+
+        user = from_entry(entry)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            digest = entry.get(PASSWORD_DIGEST) or get_md5_hash_password(user.password)     # cached before the check was switched on
+
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != digest:
+                raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+
+        return user
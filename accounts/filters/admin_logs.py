@@ -1,5 +1,7 @@
 from rest_framework import serializers as drf_serializers
 from django.db.models import Q
+from django.utils import timezone
+from datetime import datetime, time, timedelta
 
 
 MODEL_OPTIONS = {"brand"    : "BrandModel",
@@ -89,11 +91,14 @@ def admin_filter_logs(request,queryset):
 
 
 
+    # plain range on created_at rather than created_at__date, a cast of the column would stop
+    # postgres from pruning the monthly partitions
+
     if date_from:
-        queryset = queryset.filter(created_at__date__gte=date_from)
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(date_from,time.min)))
 
     if date_to:
-        queryset = queryset.filter(created_at__date__lte=date_to)
+        queryset = queryset.filter(created_at__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1),time.min)))
 
     
 
@@ -1,4 +1,7 @@
+from django.conf import settings
+from django.utils import timezone
 from accounts import models
+from accounts import audit
 
 
 
@@ -10,6 +13,17 @@ def create_audit_log(*,user,action,instance=None,message="",changes=None):
         model = ""
         object_id = ""
 
+    if settings.AUDIT_LOG_MODE == "buffered":
+        audit.record({"user_id":getattr(user,"pk",None),
+                      "action":action,
+                      "model":model,
+                      "object_id":object_id,
+                      "message":message,
+                      "changes":changes,
+                      "created_at":timezone.now().isoformat()
+                     })
+        return
+
     models.AuditLog.objects.create(user      = user,
                                    action    = action,
                                    model     = model,
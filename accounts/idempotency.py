@@ -0,0 +1,200 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from accounts import models
+from common.helpers import error_response
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from functools import wraps
+from inspect import iscoroutinefunction
+import hashlib
+import json
+
+
+
+HEADER          = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+MAX_KEY_LENGTH = 255
+
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data,"lists"):     # QueryDict from form posts
+        data = dict(data.lists())
+
+    payload = json.dumps([request.method, request.path, data], cls=DjangoJSONEncoder, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+
+def _expiry(now):
+    return now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+
+# takes over a row nobody can be working on anymore: expired, or still running past the lock timeout
+# (the worker died). the conditional update makes sure only one request wins the takeover.
+
+def _take_over(record,fingerprint,now,**conditions):
+    taken = models.IdempotencyKeyModel.objects.filter(id=record.id, **conditions).update(fingerprint = fingerprint,
+                                                                                        status_code = None,
+                                                                                        response    = None,
+                                                                                        locked_at   = now,
+                                                                                        expires_at  = _expiry(now)
+                                                                                       )
+    return record if taken else None
+
+
+
+# returns (record, None) when this request owns the key and has to run the view,
+# (None, response) when the key was seen before and that response is the answer.
+
+def claim(user,key,fingerprint):
+    now    = timezone.now()
+    record = models.IdempotencyKeyModel.objects.filter(user=user,key=key).first()
+
+    if record is None:
+        try:
+            with transaction.atomic():
+                return models.IdempotencyKeyModel.objects.create(user=user, key=key, fingerprint=fingerprint, locked_at=now, expires_at=_expiry(now)),None
+        except IntegrityError:     # a concurrent request with the same key got there first
+            record = models.IdempotencyKeyModel.objects.filter(user=user,key=key).first()
+            if record is None:
+                return claim(user,key,fingerprint)
+
+
+    if record.expires_at <= now:
+        if _take_over(record,fingerprint,now,expires_at=record.expires_at):
+            return record,None
+
+    elif record.fingerprint != fingerprint:
+        return None,error_response(message = "Idempotency-Key was already used for a different request.",
+                                   data    = {"idempotency_key":key},
+                                   status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+                                  )
+
+    elif record.status_code is not None:
+        return None,Response(record.response, status=record.status_code, headers={REPLAYED_HEADER:"true"})
+
+    elif record.locked_at <= now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+        if _take_over(record,fingerprint,now,status_code__isnull=True,locked_at=record.locked_at):
+            return record,None
+
+
+    return None,error_response(message = "A request with this Idempotency-Key is still being processed.",
+                               data    = {"idempotency_key":key},
+                               status_code = status.HTTP_409_CONFLICT
+                              )
+
+
+
+# only successful responses are kept. a failed attempt (validation error, gateway error, crash) gives the
+# key back, so the client can fix the request or retry with the same key.
+
+def complete(record,response):
+    if status.is_success(response.status_code):
+        payload = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+        models.IdempotencyKeyModel.objects.filter(id=record.id).update(status_code=response.status_code, response=payload, locked_at=None)
+    else:
+        release(record)
+
+
+
+def release(record):
+    models.IdempotencyKeyModel.objects.filter(id=record.id, status_code__isnull=True).delete()
+
+
+
+
+# None when the header is absent, otherwise (key, None) or (None, error response) for a malformed key
+
+def _read_key(request):
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None,error_response(message = f"Idempotency-Key must be between 1 and {MAX_KEY_LENGTH} characters.",
+                                   status_code = status.HTTP_400_BAD_REQUEST
+                                  )
+    return key,None
+
+
+
+# for POST handlers of authenticated views, sync or async. without the header the view runs as before. with it,
+# the first request runs the view and stores its response, repeats with the same key and body get that response
+# back from one indexed lookup without running the view again.
+
+def idempotent(view_method):
+
+    if iscoroutinefunction(view_method):
+
+        @wraps(view_method)
+        async def async_wrapper(self,request,*args,**kwargs):
+            header = _read_key(request)
+            if header is None:
+                return await view_method(self,request,*args,**kwargs)
+
+            key,response = header
+            if response is not None:
+                return response
+
+            record,response = await sync_to_async(claim)(request.user,key,request_fingerprint(request))
+            if response is not None:
+                return response
+
+            try:
+                response = await view_method(self,request,*args,**kwargs)
+            except BaseException:     # cancelled requests give the key back too
+                await sync_to_async(release)(record)
+                raise
+
+            await sync_to_async(complete)(record,response)
+            return response
+
+        return async_wrapper
+
+
+    @wraps(view_method)
+    def wrapper(self,request,*args,**kwargs):
+        header = _read_key(request)
+        if header is None:
+            return view_method(self,request,*args,**kwargs)
+
+        key,response = header
+        if response is not None:
+            return response
+
+        record,response = claim(request.user,key,request_fingerprint(request))
+        if response is not None:
+            return response
+
+        try:
+            response = view_method(self,request,*args,**kwargs)
+        except Exception:
+            release(record)
+            raise
+
+        complete(record,response)
+        return response
+
+    return wrapper
+
+
+
+def purge_expired_keys(batch_size=1000,now=None):
+    now     = now or timezone.now()
+    deleted = 0
+
+    while True:
+        ids = list(models.IdempotencyKeyModel.objects.filter(expires_at__lte=now).order_by("expires_at").values_list("id",flat=True)[:batch_size])
+        if not ids:
+            return deleted
+
+        deleted += models.IdempotencyKeyModel.objects.filter(id__in=ids, expires_at__lte=now).delete()[0]
@@ -0,0 +1,127 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from accounts import models as accounts_models
+from carts import models as carts_models
+from orders import models as orders_models
+from payments import models as payments_models
+from products import models as products_models
+import json
+
+
+
+# walks a postgres json plan and collects the scan nodes as (node type, relation, index)
+
+def _scans(plan):
+    scans = []
+
+    if "Scan" in plan["Node Type"]:
+        scans.append((plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")))
+
+    for child in plan.get("Plans",[]):
+        scans.extend(_scans(child))
+
+    return scans
+
+
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN ANALYZE for the hot endpoint queries and reports the index each one uses."
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--user", type=int, help="user id to plan the per user queries with, defaults to the user with the most orders")
+        parser.add_argument("--verbose-plan", action="store_true", help="print the full plan for every query")
+
+
+    def get_user_id(self,options):
+        if options["user"]:
+            return options["user"]
+
+        order = orders_models.OrderModel.objects.order_by("-id").values("user_id").first()
+        if order:
+            return order["user_id"]
+
+        user = accounts_models.User.objects.order_by("id").values("id").first()
+        return user["id"] if user else 0
+
+
+    # (endpoint, queryset, index expected to serve it). querysets mirror the ones built by the views.
+
+    def get_queries(self,user_id):
+        order = orders_models.OrderModel.objects.filter(user_id=user_id).order_by("-created_at").values("id").first()
+        order_id = order["id"] if order else 0
+
+        audit = accounts_models.AuditLog.objects.exclude(model=None).values("model","object_id").first() or {"model":"ProductModel","object_id":"1"}
+
+        return [("GET /api/cart/",
+                 carts_models.CartModel.objects.filter(user_id=user_id).order_by("-created_at")[:10],
+                 "cart_user_created_idx"
+                ),
+                ("GET /api/orders/",
+                 orders_models.OrderModel.objects.filter(user_id=user_id).order_by("-created_at")[:10],
+                 "order_user_created_idx"
+                ),
+                ("order cancel / return items",
+                 orders_models.OrderItemModel.objects.filter(order_id=order_id,status="PENDING"),
+                 "orderitem_order_status_idx"
+                ),
+                ("POST payment initiate",
+                 payments_models.PaymentModel.objects.filter(order_id=order_id,method="RAZORPAY",status="PENDING")[:1],
+                 "payment_order_meth_status_idx"
+                ),
+                ("GET admin audit logs",
+                 accounts_models.AuditLog.objects.order_by("-created_at")[:10],
+                 "auditlog_created_idx"
+                ),
+                ("GET admin audit logs ?model&object_id",
+                 accounts_models.AuditLog.objects.filter(model=audit["model"],object_id=audit["object_id"])[:10],
+                 "auditlog_model_object_idx"
+                ),
+                ("GET /api/catalog/products/ newest",
+                 products_models.ProductModel.objects.filter(is_active=True).order_by("-created_at")[:10],
+                 "product_active_created_idx"
+                ),
+                ("GET /api/catalog/products/ ?sort=price_asc",
+                 products_models.ProductModel.objects.filter(is_active=True).order_by("price")[:10],
+                 "product_active_price_idx"
+                ),
+                ("checkout default address",
+                 accounts_models.AddressModel.objects.filter(user_id=user_id,is_default=True)[:1],
+                 "single_default_address_per_user"
+                )
+               ]
+
+
+    def handle(self,*args,**options):
+        postgres = connection.vendor == "postgresql"
+
+        if not postgres:
+            self.stdout.write(self.style.WARNING(f"{connection.vendor} backend, showing plain EXPLAIN output without ANALYZE."))
+
+
+        for endpoint,queryset,expected in self.get_queries(self.get_user_id(options)):
+            self.stdout.write(self.style.MIGRATE_HEADING(endpoint))
+
+            if not postgres:
+                self.stdout.write(queryset.explain())
+                continue
+
+            plan  = json.loads(queryset.explain(analyze=True, buffers=True, format="json"))[0]
+            scans = _scans(plan["Plan"])
+
+            used = [index for _,_,index in scans if index]
+            seq  = [relation for node,relation,_ in scans if node == "Seq Scan"]
+
+            line = f"  {plan['Execution Time']:.3f} ms  indexes: {', '.join(used) or '-'}"
+            if seq:
+                line += f"  seq scans: {', '.join(seq)}"
+
+            style = self.style.SUCCESS if expected in used else self.style.WARNING
+            self.stdout.write(style(line))
+
+            if expected not in used:
+                self.stdout.write(f"  expected {expected}, small tables are often cheaper to scan sequentially")
+
+            if options["verbose_plan"]:
+                self.stdout.write(json.dumps(plan["Plan"], indent=2))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from accounts.idempotency import purge_expired_keys
+
+
+
+class Command(BaseCommand):
+    help = "Deletes expired Idempotency-Key records. Meant to run periodically."
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+
+    def handle(self,*args,**options):
+        deleted = purge_expired_keys(batch_size=options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(f"{deleted} expired idempotency keys deleted"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from accounts.audit import replay_orphaned_segments
+
+
+
+class Command(BaseCommand):
+    help = "Writes audit log entries left in the spool directory by processes that exited before flushing them."
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--spool-dir", default=None, help=f"defaults to AUDIT_LOG_SPOOL_DIR ({settings.AUDIT_LOG_SPOOL_DIR})")
+
+
+    def handle(self,*args,**options):
+        written = replay_orphaned_segments(options["spool_dir"])
+
+        self.stdout.write(self.style.SUCCESS(f"Replayed {written} audit log entries."))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.utils import timezone
+from accounts import partitions
+
+
+
+class Command(BaseCommand):
+    help = ("Creates the upcoming monthly audit log partitions and archives partitions older than the "
+            "retention period to gzipped JSON lines before dropping them.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--ahead", type=int, default=settings.AUDIT_LOG_PARTITIONS_AHEAD, help="months of partitions to keep created ahead")
+        parser.add_argument("--retention-months", type=int, default=settings.AUDIT_LOG_RETENTION_MONTHS)
+        parser.add_argument("--archive-dir", default=settings.AUDIT_LOG_ARCHIVE_DIR)
+        parser.add_argument("--dry-run", action="store_true", help="only report what would be created and archived")
+
+
+    def handle(self,*args,**options):
+        if not partitions.partitioning_enabled():
+            raise CommandError("The audit log table is not partitioned, this needs PostgreSQL and migration accounts 0012.")
+
+        if options["retention_months"] < 1:
+            raise CommandError("--retention-months must be at least 1.")
+
+        dry_run = options["dry_run"]
+        current = partitions.month_start(timezone.now())
+
+
+        for offset in range(options["ahead"] + 1):
+            month = partitions.add_months(current,offset)
+            name  = partitions.partition_name(month)
+
+            if dry_run:
+                self.stdout.write(f"would ensure {name}")
+            elif partitions.ensure_partition(month):
+                self.stdout.write(self.style.SUCCESS(f"created {name}"))
+
+
+        cutoff = partitions.retention_cutoff(options["retention_months"])
+
+        for name,start,end in partitions.list_partitions():
+            if end > cutoff:
+                continue
+
+            if dry_run:
+                self.stdout.write(f"would archive and drop {name}")
+                continue
+
+            path,rows = partitions.archive_partition(name,start,end,options["archive_dir"])
+
+            try:
+                partitions.drop_partition(name,rows)
+            except partitions.ArchiveMismatch as e:
+                self.stdout.write(self.style.WARNING(f"kept {name}: {e}, it is archived again on the next run"))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(f"archived {rows} rows of {name} to {path} and dropped it"))
@@ -0,0 +1,101 @@
+# Converts accounts_auditlog into a table range partitioned by month on created_at (postgres only).
+# The primary key becomes (id, created_at) since postgres requires the partition key in every unique index,
+# the model keeps id as its primary key. Monthly partitions are created from the oldest row up to three
+# months ahead, later months are added by the rotate_audit_logs command.
+
+from django.db import migrations
+
+
+PARENT  = "accounts_auditlog"
+OLD     = "accounts_auditlog_unpartitioned"
+DEFAULT = "accounts_auditlog_default"
+
+MONTHS_AHEAD = 3
+
+
+def _months(first,last):
+    year,month = first
+    while (year,month) <= last:
+        yield year,month
+        year,month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _bounds(year,month):
+    end = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01 00:00:00+00", f"{end[0]:04d}-{end[1]:02d}-01 00:00:00+00"
+
+
+def partition_auditlog(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    user_table = apps.get_model("accounts", "User")._meta.db_table
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {PARENT} RENAME TO {OLD}")
+        cursor.execute(f"CREATE TABLE {PARENT} (LIKE {OLD}) PARTITION BY RANGE (created_at)")
+
+        cursor.execute(f"SELECT min(created_at AT TIME ZONE 'UTC'), now() AT TIME ZONE 'UTC' FROM {OLD}")
+        oldest,now = cursor.fetchone()
+        oldest = oldest or now
+
+        last = (now.year + (now.month - 1 + MONTHS_AHEAD) // 12, (now.month - 1 + MONTHS_AHEAD) % 12 + 1)
+        for year,month in _months((oldest.year, oldest.month), last):
+            start,end = _bounds(year,month)
+            cursor.execute(f"CREATE TABLE {PARENT}_p{year:04d}{month:02d} PARTITION OF {PARENT} FOR VALUES FROM ('{start}') TO ('{end}')")
+
+        cursor.execute(f"CREATE TABLE {DEFAULT} PARTITION OF {PARENT} DEFAULT")
+
+        cursor.execute(f"INSERT INTO {PARENT} SELECT * FROM {OLD}")
+        cursor.execute(f"DROP TABLE {OLD}")
+
+        cursor.execute(f"CREATE SEQUENCE {PARENT}_id_seq OWNED BY {PARENT}.id")
+        cursor.execute(f"SELECT setval('{PARENT}_id_seq', COALESCE((SELECT max(id) FROM {PARENT}), 0) + 1, false)")
+        cursor.execute(f"ALTER TABLE {PARENT} ALTER COLUMN id SET DEFAULT nextval('{PARENT}_id_seq')")
+
+        cursor.execute(f"ALTER TABLE {PARENT} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(f"CREATE INDEX auditlog_created_idx ON {PARENT} (created_at DESC)")
+        cursor.execute(f"CREATE INDEX auditlog_model_object_idx ON {PARENT} (model, object_id)")
+        cursor.execute(f"CREATE INDEX {PARENT}_user_id_idx ON {PARENT} (user_id)")
+        cursor.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_user_id_fk FOREIGN KEY (user_id) "
+                       f"REFERENCES {user_table} (id) DEFERRABLE INITIALLY DEFERRED")
+
+
+def unpartition_auditlog(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    user_table = apps.get_model("accounts", "User")._meta.db_table
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {PARENT} RENAME TO {OLD}")
+        cursor.execute(f"ALTER INDEX auditlog_created_idx RENAME TO {OLD}_created_idx")
+        cursor.execute(f"ALTER INDEX auditlog_model_object_idx RENAME TO {OLD}_model_object_idx")
+        cursor.execute(f"ALTER INDEX {PARENT}_user_id_idx RENAME TO {OLD}_user_id_idx")
+        cursor.execute(f"ALTER TABLE {OLD} ALTER COLUMN id DROP DEFAULT")
+        cursor.execute(f"ALTER SEQUENCE {PARENT}_id_seq RENAME TO {OLD}_id_seq")
+
+        cursor.execute(f"CREATE TABLE {PARENT} (LIKE {OLD})")
+        cursor.execute(f"INSERT INTO {PARENT} SELECT * FROM {OLD}")
+        cursor.execute(f"DROP TABLE {OLD} CASCADE")
+
+        cursor.execute(f"ALTER TABLE {PARENT} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{PARENT}', 'id'), COALESCE((SELECT max(id) FROM {PARENT}), 0) + 1, false)")
+
+        cursor.execute(f"ALTER TABLE {PARENT} ADD PRIMARY KEY (id)")
+        cursor.execute(f"CREATE INDEX auditlog_created_idx ON {PARENT} (created_at DESC)")
+        cursor.execute(f"CREATE INDEX auditlog_model_object_idx ON {PARENT} (model, object_id)")
+        cursor.execute(f"CREATE INDEX {PARENT}_user_id_idx ON {PARENT} (user_id)")
+        cursor.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_user_id_fk FOREIGN KEY (user_id) "
+                       f"REFERENCES {user_table} (id) DEFERRABLE INITIALLY DEFERRED")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_auditlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_auditlog, unpartition_auditlog),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.db.models import Q
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 # Create your models here.
 
@@ -9,6 +10,25 @@ class User(AbstractUser):
     email = models.EmailField(unique=True, blank=False)
 
 
+    # authentication serves users from a cache (accounts.authentication), every write retires the shared copy and
+    # this process's local one. other processes keep serving theirs for up to AUTH_USER_LOCAL_TTL seconds.
+    def save(self,*args,**kwargs):
+        from accounts.authentication import invalidate_user
+
+        result = super().save(*args,**kwargs)
+        invalidate_user(self.pk)
+        return result
+
+
+    def delete(self,*args,**kwargs):
+        from accounts.authentication import invalidate_user
+
+        user_id = self.pk
+        result  = super().delete(*args,**kwargs)
+        invalidate_user(user_id)
+        return result
+
+
 
 
 class AuditLog(models.Model):
@@ -19,11 +39,14 @@ class AuditLog(models.Model):
     message   = models.TextField(null=True, blank=True)
     changes   = models.JSONField(null=True, blank=True)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)     # set when the event happens, not when a buffered batch lands
 
 
     class Meta:
         ordering = ["-created_at"]
+        indexes  = [models.Index(fields=["-created_at"], name="auditlog_created_idx"),
+                    models.Index(fields=["model","object_id"], name="auditlog_model_object_idx")
+                   ]
 
     def __str__(self):
         return f"{self.user} - {self.action}"
@@ -52,10 +75,31 @@ class AddressModel(models.Model):
                                                name="single_default_address_per_user"
                                                )
                       ]
-        
-    
 
-    
 
 
 
+
+# one row per Idempotency-Key a user sent to a non idempotent endpoint (order creation, payment initiation).
+# status_code and response stay null while the first request is still running, see accounts.idempotency
+
+class IdempotencyKeyModel(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="idempotency_keys", on_delete=models.CASCADE, null=False, blank=False)
+    key  = models.CharField(max_length=255, null=False, blank=False)
+
+    fingerprint = models.CharField(max_length=64, null=False, blank=False)     # sha256 of method, path and body
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response    = models.JSONField(null=True, blank=True)
+
+    locked_at  = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=False, blank=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+    def __str__(self):
+        return f"{self.user_id} - {self.key}"
+
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user","key"], name="unique_idempotency_key_per_user")]
+        indexes     = [models.Index(fields=["expires_at"], name="idempotency_expires_idx")]
@@ -0,0 +1,161 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts import models
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+import gzip
+import json
+import os
+
+
+
+# the audit table is range partitioned by month on created_at (migration 0012, postgres only).
+# partitions are named accounts_auditlog_pYYYYMM, rows outside every partition land in accounts_auditlog_default.
+
+PARENT_TABLE    = models.AuditLog._meta.db_table
+DEFAULT_TABLE   = f"{PARENT_TABLE}_default"
+PARTITION_NAME  = PARENT_TABLE + "_p{:04d}{:02d}"
+
+ARCHIVE_FIELDS = ["id","user_id","action","model","object_id","message","changes","created_at"]
+
+
+
+def partitioning_enabled():
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s)",
+                       [PARENT_TABLE]
+                      )
+        return cursor.fetchone()[0]
+
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+
+def add_months(month,count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+
+def partition_name(month):
+    return PARTITION_NAME.format(month.year, month.month)
+
+
+
+# monthly partitions as (name, start, end), oldest first. bounds come from the names.
+
+def list_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute("""SELECT child.relname
+                          FROM pg_inherits
+                          JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                          JOIN pg_class child  ON child.oid  = pg_inherits.inhrelid
+                          WHERE parent.relname = %s""",
+                       [PARENT_TABLE]
+                      )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    prefix = f"{PARENT_TABLE}_p"
+    for name in names:
+        suffix = name.removeprefix(prefix)
+        if name == DEFAULT_TABLE or len(suffix) != 6 or not suffix.isdigit():
+            continue
+
+        start = datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc)
+        partitions.append((name, start, add_months(start,1)))
+
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+
+# creates the partition for this month unless it exists. rows already caught by the default partition
+# for that range are moved into the new table before it is attached, postgres refuses the attach otherwise.
+
+def ensure_partition(month):
+    name = partition_name(month)
+    end  = add_months(month,1)
+
+    if any(existing == name for existing,_,_ in list_partitions()):
+        return False
+
+    quote = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(PARENT_TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+
+        cursor.execute(f"WITH moved AS (DELETE FROM {quote(DEFAULT_TABLE)} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                       f"INSERT INTO {quote(name)} SELECT * FROM moved",
+                       [month,end]
+                      )
+
+        # DDL takes no bind parameters, the bounds are built from integers so inlining them is safe
+        cursor.execute(f"ALTER TABLE {quote(PARENT_TABLE)} ATTACH PARTITION {quote(name)} "
+                       f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+                      )
+
+    return True
+
+
+
+# streams one partition into a gzipped JSON lines file. written to a temporary name and renamed
+# once complete, so a half written archive never looks like a finished one.
+
+def archive_partition(name,start,end,archive_dir):
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+
+    path = archive_dir / f"{name}.jsonl.gz"
+    temp = archive_dir / f".{name}.jsonl.gz.tmp"
+
+    rows = 0
+    logs = models.AuditLog.objects.filter(created_at__gte=start, created_at__lt=end).order_by("id").values(*ARCHIVE_FIELDS)
+
+    with open(temp,"wb") as raw:
+        with gzip.open(raw,"wt",encoding="utf-8") as archive:
+            for log in logs.iterator(chunk_size=settings.AUDIT_LOG_ARCHIVE_CHUNK_SIZE):
+                archive.write(json.dumps(log, cls=DjangoJSONEncoder) + "\n")
+                rows += 1
+
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    os.replace(temp,path)
+    return path,rows
+
+
+
+class ArchiveMismatch(Exception):
+    pass
+
+
+
+# detaches and drops an archived partition. the row count is checked again after the detach has locked
+# the table, a row that slipped in after the archive was written rolls the drop back.
+
+def drop_partition(name,archived_rows):
+    quote = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {quote(PARENT_TABLE)} DETACH PARTITION {quote(name)}")
+
+        cursor.execute(f"SELECT count(*) FROM {quote(name)}")
+        rows = cursor.fetchone()[0]
+        if rows != archived_rows:
+            raise ArchiveMismatch(f"{name} has {rows} rows, {archived_rows} were archived")
+
+        cursor.execute(f"DROP TABLE {quote(name)}")
+
+
+
+def retention_cutoff(retention_months,now=None):
+    return add_months(month_start(now or timezone.now()), -retention_months)
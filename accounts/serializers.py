@@ -9,6 +9,8 @@ from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, Bl
 from django.conf import settings
 from orders import models as orders_models
 from accounts.helpers import create_audit_log
+from accounts.authentication import invalidate_user
+from orders.inventory import restock_items
 from payments import models as payments_model
 
 class RegsiterSerializer(serializers.ModelSerializer):
@@ -141,6 +143,8 @@ class LogoutSerializer(serializers.Serializer):
         refresh_token = self.validated_data["refresh_token"]
         refresh_token.blacklist()
 
+        invalidate_user(self.context["request"].user.id)
+
 
 
 
@@ -234,10 +238,15 @@ class UpdateProfileSerializer(serializers.ModelSerializer):
         return attrs
     
 
+    # request.user can be a cached copy a few seconds old, only the fields of this request are written back
     def update(self, instance, validated_data):
         try:
             with transaction.atomic():
-                return super().update(instance, validated_data)
+                for field,value in validated_data.items():
+                    setattr(instance,field,value)
+
+                instance.save(update_fields=list(validated_data))
+                return instance
         except IntegrityError:
             raise serializers.ValidationError({"error_message":"Username or email already taken.",
                                                "data":{"username":validated_data.get("username", ""),
@@ -284,7 +293,7 @@ class UpdatePasswordSerializer(serializers.ModelSerializer):
 
         with transaction.atomic():
             user.set_password(new_password)
-            user.save()
+            user.save(update_fields=["password"])     # request.user can be a cached copy, only write what changed
 
             refresh_tokens = OutstandingToken.objects.filter(user=user)
 
@@ -562,6 +571,7 @@ class AdminMarkOrderItemReturnedSerializer(serializers.ModelSerializer):
 
             instance.status = "RETURNED"
             instance.save(update_fields=["status"])
+            restock_items([instance.id], "RETURN")
 
             order_items = order.items.all()
             existing_items = order_items.exclude(status="RETURNED")
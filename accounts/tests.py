@@ -1,3 +1,164 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+from unittest import mock
+from accounts.authentication import CachedJWTAuthentication, local_users
+from orders.tests import create_order, create_product
 
-# Create your tests here.
+
+
+# the admin order list joins the user for user_email, the query count does not grow with the page size
+
+class AdminOrderListQueryCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser(username="admin", email="admin@example.com")
+        products  = [create_product("Hammer")]
+
+        for index in range(12):
+            user = get_user_model().objects.create_user(username=f"buyer{index}", email=f"buyer{index}@example.com")
+            create_order(user,products)
+
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+
+    def assert_list_queries(self,params,queries,rows):
+        with self.assertNumQueries(queries):
+            response = self.client.get("/api/accounts/admin/orders/",params)
+
+        self.assertEqual(response.status_code,200)
+        results = response.json()["data"]["results"]
+        self.assertEqual(len(results),rows)
+        self.assertTrue(all(order["user_email"].startswith("buyer") for order in results))
+
+
+    def test_page_number_pagination(self):
+        # COUNT(*) and the page with its users
+        self.assert_list_queries({"page_size":1},2,1)
+        self.assert_list_queries({"page_size":12},2,12)
+
+
+    def test_cursor_pagination(self):
+        self.assert_list_queries({"page_size":1,"pagination":"cursor"},1,1)
+        self.assert_list_queries({"page_size":12,"pagination":"cursor"},1,12)
+
+
+
+    @override_settings(QUERY_INSTRUMENTATION=True, QUERY_SERVER_TIMING=True)
+    def test_serializer_time_is_reported(self):
+        response = self.client.get("/api/accounts/admin/orders/",{"page_size":12})
+        timings  = dict(part.split(";",1) for part in response["Server-Timing"].split(", "))
+
+        self.assertGreater(float(timings["serializer"].removeprefix("dur=")),0)
+
+        stats = {entry["endpoint"]:entry for entry in self.client.get("/api/accounts/admin/query-stats/").json()["data"]["endpoints"]}
+        self.assertGreater(stats["admin-order-list"]["avg_serializer_ms"],0)
+
+
+
+
+# authentication serves the user from the process LRU, then the shared cache, then the database. every write to
+# the user retires both cached copies once it commits. LocMemCache is per process, so the shared tier only runs
+# where cache_is_shared() is patched to stand in for redis.
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class CachedAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_users.entries.clear()
+
+        self.user    = get_user_model().objects.create_user(username="buyer", email="buyer@example.com", password="old-password")
+        self.refresh = RefreshToken.for_user(self.user)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.refresh.access_token}")
+
+
+    def authenticate(self,queries):
+        request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {self.refresh.access_token}")
+
+        with self.assertNumQueries(queries):
+            user,_ = CachedJWTAuthentication().authenticate(request)
+        return user
+
+
+    def shared(self):
+        patcher = mock.patch("accounts.authentication.cache_is_shared", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def test_cached_after_first_request(self):
+        self.authenticate(1)
+        self.assertEqual(self.authenticate(0).username,"buyer")
+
+
+    def test_per_process_cache_is_skipped(self):
+        self.authenticate(1)
+        local_users.evict(str(self.user.id))
+
+        self.authenticate(1)
+
+
+    def test_shared_cache_behind_the_local_one(self):
+        self.shared()
+        self.authenticate(1)
+        local_users.evict(str(self.user.id))
+
+        self.authenticate(0)
+
+
+    def test_profile_update_invalidates(self):
+        self.shared()
+        self.authenticate(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch("/api/accounts/me/", {"first_name":"Renamed"}, format="json")
+        self.assertEqual(response.status_code,200)
+
+        self.assertEqual(self.authenticate(1).first_name,"Renamed")
+        self.authenticate(0)
+
+
+    def test_password_change_invalidates(self):
+        self.shared()
+        self.authenticate(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch("/api/accounts/me/password/", {"old_password":"old-password", "new_password":"new-password",
+                                                                        "confirm_password":"new-password"
+                                                                       }, format="json")
+        self.assertEqual(response.status_code,200)
+
+        self.assertTrue(self.authenticate(1).check_password("new-password"))     # the hash is deferred, check_password loads it
+
+
+    def test_deactivation_invalidates(self):
+        self.shared()
+        self.authenticate(1)
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=["is_active"])
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(1)
+
+
+    def test_logout_invalidates(self):
+        self.shared()
+        self.authenticate(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/accounts/logout/", {"refresh":str(self.refresh)}, format="json")
+        self.assertEqual(response.status_code,204)
+
+        self.authenticate(1)
@@ -20,6 +20,7 @@ urlpatterns = [
     path('admin/users/',views.UserListAPIView.as_view(), name="admin-user-list"),
     path('admin/audit-logs/',views.AuditLogListAPIView.as_view(), name="admin-audit-log-list"),
     path('admin/orders/',views.AdminOrderListAPIView.as_view(), name="admin-order-list"),    
+    path('admin/query-stats/',views.AdminQueryStatsAPIView.as_view(), name="admin-query-stats"),
 
     path('admin/users/<int:id>/',views.UserDetailAPIView.as_view(), name="admin-user-detail"),
     path('admin/audit-logs/<int:id>/', views.AdminAuditLogDetailAPIView.as_view(), name="admin-audit-log-detail"),
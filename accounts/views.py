@@ -10,7 +10,7 @@ from accounts.helpers import create_audit_log
 from accounts import models
 from common.pagination import DefaultPagination
 from django.db.models import Q
-from common.swagger import ID_PARAM,IS_ACTIVE_PARAM,IS_STAFF_PARAM,DATE_FROM_PARAM,DATE_TO_PARAM,SEARCH_PARAM,U_ID_PARAM,MODEL_PARAM,ACTION_PARAM,OBJECT_ID_PARAM
+from common.swagger import ID_PARAM,IS_ACTIVE_PARAM,IS_STAFF_PARAM,DATE_FROM_PARAM,DATE_TO_PARAM,SEARCH_PARAM,U_ID_PARAM,MODEL_PARAM,ACTION_PARAM,OBJECT_ID_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM
 from accounts.filters.admin_users import admin_filter_users
 from accounts.filters.admin_logs import admin_filter_logs
 from rest_framework import serializers as drf_serializers
@@ -19,7 +19,8 @@ from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from common.helpers import success_response,error_response,normalize_validation_errors
 from orders import models as orders_models
 from payments import models as payments_model
-from common.schemas import RegisterSuccessResponseSerializer,LoginSuccessResponseSerializer,ErrorResponseSerializer,SuccessResponseSerializer,RefreshTokenSuccessSerializer,ProfileSuccessResponseSerializer,UpdateProfileSuccessResponseSerializer,CreateAddressSuccessResponse,AddressListSuccessResponseSerializer,AddressDeleteSuccessResponse,UpdateAddressSuccessResponseSerializer,AddressDetailSuccessResponse,UserListSuccessResponseSerializer, UserDetailSuccessResponseSerializer,AuditLogListSuccessResponseSerializer,AuditLogDetailSuccessResponseSerializer,OrderListSuccessResponseSerializer,OrderDetailSuccessResponseSerializer,OrderUpdateSuccessResponseSerializer,AdminOrderPaymentHistorySuccessResponseSerializer,MarkOrderItemReturnSuccessResponseSerializer
+from common.instrumentation import get_query_stats, timed_data
+from common.schemas import RegisterSuccessResponseSerializer,LoginSuccessResponseSerializer,ErrorResponseSerializer,SuccessResponseSerializer,RefreshTokenSuccessSerializer,ProfileSuccessResponseSerializer,UpdateProfileSuccessResponseSerializer,CreateAddressSuccessResponse,AddressListSuccessResponseSerializer,AddressDeleteSuccessResponse,UpdateAddressSuccessResponseSerializer,AddressDetailSuccessResponse,UserListSuccessResponseSerializer, UserDetailSuccessResponseSerializer,AuditLogListSuccessResponseSerializer,AuditLogDetailSuccessResponseSerializer,OrderListSuccessResponseSerializer,OrderDetailSuccessResponseSerializer,OrderUpdateSuccessResponseSerializer,AdminOrderPaymentHistorySuccessResponseSerializer,MarkOrderItemReturnSuccessResponseSerializer,QueryStatsSuccessResponseSerializer
 # Create your views here.
 
 
@@ -197,7 +198,7 @@ class ProfileApiView(GenericAPIView):
         serializer = self.get_serializer(request.user)
 
         return success_response(message = "User data fetched successfully",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     
@@ -298,6 +299,7 @@ class AddressApiView(GenericAPIView):
         
 
     @swagger_auto_schema(tags=["User"], request_body=None,
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          responses={200 : AddressListSuccessResponseSerializer,
                                     500 : ErrorResponseSerializer,
                                     400 : ErrorResponseSerializer
@@ -312,11 +314,7 @@ class AddressApiView(GenericAPIView):
 
         serializer = self.get_serializer(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Address list fetched successfuly.",
                                 data    = paginated_data,
@@ -411,7 +409,7 @@ class AddressDetailAPIView(GenericAPIView):
         serializer = self.get_serializer(address)
 
         return success_response(message = "Address info fetched successfuly.",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
 
@@ -425,7 +423,7 @@ class UserListAPIView(GenericAPIView):
     pagination_class = DefaultPagination
 
     @swagger_auto_schema(tags=['Admin'],
-                         manual_parameters=[ID_PARAM,SEARCH_PARAM,IS_STAFF_PARAM,IS_ACTIVE_PARAM,DATE_FROM_PARAM,DATE_TO_PARAM],
+                         manual_parameters=[ID_PARAM,SEARCH_PARAM,IS_STAFF_PARAM,IS_ACTIVE_PARAM,DATE_FROM_PARAM,DATE_TO_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          request_body = None,
                          responses = {200 : UserListSuccessResponseSerializer,
                                       400 : ErrorResponseSerializer,
@@ -451,11 +449,7 @@ class UserListAPIView(GenericAPIView):
 
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
 
         return success_response(message = "User list fetched successfuly.",
                                 data    = paginated_data,
@@ -488,7 +482,7 @@ class UserDetailAPIView(GenericAPIView):
         serializer = self.serializer_class(user)
 
         return success_response(message = "User data fetched successfuly.",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     
@@ -501,7 +495,7 @@ class AuditLogListAPIView(GenericAPIView):
     pagination_class = DefaultPagination
 
     @swagger_auto_schema(tags=['Admin'],
-                         manual_parameters=[ID_PARAM,U_ID_PARAM,ACTION_PARAM,DATE_FROM_PARAM,DATE_TO_PARAM,SEARCH_PARAM,MODEL_PARAM,OBJECT_ID_PARAM],
+                         manual_parameters=[ID_PARAM,U_ID_PARAM,ACTION_PARAM,DATE_FROM_PARAM,DATE_TO_PARAM,SEARCH_PARAM,MODEL_PARAM,OBJECT_ID_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          request_body = None,
                          responses = {200 : AuditLogListSuccessResponseSerializer,
                                       500 : ErrorResponseSerializer,
@@ -527,11 +521,7 @@ class AuditLogListAPIView(GenericAPIView):
 
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
 
         return success_response(message = "Audit Log list fetched successfuly",
                                 data    = paginated_data,
@@ -563,7 +553,7 @@ class AdminAuditLogDetailAPIView(GenericAPIView):
         serializer = self.serializer_class(audit_log)
 
         return success_response(message = "Audit log detail fetched successfuly.",
-                                data    =  serializer.data,
+                                data    =  timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
         
@@ -575,24 +565,22 @@ class AdminOrderListAPIView(GenericAPIView):
     serializer_class = serializers.AdminOrderListSerializer
     pagination_class = DefaultPagination
 
-    @swagger_auto_schema(tags=["Admin"], request_body=None,responses={200 : OrderListSuccessResponseSerializer,
-                                                                      500 : ErrorResponseSerializer,
-                                                                      400 : ErrorResponseSerializer
-                                                                     }
+    @swagger_auto_schema(tags=["Admin"], request_body=None,
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
+                         responses = {200 : OrderListSuccessResponseSerializer,
+                                      500 : ErrorResponseSerializer,
+                                      400 : ErrorResponseSerializer
+                                     }
                         )
     def get(self,request):
-        orders = self.queryset.order_by('-created_at')
+        orders = self.queryset.select_related("user").order_by('-created_at')
 
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(orders,request)
 
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next" : paginator.get_next_link(),
-                          "previous" : paginator.get_previous_link(),
-                          "results" : serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Order List fetched successfuly.",
                                 data    = paginated_data,
@@ -629,7 +617,7 @@ class AdminOrderDetailAPIView(GenericAPIView):
         serializer = self.get_serializer(order_instance)
 
         return success_response(message = "Order details fetched successfuly.",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     
@@ -678,10 +666,12 @@ class AdminOrderPaymentHistoryAPIView(GenericAPIView):
     pagination_class = DefaultPagination
     lookup_field = "order_id"
 
-    @swagger_auto_schema(tags=["Admin"], responses={200 : AdminOrderPaymentHistorySuccessResponseSerializer,
-                                                    500 : ErrorResponseSerializer,
-                                                    404 : ErrorResponseSerializer
-                                                   }
+    @swagger_auto_schema(tags=["Admin"], request_body=None,
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
+                         responses = {200 : AdminOrderPaymentHistorySuccessResponseSerializer,
+                                      500 : ErrorResponseSerializer,
+                                      404 : ErrorResponseSerializer
+                                     }
                         )
     def get(self,request,order_id):
         try:
@@ -699,11 +689,7 @@ class AdminOrderPaymentHistoryAPIView(GenericAPIView):
 
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
 
         return success_response(message = "Order payment records fetched successfuly.",
                                 data    =  paginated_data,
@@ -751,3 +737,19 @@ class MarkOrderItemReturnedApiView(GenericAPIView):
                                   status_code = status.HTTP_400_BAD_REQUEST
                                  )
 
+
+
+
+
+class AdminQueryStatsAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated,IsAdminUser]
+
+    @swagger_auto_schema(tags=["Admin"], request_body=None, responses={200 : QueryStatsSuccessResponseSerializer,
+                                                                       500 : ErrorResponseSerializer
+                                                                      }
+                        )
+    def get(self,request):
+        return success_response(message = "Query stats fetched successfuly.",
+                                data    = {"endpoints":get_query_stats()},
+                                status_code = status.HTTP_200_OK
+                               )
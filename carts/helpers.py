@@ -0,0 +1,130 @@
+from django.db import connection
+from django.utils import timezone
+from carts import models as carts_models
+from products import models as products_models
+from decimal import Decimal
+
+
+
+# writes cart lines for {product id: quantity} with one statement:
+#   INSERT INTO cart ... SELECT ... FROM lines JOIN product WHERE product is active AND stock >= quantity
+#   ON CONFLICT (user, product) DO UPDATE SET quantity = cart.quantity + excluded.quantity, total_price = ...
+#   WHERE the new quantity <= product stock
+# the row lock taken by ON CONFLICT serialises concurrent adds of the same product, so none of them is lost
+# and the stock guard is checked against the quantity that is actually written. with increment=False the
+# quantity is replaced instead of added to. existing rows keep their unit_price, total_price is computed in
+# the same statement.
+# returns {product id: (cart id, quantity, unit_price, total_price)} for the lines that were written, a line
+# missing from it failed the stock guard or names an inactive product.
+
+def upsert_cart_items(user,quantities,increment=True):
+    quantities = {product_id:quantity for product_id,quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return {}
+
+    cart    = connection.ops.quote_name(carts_models.CartModel._meta.db_table)
+    product = connection.ops.quote_name(products_models.ProductModel._meta.db_table)
+
+    new_quantity = "cart.quantity + EXCLUDED.quantity" if increment else "EXCLUDED.quantity"
+
+    lines  = ", ".join(["(CAST(%s AS BIGINT), CAST(%s AS INTEGER))"] * len(quantities))
+    params = [value for product_id in sorted(quantities) for value in (product_id,quantities[product_id])]
+    now    = timezone.now()
+
+    sql = f"""
+        WITH line (product_id, quantity) AS (VALUES {lines})
+        INSERT INTO {cart} AS cart (user_id, product_id, unit_price, quantity, total_price, product_version, created_at, updated_at)
+        SELECT %s, product.id, product.price, line.quantity, product.price * line.quantity, product.version, %s, %s
+          FROM line JOIN {product} AS product ON product.id = line.product_id
+         WHERE product.is_active AND product.stock >= line.quantity
+        ON CONFLICT (user_id, product_id) DO UPDATE
+           SET quantity    = {new_quantity},
+               total_price = cart.unit_price * ({new_quantity}),
+               updated_at  = EXCLUDED.updated_at
+         WHERE {new_quantity} <= (SELECT stock FROM {product} WHERE id = EXCLUDED.product_id)
+        RETURNING product_id, id, quantity, unit_price, total_price
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [user.id, now, now])
+        rows = cursor.fetchall()
+
+    return {product_id:(cart_id, quantity, _decimal(unit_price), _decimal(total_price)) for product_id,cart_id,quantity,unit_price,total_price in rows}
+
+
+
+# writes a cart snapshot {product id: (quantity, unit_price, product_version, created_at, updated_at)} with one
+# upsert on (user, product):
+#   INSERT INTO cart ... SELECT ... FROM lines JOIN product ON CONFLICT (user, product) DO UPDATE SET ...
+# the rows keep the timestamps of the lines (bulk_create would stamp them with now), lines whose product no
+# longer exists are skipped. returns the product ids written.
+
+def write_cart_lines(user_id,lines):
+    if not lines:
+        return set()
+
+    cart    = connection.ops.quote_name(carts_models.CartModel._meta.db_table)
+    product = connection.ops.quote_name(products_models.ProductModel._meta.db_table)
+
+    values = ", ".join(["(CAST(%s AS BIGINT), CAST(%s AS INTEGER), CAST(%s AS NUMERIC(10,2)), CAST(%s AS INTEGER), %s, %s)"] * len(lines))
+    params = [value for product_id in sorted(lines)
+                    for value in (product_id, lines[product_id][0], lines[product_id][1], lines[product_id][2],
+                                  connection.ops.adapt_datetimefield_value(lines[product_id][3]),
+                                  connection.ops.adapt_datetimefield_value(lines[product_id][4])
+                                 )
+             ]
+
+    sql = f"""
+        WITH line (product_id, quantity, unit_price, product_version, created_at, updated_at) AS (VALUES {values})
+        INSERT INTO {cart} AS cart (user_id, product_id, unit_price, quantity, total_price, product_version, created_at, updated_at)
+        SELECT %s, product.id, line.unit_price, line.quantity, line.unit_price * line.quantity, line.product_version, line.created_at, line.updated_at
+          FROM line JOIN {product} AS product ON product.id = line.product_id
+         WHERE true     -- sqlite reads an ON CONFLICT straight after the join as part of it
+        ON CONFLICT (user_id, product_id) DO UPDATE
+           SET unit_price      = EXCLUDED.unit_price,
+               quantity        = EXCLUDED.quantity,
+               total_price     = EXCLUDED.total_price,
+               product_version = EXCLUDED.product_version,
+               updated_at      = EXCLUDED.updated_at
+        RETURNING product_id
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [user_id])
+        return {product_id for product_id, in cursor.fetchall()}
+
+
+
+# sqlite hands decimals back as floats
+def _decimal(value):
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+
+# reprices the user's cart lines whose product changed since they were priced, found by comparing version stamps
+# in the same statement:
+#   UPDATE cart SET unit_price = product.price, total_price = product.price * cart.quantity, product_version = product.version
+#     FROM product WHERE product.id = cart.product_id AND cart.user_id = %s AND cart.product_version <> product.version
+# a cart with nothing stale costs one indexed read and writes no row.
+# returns {product id: (unit_price, total_price)} for the lines that were repriced.
+
+def reprice_stale_items(user):
+    cart    = connection.ops.quote_name(carts_models.CartModel._meta.db_table)
+    product = connection.ops.quote_name(products_models.ProductModel._meta.db_table)
+
+    sql = f"""
+        UPDATE {cart} AS cart
+           SET unit_price      = product.price,
+               total_price     = product.price * cart.quantity,
+               product_version = product.version,
+               updated_at      = %s
+          FROM {product} AS product
+         WHERE product.id = cart.product_id AND cart.user_id = %s AND cart.product_version <> product.version
+        RETURNING product_id, unit_price, total_price
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [timezone.now(), user.id])
+        rows = cursor.fetchall()
+
+    return {product_id:(_decimal(unit_price), _decimal(total_price)) for product_id,unit_price,total_price in rows}
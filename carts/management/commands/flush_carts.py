@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from carts.storage import cart_storage
+import logging
+import signal
+import threading
+import time
+
+
+
+logger = logging.getLogger("carts")
+
+
+
+class Command(BaseCommand):
+    help = ("Writes the carts changed in redis back to CartModel (RedisCartStorage). Drains the dirty set once "
+            "by default, --loop keeps flushing every --interval seconds until stopped.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--loop", action="store_true", help="keep flushing every --interval seconds until stopped")
+        parser.add_argument("--interval", type=float, default=1)
+
+
+    def drain(self,batch_size):
+        flushed = failed = 0
+        while True:
+            started = time.perf_counter()
+            batch_flushed,batch_failed = cart_storage.flush_dirty(batch_size)
+
+            flushed += batch_flushed
+            failed  += batch_failed
+
+            if batch_flushed or batch_failed:
+                logger.info("cart flush flushed=%s failed=%s duration_ms=%.1f", batch_flushed, batch_failed, (time.perf_counter() - started) * 1000)
+
+            # failed carts went back into the dirty set, they wait for the next pass
+            if batch_flushed + batch_failed < batch_size or batch_failed:
+                return flushed,failed
+
+
+    def handle(self,*args,**options):
+        if not hasattr(cart_storage,"flush_dirty"):
+            raise CommandError(f"{cart_storage.__class__.__name__} writes CartModel directly, there is nothing to flush.")
+
+        if cart_storage.write_through:
+            raise CommandError("CART_REDIS_URL is unset, every web process keeps its carts in its own fakeredis and writes "
+                               "them back as they change. there is nothing this process could flush.")
+
+        stopping = threading.Event()
+        if options["loop"]:
+            signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+        flushed = failed = 0
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    batch_flushed,batch_failed = self.drain(options["batch_size"])
+                    flushed += batch_flushed
+                    failed  += batch_failed
+                except Exception:     # redis or the database went away, the carts stay dirty
+                    logger.exception("cart flush pass failed")
+                    if not options["loop"]:
+                        raise
+
+                if not options["loop"] or stopping.wait(options["interval"]):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f"flushed {flushed} carts, {failed} failed"))
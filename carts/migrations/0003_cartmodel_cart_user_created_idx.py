@@ -0,0 +1,20 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0002_alter_cartmodel_updated_at'),
+        ('products', '0007_productmodel_product_active_created_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartmodel',
+            index=models.Index(fields=['user', '-created_at'], name='cart_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.9 on 2026-10-18 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0003_cartmodel_cart_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartmodel',
+            name='product_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
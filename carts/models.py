@@ -13,6 +13,8 @@ class CartModel(models.Model):
     quantity    = models.PositiveIntegerField(default=1, null=False, blank=False)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, null=False, blank=False)
 
+    product_version = models.PositiveIntegerField(default=0)     # ProductModel.version unit_price was taken at, 0 = unknown
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -33,4 +35,9 @@ class CartModel(models.Model):
                                     fields=["user","product"]
                                     )
         ]
+        indexes = [
+            models.Index(name="cart_user_created_idx",
+                         fields=["user","-created_at"]
+                        )
+        ]
     
\ No newline at end of file
@@ -5,6 +5,7 @@ from rest_framework.validators import UniqueTogetherValidator
 from django.db.utils import IntegrityError
 from django.db import transaction
 from products import serializers as products_serializers
+from carts.storage import cart_storage
 
 
 
@@ -26,45 +27,24 @@ class AddToCartSerializer(serializers.ModelSerializer):
         return value
         
 
-    def validate(self,attrs):
+    # the stock check runs inside the upsert, against the quantity the cart line ends up with
+    def create(self, validated_data):
         request = self.context["request"]
 
-        product  = attrs.get('product')
-        quantity = attrs.get('quantity')
-
-        existing_cart_quantity = 0
+        product  = validated_data['product']
+        quantity = validated_data['quantity']
 
-        existing_cart_instance = carts_models.CartModel.objects.filter(user=request.user,product=product).first()
-        if existing_cart_instance is not None:
-            existing_cart_quantity = existing_cart_instance.quantity
+        cart_item = cart_storage.upsert(request.user,{product.id:product},{product.id:quantity}).get(product.id)
 
-        if quantity + existing_cart_quantity > product.stock:
+        if cart_item is None:
             raise serializers.ValidationError({"error_message":"Insufficient stock.",
                                                "data":{"quantity":quantity,
                                                        "product_id":product.id,
                                                        "existing_stock":product.stock
                                                       }
-                                              }) 
-
-        return attrs
-    
-
-    def create(self, validated_data):
-        request = self.context["request"]
-        
-        product =validated_data['product']
-
-        cart_instance,created = carts_models.CartModel.objects.get_or_create(user=request.user,product=product,
-                                                                             defaults={"unit_price":product.price,
-                                                                                       "quantity":validated_data['quantity'],
-                                                                                       }
-                                                                            )
+                                              })
 
-        if not created:
-            cart_instance.quantity = cart_instance.quantity + validated_data['quantity']
-            cart_instance.save()
-        
-        return cart_instance
+        return cart_item
 
 
 
@@ -114,8 +94,19 @@ class UpdateCartQuantitySerializer(serializers.ModelSerializer):
         return attrs
     
     def update(self, instance, validated_data):
+        request = self.context["request"]
+
+        cart_item = cart_storage.upsert(request.user,{instance.product_id:instance.product},{instance.product_id:validated_data["quantity"]},increment=False).get(instance.product_id)
 
-        return super().update(instance, validated_data)
+        if cart_item is None:
+            raise serializers.ValidationError({"error_message":"insufficient stock.",
+                                               "data":{"cart_id":instance.id,
+                                                       "quantity":validated_data["quantity"],
+                                                       "existing_stock":instance.product.stock
+                                                      }
+                                              })
+
+        return cart_item
     
         
 
@@ -133,4 +124,117 @@ class CartNestedSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = carts_models.CartModel
-        fields = ["product_id","product_name","brand_name","category_name","product_slug","brand_slug","category_slug","unit_price","quantity","total_price"]
\ No newline at end of file
+        fields = ["product_id","product_name","brand_name","category_name","product_slug","brand_slug","category_slug","unit_price","quantity","total_price"]
+
+
+
+class BulkCartLineSerializer(serializers.Serializer):
+    ACTION_CHOICES = [("add","Add"),
+                      ("set","Set"),
+                      ("remove","Remove"),
+                     ]
+
+    product  = serializers.IntegerField(min_value=1, required=True)
+    action   = serializers.ChoiceField(choices=ACTION_CHOICES, default="add")
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self,attrs):
+        if attrs["action"] != "remove" and attrs.get("quantity") is None:
+            raise serializers.ValidationError({"quantity":["This field is required."]})
+        return attrs
+
+
+
+
+# add, set or remove up to MAX_LINES cart lines in one request. every line is checked against one fetch of the
+# products and one read of the user's matching cart lines, then the adds and the sets are written with one
+# cart_storage.upsert() each and the removals with one remove(). the upserts check stock again against
+# the lines they write, so a line that lost a race with another request fails instead of overselling. lines
+# that fail are reported, not raised, so the rest of the batch still goes through.
+
+class BulkCartSerializer(serializers.Serializer):
+    MAX_LINES = 100
+
+    items = BulkCartLineSerializer(many=True, allow_empty=False, max_length=MAX_LINES)
+
+
+    def _result(self,index,line,status,quantity=None,message=None,data=None):
+        return {"index":index,
+                "product_id":line["product"],
+                "action":line["action"],
+                "status":status,
+                "quantity":quantity,
+                "message":message,
+                "data":data or {}
+               }
+
+
+    def save(self):
+        request = self.context["request"]
+        lines   = self.validated_data["items"]
+
+        product_ids = {line["product"] for line in lines}
+
+        products = products_models.ProductModel.objects.filter(is_active=True).in_bulk(product_ids)
+        existing = cart_storage.quantities(request.user,product_ids)
+
+        results  = []
+        writes   = {"add":{}, "set":{}}
+        removals = set()
+        seen     = set()
+
+        for index,line in enumerate(lines):
+            product_id = line["product"]
+            product    = products.get(product_id)
+
+            if product_id in seen:
+                results.append(self._result(index, line, "failed", message="Product appears more than once in the request."))
+                continue
+            seen.add(product_id)
+
+            if line["action"] == "remove":
+                if product_id not in existing:
+                    results.append(self._result(index, line, "failed", message="Product not in cart."))
+                    continue
+
+                removals.add(product_id)
+                results.append(self._result(index, line, "applied", quantity=0))
+                continue
+
+            if product is None:
+                results.append(self._result(index, line, "failed", message="Invalid product."))
+                continue
+
+            quantity = line["quantity"]
+            if line["action"] == "add":
+                quantity += existing.get(product_id,0)
+
+            if quantity > product.stock:
+                results.append(self._result(index, line, "failed", message="Insufficient stock.",
+                                            data={"quantity":quantity, "existing_stock":product.stock}
+                                           ))
+                continue
+
+            writes[line["action"]][product_id] = line["quantity"]
+            results.append(self._result(index, line, "applied"))
+
+
+        with transaction.atomic():
+            written = {**cart_storage.upsert(request.user, products, writes["add"]),
+                       **cart_storage.upsert(request.user, products, writes["set"], increment=False)
+                      }
+
+            if removals:
+                cart_storage.remove(request.user,removals)
+
+
+        for result in results:
+            if result["status"] != "applied" or result["action"] == "remove":
+                continue
+
+            if result["product_id"] in written:
+                result["quantity"] = written[result["product_id"]].quantity
+            else:
+                result.update(status="failed", message="Insufficient stock.", data={"existing_stock":products[result["product_id"]].stock})
+
+        return results
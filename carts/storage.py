@@ -0,0 +1,341 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from carts import models as carts_models
+from carts.helpers import upsert_cart_items, reprice_stale_items, write_cart_lines
+from products import models as products_models
+from contextlib import contextmanager
+from decimal import Decimal
+import json
+import logging
+import time
+import uuid
+
+
+
+logger = logging.getLogger("carts")
+
+
+
+# cart storage backends. the cart views and serializers only talk to cart_storage, lines are addressed by
+# product id (one line per product and user) and handed back as CartModel instances, saved or not.
+#   items(user)                                 -> the user's lines with product, brand and category, newest first, stale lines repriced
+#   item(user,id)                               -> the line the api calls id, None when it is not in the cart
+#   quantities(user,product_ids)                -> {product id: quantity in the cart}
+#   upsert(user,products,quantities,increment)  -> {product id: line} for the lines written, a missing line failed the stock check
+#   remove(user,product_ids)
+#   reprice(user)                               -> product ids of the lines repriced because their product version moved on
+#   sync(user)                                  -> CartModel holds the user's cart once this returns
+#   discard(user,lines)                         -> checkout took {product id: quantity} out of CartModel
+
+
+
+class DatabaseCartStorage:
+
+    def items(self,user):
+        reprice_stale_items(user)
+        return carts_models.CartModel.objects.filter(user=user).select_related("product","product__brand","product__category").order_by('-created_at')
+
+
+    def item(self,user,id):
+        return carts_models.CartModel.objects.select_related("product").filter(id=id,user=user).first()
+
+
+    def quantities(self,user,product_ids):
+        return dict(carts_models.CartModel.objects.filter(user=user,product_id__in=product_ids).values_list("product_id","quantity"))
+
+
+    def upsert(self,user,products,quantities,increment=True):
+        written = upsert_cart_items(user,quantities,increment)
+
+        return {product_id:carts_models.CartModel(id=cart_id, user=user, product=products[product_id], quantity=quantity,
+                                                  unit_price=unit_price, total_price=total_price
+                                                 )
+                for product_id,(cart_id,quantity,unit_price,total_price) in written.items()
+               }
+
+
+    def remove(self,user,product_ids):
+        carts_models.CartModel.objects.filter(user=user,product_id__in=product_ids).delete()
+
+
+    def reprice(self,user):
+        return set(reprice_stale_items(user))
+
+
+    def sync(self,user):
+        pass
+
+
+    def discard(self,user,lines):
+        pass
+
+
+
+
+# active carts as one redis hash per user, {product id: json line} plus a marker field so an empty cart is
+# cached too. a cart missing from redis is loaded from CartModel by the first request that touches it.
+# every write is a WATCH/MULTI transaction on the hash (retried when another request wrote it meanwhile) and
+# puts the user in the dirty set, flush() writes the hash back to CartModel under a per user lock and
+# flush_dirty() drains the dirty set (the flush_carts command). the api id of a line is its product id,
+# rows written behind get their database ids only when they are inserted.
+# the stock check runs against the product the request loaded, checkout reserves stock against the database.
+
+class RedisCartStorage:
+    MARKER = "_"
+
+    # a process local fakeredis is invisible to flush_carts, every change is written back to CartModel right away
+    def __init__(self,client=None):
+        self.write_through = False
+
+        if client is not None:
+            self.client = client
+        elif settings.CART_REDIS_URL:
+            import redis
+            self.client = redis.Redis.from_url(settings.CART_REDIS_URL, decode_responses=True)
+        else:
+            try:
+                import fakeredis
+            except ImportError:
+                raise ImproperlyConfigured("RedisCartStorage needs CART_REDIS_URL, or fakeredis installed as a local stand-in.")
+            self.client = fakeredis.FakeRedis(decode_responses=True)     # process local, one web process only
+            self.write_through = True
+
+        self.prefix = settings.CART_REDIS_PREFIX
+        self.dirty  = f"{self.prefix}:dirty"
+
+
+    def _key(self,user_id):
+        return f"{self.prefix}:{user_id}"
+
+
+    def _decode(self,raw):
+        return {int(field):json.loads(value) for field,value in raw.items() if field != self.MARKER}
+
+
+    def _load(self,user_id):
+        rows = carts_models.CartModel.objects.filter(user_id=user_id).values_list("product_id","quantity","unit_price","product_version","created_at","updated_at")
+
+        return {product_id:{"quantity":quantity,
+                            "unit_price":str(unit_price),
+                            "product_version":product_version,
+                            "created_at":created_at.isoformat(),
+                            "updated_at":updated_at.isoformat()
+                           } for product_id,quantity,unit_price,product_version,created_at,updated_at in rows
+               }
+
+
+    def _line(self,user,product,line):
+        unit_price = Decimal(line["unit_price"])
+
+        return carts_models.CartModel(id=product.id, user=user, product=product, unit_price=unit_price, quantity=line["quantity"],
+                                      total_price=unit_price * line["quantity"], product_version=line.get("product_version",0),
+                                      created_at=parse_datetime(line["created_at"]), updated_at=parse_datetime(line["updated_at"])
+                                     )
+
+
+    # change(lines) -> (result, {product id: line} to write, product ids to delete)
+    def _update(self,user_id,change):
+        key = self._key(user_id)
+
+        def apply(pipe):
+            raw    = pipe.hgetall(key)
+            lines  = self._decode(raw) if raw else self._load(user_id)
+
+            result,written,removed = change(lines)
+
+            pipe.multi()
+            if not raw:
+                lines.update(written)
+                pipe.hset(key, mapping={self.MARKER:1, **{product_id:json.dumps(line) for product_id,line in lines.items() if product_id not in removed}})
+            else:
+                if written:
+                    pipe.hset(key, mapping={product_id:json.dumps(line) for product_id,line in written.items()})
+                if removed:
+                    pipe.hdel(key, *removed)
+
+            pipe.expire(key, settings.CART_REDIS_TTL)
+            if written or removed:
+                pipe.sadd(self.dirty, user_id)
+
+            return result
+
+        result = self.client.transaction(apply, key, value_from_callable=True)
+
+        if self.write_through and self.client.sismember(self.dirty, user_id):
+            self.flush(user_id)
+
+        return result
+
+
+    def _lines(self,user_id):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(self._key(user_id))
+        pipe.expire(self._key(user_id), settings.CART_REDIS_TTL)
+        raw,_ = pipe.execute()
+
+        if raw:
+            return self._decode(raw)
+        return self._update(user_id, lambda lines: (lines,{},[]))
+
+
+    # {product id: product} -> the lines whose product_version differs, rewritten at the current price in one transaction
+    def _reprice(self,user_id,products):
+        now = timezone.now().isoformat()
+
+        def change(lines):
+            written = {product_id:{**line, "unit_price":str(products[product_id].price), "product_version":products[product_id].version, "updated_at":now}
+                       for product_id,line in lines.items()
+                       if product_id in products and line.get("product_version",0) != products[product_id].version
+                      }
+            return written,written,[]
+
+        return self._update(user_id,change)
+
+
+    def items(self,user):
+        lines    = self._lines(user.id)
+        products = products_models.ProductModel.objects.select_related("brand","category").in_bulk(list(lines))
+
+        if any(line.get("product_version",0) != products[product_id].version for product_id,line in lines.items() if product_id in products):
+            lines.update(self._reprice(user.id,products))
+
+        items = [self._line(user,products[product_id],line) for product_id,line in lines.items() if product_id in products]
+        items.sort(key=lambda item: (item.created_at,item.id), reverse=True)
+        return items
+
+
+    def item(self,user,id):
+        line = self._lines(user.id).get(id)
+        if line is None:
+            return None
+
+        product = products_models.ProductModel.objects.filter(id=id).first()
+        return self._line(user,product,line) if product else None
+
+
+    def quantities(self,user,product_ids):
+        lines = self._lines(user.id)
+        return {product_id:lines[product_id]["quantity"] for product_id in product_ids if product_id in lines}
+
+
+    # same rules as upsert_cart_items(): a new line needs an active product, every line needs the stock
+    def upsert(self,user,products,quantities,increment=True):
+        now = timezone.now().isoformat()
+
+        def change(lines):
+            written = {}
+            for product_id,quantity in quantities.items():
+                product  = products[product_id]
+                line     = lines.get(product_id)
+                existing = line["quantity"] if line and increment else 0
+
+                if quantity <= 0 or existing + quantity > product.stock or (line is None and not product.is_active):
+                    continue
+
+                written[product_id] = {"quantity":existing + quantity,
+                                       "unit_price":line["unit_price"] if line else str(product.price),
+                                       "product_version":line.get("product_version",0) if line else product.version,
+                                       "created_at":line["created_at"] if line else now,
+                                       "updated_at":now
+                                      }
+            return written,written,[]
+
+        written = self._update(user.id,change)
+        return {product_id:self._line(user,products[product_id],line) for product_id,line in written.items()}
+
+
+    def remove(self,user,product_ids):
+        self._update(user.id, lambda lines: (None,{},[product_id for product_id in product_ids if product_id in lines]))
+
+
+    def reprice(self,user):
+        lines    = self._lines(user.id)
+        products = products_models.ProductModel.objects.only("id","price","version").in_bulk(list(lines))
+
+        return set(self._reprice(user.id,products))
+
+
+    def sync(self,user):
+        self.flush(user.id)
+
+
+    # lines changed since checkout read them stay in the cart and are written back as new rows
+    def discard(self,user,lines):
+        self._update(user.id, lambda current: (None,{},[product_id for product_id,quantity in lines.items()
+                                                        if product_id in current and current[product_id]["quantity"] == quantity
+                                                       ]))
+
+
+    # SET NX with a token, released with a WATCH/MULTI compare and delete so it needs no lua (fakeredis has none
+    # without lupa). the expiry frees the lock of a process that died holding it.
+    @contextmanager
+    def _locked(self,user_id):
+        key      = f"{self.prefix}:lock:{user_id}"
+        token    = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.CART_SYNC_LOCK_TIMEOUT
+
+        while not self.client.set(key, token, nx=True, ex=settings.CART_SYNC_LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"cart of user {user_id} is locked by another flush")
+            time.sleep(0.01)
+
+        def release(pipe):
+            if pipe.get(key) == token:
+                pipe.multi()
+                pipe.delete(key)
+
+        try:
+            yield
+        finally:
+            self.client.transaction(release, key)
+
+
+    # writes the user's hash to CartModel with write_cart_lines(), lines keep their own timestamps, and deletes the
+    # rows of lines that are gone. the snapshot is read under the lock, so flushes of the same cart land in order.
+    def flush(self,user_id):
+        with self._locked(user_id):
+            self.client.srem(self.dirty, user_id)
+
+            raw = self.client.hgetall(self._key(user_id))
+            if not raw:     # not cached, CartModel is already current
+                return 0
+
+            lines = {product_id:(line["quantity"], Decimal(line["unit_price"]), line.get("product_version",0),
+                                 parse_datetime(line["created_at"]), parse_datetime(line["updated_at"])
+                                ) for product_id,line in self._decode(raw).items()
+                    }
+
+            try:
+                with transaction.atomic():
+                    written = write_cart_lines(user_id,lines)
+                    carts_models.CartModel.objects.filter(user_id=user_id).exclude(product_id__in=written).delete()
+
+            except Exception:
+                self.client.sadd(self.dirty, user_id)
+                raise
+
+        return len(written)
+
+
+    # flushes up to batch_size dirty carts, returns (flushed, failed)
+    def flush_dirty(self,batch_size=100):
+        flushed = failed = 0
+
+        for user_id in self.client.spop(self.dirty, batch_size) or []:
+            try:
+                self.flush(int(user_id))
+                flushed += 1
+            except Exception:
+                logger.exception("Cart flush failed for user %s, it stays dirty", user_id)
+                failed += 1
+
+        return flushed,failed
+
+
+
+
+cart_storage = import_string(settings.CART_STORAGE_BACKEND)()
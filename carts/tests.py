@@ -1,3 +1,226 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction, IntegrityError
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from carts import models as carts_models
+from carts.helpers import upsert_cart_items, reprice_stale_items
+from carts.storage import RedisCartStorage
+from orders.tests import create_product
+from products import models as product_models
+import threading
 
-# Create your tests here.
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+
+# clients adding single units of the same product to the same cart at once: every add that reports a written
+# line is in the quantity, and the quantity never goes past the stock. sqlite has no row locks and serialises
+# every write, nothing to race there.
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentCartAddTests(TransactionTestCase):
+    THREADS = 8
+    ADDS    = 25
+
+
+    def setUp(self):
+        self.user    = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        self.product = create_product("Hammer", price=100, stock=0)
+
+
+    def race(self,stock):
+        product_models.ProductModel.objects.filter(id=self.product.id).update(stock=stock)
+
+        barrier = threading.Barrier(self.THREADS)
+
+        def client(index):
+            written = 0
+            barrier.wait()
+            try:
+                for _ in range(self.ADDS):
+                    written += self.product.id in upsert_cart_items(self.user,{self.product.id:1})
+            finally:
+                connection.close()
+            return written
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            written = sum(pool.map(client, range(self.THREADS)))
+
+        return written,carts_models.CartModel.objects.get(user=self.user, product=self.product)
+
+
+    def test_no_increment_is_lost(self):
+        requested = self.THREADS * self.ADDS
+        written,cart_item = self.race(stock=requested * 2)
+
+        self.assertEqual(written,requested)
+        self.assertEqual(cart_item.quantity,requested)
+        self.assertEqual(cart_item.total_price,cart_item.unit_price * requested)
+
+
+    def test_stock_guard_holds(self):
+        stock = self.THREADS * self.ADDS // 2
+        written,cart_item = self.race(stock=stock)
+
+        self.assertEqual(written,stock)
+        self.assertEqual(cart_item.quantity,stock)
+        self.assertEqual(cart_item.total_price,cart_item.unit_price * stock)
+
+
+
+
+# a product write is one UPDATE that bumps its version, the next cart read reprices the line in one more statement
+
+class CartRepriceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user    = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        cls.product = create_product("Hammer", price=100, stock=10)
+        upsert_cart_items(cls.user,{cls.product.id:2})
+
+
+    def test_price_change_reprices_the_line(self):
+        self.product.price = Decimal("150.00")
+        with self.assertNumQueries(1):
+            self.product.save(update_fields=["price"])
+
+        self.assertEqual(self.product.version,2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(reprice_stale_items(self.user),{self.product.id:(Decimal("150.00"),Decimal("300.00"))})
+
+        with self.assertNumQueries(1):     # nothing stale, nothing written
+            self.assertEqual(reprice_stale_items(self.user),{})
+
+        cart_item = carts_models.CartModel.objects.get(user=self.user)
+        self.assertEqual((cart_item.unit_price,cart_item.total_price,cart_item.product_version),(Decimal("150.00"),Decimal("300.00"),2))
+
+
+    def test_cart_list_reprices_within_its_budget(self):
+        self.product.price = Decimal("80.00")
+        self.product.save()
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        # reprice, COUNT(*) and the page with product, brand and category
+        with self.assertNumQueries(3):
+            response = client.get("/api/cart/")
+
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(Decimal(response.json()["data"]["results"][0]["unit_price"]),Decimal("80.00"))
+
+
+    def test_failed_save_keeps_the_version(self):
+        self.product.stock = -1
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.product.save(update_fields=["stock"])
+
+        self.assertEqual(self.product.version,1)
+
+
+
+
+# the redis cart backend against an in process fakeredis standing in for a shared redis: writes stay in the
+# hash until a flush writes them back to CartModel.
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class RedisCartStorageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user   = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        cls.hammer = create_product("Hammer", price=100, stock=10)
+        cls.wrench = create_product("Wrench", price=50, stock=10)
+
+
+    def setUp(self):
+        self.storage  = RedisCartStorage(client=fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True))
+        self.products = {self.hammer.id:self.hammer, self.wrench.id:self.wrench}
+
+
+    def upsert(self,quantities,increment=True):
+        return self.storage.upsert(self.user,self.products,quantities,increment)
+
+
+    def is_dirty(self):
+        return self.storage.client.sismember(self.storage.dirty, self.user.id)
+
+
+    def test_upsert(self):
+        self.assertEqual(self.upsert({self.hammer.id:2})[self.hammer.id].quantity,2)
+        self.assertEqual(self.upsert({self.hammer.id:3})[self.hammer.id].quantity,5)
+        self.assertEqual(self.upsert({self.hammer.id:6}),{})     # 11 is past the stock
+        self.assertEqual(self.upsert({self.hammer.id:1},increment=False)[self.hammer.id].quantity,1)
+
+        self.assertEqual(self.storage.quantities(self.user,[self.hammer.id,self.wrench.id]),{self.hammer.id:1})
+        self.assertTrue(self.is_dirty())
+        self.assertFalse(carts_models.CartModel.objects.exists())     # written behind
+
+
+    def test_reprice(self):
+        self.upsert({self.hammer.id:2, self.wrench.id:1})
+
+        self.hammer.price = Decimal("120.00")
+        self.hammer.save(update_fields=["price"])
+
+        self.assertEqual(self.storage.reprice(self.user),{self.hammer.id})
+        self.assertEqual(self.storage.reprice(self.user),set())
+
+        line = {item.product_id:item for item in self.storage.items(self.user)}[self.hammer.id]
+        self.assertEqual((line.unit_price,line.total_price,line.product_version),(Decimal("120.00"),Decimal("240.00"),self.hammer.version))
+
+
+    def test_discard(self):
+        self.upsert({self.hammer.id:2, self.wrench.id:1})
+
+        # checkout read 1 wrench, another request added one more meanwhile: that line stays
+        self.upsert({self.wrench.id:1})
+        self.storage.discard(self.user,{self.hammer.id:2, self.wrench.id:1})
+
+        self.assertEqual(self.storage.quantities(self.user,[self.hammer.id,self.wrench.id]),{self.wrench.id:2})
+
+
+    def test_flush(self):
+        added_at = timezone.now() - timedelta(days=3)
+        upsert_cart_items(self.user,{self.hammer.id:1})
+        carts_models.CartModel.objects.filter(user=self.user).update(created_at=added_at, updated_at=added_at)
+
+        self.upsert({self.wrench.id:2})
+        lines = {item.product_id:item for item in self.storage.items(self.user)}
+
+        self.assertEqual(self.storage.flush(self.user.id),2)
+        self.assertFalse(self.is_dirty())
+
+        rows = {row.product_id:row for row in carts_models.CartModel.objects.filter(user=self.user)}
+        self.assertEqual(rows[self.hammer.id].created_at,added_at)
+        self.assertEqual(rows[self.hammer.id].updated_at,added_at)
+        self.assertEqual(rows[self.wrench.id].created_at,lines[self.wrench.id].created_at)
+        self.assertEqual((rows[self.wrench.id].quantity,rows[self.wrench.id].total_price),(2,Decimal("100.00")))
+
+        self.storage.remove(self.user,[self.hammer.id])
+        self.storage.flush(self.user.id)
+        self.assertEqual(list(carts_models.CartModel.objects.filter(user=self.user).values_list("product_id",flat=True)),[self.wrench.id])
+
+
+    @override_settings(CART_REDIS_URL=None)
+    def test_process_local_redis_writes_through(self):
+        storage = RedisCartStorage()
+        storage.upsert(self.user,self.products,{self.hammer.id:2})
+
+        self.assertEqual(carts_models.CartModel.objects.get(user=self.user).quantity,2)
+
+        with mock.patch("carts.management.commands.flush_carts.cart_storage", storage):
+            with self.assertRaises(CommandError):
+                call_command("flush_carts")
@@ -5,6 +5,7 @@ from carts import views
 
 urlpatterns = [
     path('', views.CartListCreateAPIView.as_view(), name="list-add-to-cart"),
+    path('bulk/', views.CartBulkAPIView.as_view(), name="bulk-update-cart"),
     path('<int:id>/',views.CartItemAPIView.as_view(), name="delete-cart-item"),
     path('<int:id>/quantity/',views.CartItemQuantityAPIView.as_view(), name="update-cart-quantity"),
 ]
\ No newline at end of file
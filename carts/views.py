@@ -2,14 +2,16 @@ from django.shortcuts import render
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import AllowAny,IsAuthenticated
 from carts import serializers
-from carts import models as cart_models
+from carts.storage import cart_storage
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.response import Response
 from rest_framework import status
 from common.pagination import DefaultPagination
+from common.swagger import PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM
 from common.helpers import success_response,error_response,normalize_validation_errors
+from common.instrumentation import timed_data
 from rest_framework import serializers as drf_serializers
-from common.schemas import SuccessResponseSerializer,ErrorResponseSerializer,AddToCartSuccessResponseSerializer,CartListSuccessResponseSerializer,CartItemDeleteSuccessResponseSerializer,UpdateCartQuantitySuccessResponseSerializer
+from common.schemas import SuccessResponseSerializer,ErrorResponseSerializer,AddToCartSuccessResponseSerializer,CartListSuccessResponseSerializer,CartItemDeleteSuccessResponseSerializer,UpdateCartQuantitySuccessResponseSerializer,BulkCartSuccessResponseSerializer
 # Create your views here.
 
 
@@ -49,13 +51,15 @@ class CartListCreateAPIView(GenericAPIView):
                                  )
     
 
-    @swagger_auto_schema(tags=["Cart"], request_body=None, responses = {200 : CartListSuccessResponseSerializer,
-                                                                        400 : ErrorResponseSerializer,
-                                                                        500 : ErrorResponseSerializer
-                                                                       }
+    @swagger_auto_schema(tags=["Cart"], request_body=None,
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
+                         responses = {200 : CartListSuccessResponseSerializer,
+                                      400 : ErrorResponseSerializer,
+                                      500 : ErrorResponseSerializer
+                                     }
                         )
     def get(self,request):
-        cart_items = cart_models.CartModel.objects.filter(user=request.user).select_related("product","product__brand","product__category").order_by('-created_at')
+        cart_items = cart_storage.items(request.user)
 
         paginator = self.pagination_class() 
         page = paginator.paginate_queryset(cart_items,request)
@@ -63,11 +67,7 @@ class CartListCreateAPIView(GenericAPIView):
 
         serializer = self.get_serializer(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Cart items fetched successfuly.",
                                 data    = paginated_data,
@@ -88,15 +88,15 @@ class CartItemAPIView(GenericAPIView):
                                                                         }
                         )
     def delete(self,request,id):
-        try:
-            cart_item = cart_models.CartModel.objects.get(id=id,user=request.user)
-        except cart_models.CartModel.DoesNotExist:
+        cart_item = cart_storage.item(request.user,id)
+
+        if cart_item is None:
             return error_response(message = "Invalid cart id.",
                                   data    = {"cart_id":id},
                                   status_code = status.HTTP_404_NOT_FOUND
                                  )
         
-        cart_item.delete()
+        cart_storage.remove(request.user,[cart_item.product_id])
         return success_response(message = "Crat item deleted successfuly.",
                                 data    = {"cart_id":id},
                                 status_code = status.HTTP_204_NO_CONTENT
@@ -118,9 +118,9 @@ class CartItemQuantityAPIView(GenericAPIView):
                                      }
                         )
     def patch(self,request,id):
-        try:
-            cart_item = cart_models.CartModel.objects.get(id=id,user=request.user)
-        except cart_models.CartModel.DoesNotExist:
+        cart_item = cart_storage.item(request.user,id)
+
+        if cart_item is None:
             return error_response(message = "Invalid Cart id.",
                                   data    = {"cart_id":id},
                                   status_code = status.HTTP_404_NOT_FOUND
@@ -142,4 +142,50 @@ class CartItemQuantityAPIView(GenericAPIView):
             return error_response(message = message,
                                   data    = data,
                                   status_code = status.HTTP_400_BAD_REQUEST
-                                 )
\ No newline at end of file
+                                 )
+
+
+
+
+class CartBulkAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = serializers.BulkCartSerializer
+
+
+    @swagger_auto_schema(tags=["Cart"], request_body=serializers.BulkCartSerializer,
+                         responses = {200 : BulkCartSuccessResponseSerializer,
+                                      400 : ErrorResponseSerializer,
+                                      500 : ErrorResponseSerializer
+                                     }
+                        )
+    def post(self,request):
+        serializer = self.serializer_class(data=request.data, context={"request":request})
+
+        try:
+            serializer.is_valid(raise_exception=True)
+        except drf_serializers.ValidationError as e:
+            message,data = normalize_validation_errors(e.detail)
+
+            return error_response(message = message,
+                                  data    = data,
+                                  status_code = status.HTTP_400_BAD_REQUEST
+                                 )
+
+        results = serializer.save()
+        applied = sum(1 for result in results if result["status"] == "applied")
+        failed  = len(results) - applied
+
+        if not failed:
+            message = "Cart updated successfuly."
+        elif applied:
+            message = "Cart partially updated."
+        else:
+            message = "No cart items were updated."
+
+        return success_response(message = message,
+                                data    = {"applied":applied,
+                                           "failed":failed,
+                                           "results":results
+                                          },
+                                status_code = status.HTTP_200_OK
+                               )
@@ -0,0 +1,139 @@
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from functools import wraps
+import hashlib
+import json
+import time
+
+
+
+GENERATION_KEY = "generation:{}"
+
+PROCESS_LOCAL_BACKENDS = {"django.core.cache.backends.locmem.LocMemCache",
+                          "django.core.cache.backends.dummy.DummyCache"
+                         }
+
+
+
+# False when every process has a cache of its own (no REDIS_URL), a write or a bump there is never seen by the others
+
+def cache_is_shared(alias="default"):
+    return settings.CACHES[alias]["BACKEND"] not in PROCESS_LOCAL_BACKENDS
+
+
+
+# generation counters live in the shared cache. readers embed them in their cache keys, writers bump them,
+# so stale entries are never deleted explicitly, they just stop being addressed and expire.
+# a missing counter is seeded from the clock so it can never go back to a value that is still cached somewhere.
+
+def get_generations(*namespaces):
+    keys  = [GENERATION_KEY.format(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        found.update(cache.get_many(missing))
+
+    return tuple(found.get(key) for key in keys)
+
+
+
+def get_generation(namespace):
+    return get_generations(namespace)[0]
+
+
+
+def _bump(namespaces):
+    for namespace in namespaces:
+        key = GENERATION_KEY.format(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+
+# bumped after commit, bumping inside the transaction would let a concurrent reader cache the old rows again
+
+def bump_generations(*namespaces):
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+
+
+
+def _digest(value):
+    return hashlib.md5(value.encode(), usedforsecurity=False).hexdigest()
+
+
+
+def _etag_matches(request,etag):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+
+    etags = parse_etags(header)
+    if "*" in etags:
+        return True
+
+    return any(candidate.removeprefix("W/") == etag for candidate in etags)
+
+
+
+# caches the 200 responses of a read-only view method under the current generations of the given namespaces,
+# keyed on host, path and the normalized query params. every response carries an ETag and a matching
+# If-None-Match gets an empty 304.
+# live(payload) -> payload refreshes the parts of a cached payload that change too often to invalidate on,
+# the ETag is then taken over what is actually served.
+
+def cached_response(*namespaces,timeout=None,live=None):
+
+    def decorator(view_method):
+
+        @wraps(view_method)
+        def wrapper(self,request,*args,**kwargs):
+            generations = get_generations(*namespaces)
+
+            params = sorted((key,value.strip()) for key in request.query_params
+                                                for value in request.query_params.getlist(key)
+                                                if value.strip()
+                           )
+            key = "response:{}:{}".format(self.__class__.__name__,
+                                           _digest(json.dumps([request.get_host(), request.path, params, generations]))
+                                          )
+
+            entry = cache.get(key)
+
+            if entry is None:
+                response = view_method(self,request,*args,**kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+
+                payload = json.dumps(response.data, cls=DjangoJSONEncoder, sort_keys=True)
+                entry   = {"etag":f'"{_digest(payload)}"',
+                           "data":json.loads(payload)
+                          }
+                cache.set(key, entry, timeout or settings.CATALOG_RESPONSE_CACHE_TIMEOUT)
+
+            elif live is not None:
+                data  = live(entry["data"])
+                entry = {"etag":f'"{_digest(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True))}"',
+                         "data":data
+                        }
+
+
+            if _etag_matches(request,entry["etag"]):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag":entry["etag"]})
+
+            return Response(entry["data"], status=status.HTTP_200_OK, headers={"ETag":entry["etag"]})
+
+        return wrapper
+
+    return decorator
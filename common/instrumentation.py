@@ -0,0 +1,312 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+from contextlib import ExitStack
+from contextvars import ContextVar
+from collections import Counter
+import hashlib
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+
+
+logger = logging.getLogger("performance")
+
+STATS_REGISTRY_KEY = "query_stats:workers"
+STATS_WORKER_KEY   = "query_stats:worker:{}"
+
+MAX_FINGERPRINTS = 20
+
+_current = ContextVar("query_recorder", default=None)
+
+
+
+# sql is seen before parameter interpolation, so the fingerprint only has to fold
+# IN lists and VALUES rows of different lengths and any inlined literals.
+
+_IN_LIST  = re.compile(r"\(\s*%s(\s*,\s*%s)*\s*\)")
+_VALUES   = re.compile(r"(VALUES\s*\(%s\))(\s*,\s*\(%s\))+", re.IGNORECASE)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+def fingerprint(sql):
+    normalized = _LITERALS.sub("?", _IN_LIST.sub("(%s)", sql))
+    normalized = _VALUES.sub(r"\1", normalized)
+    return hashlib.md5(normalized.encode(), usedforsecurity=False).hexdigest()[:12], normalized
+
+
+
+
+# one per request. installed as an execute_wrapper on every configured connection.
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.count         = 0
+        self.db_time       = 0.0
+        self.serializer    = 0.0
+        self.render        = 0.0
+        self.fingerprints  = Counter()
+        self.statements    = {}
+
+
+    def __call__(self,execute,sql,params,many,context):
+        started = time.perf_counter()
+        try:
+            return execute(sql,params,many,context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.count   += 1
+
+            key,normalized = fingerprint(sql)
+            self.fingerprints[key] += 1
+            self.statements.setdefault(key,normalized)
+
+
+    def duplicates(self):
+        return {key:count for key,count in self.fingerprints.items() if count > 1}
+
+
+
+
+# serializer.data as the list and retrieve views read it, timed: the time to_representation takes goes to the
+# request's serializer time, minus the queries it triggers on the way (lazy relations), those are db time.
+# writes do not go through it, their serializer time is reported as 0.
+
+def timed_data(serializer):
+    recorder = _current.get()
+    if recorder is None:
+        return serializer.data
+
+    started = time.perf_counter()
+    db_time = recorder.db_time
+    try:
+        return serializer.data
+    finally:
+        recorder.serializer += (time.perf_counter() - started) - (recorder.db_time - db_time)
+
+
+
+
+# render time is measured in the renderer, the response is rendered before it leaves the middleware.
+
+class TimedJSONRenderer(JSONRenderer):
+
+    def render(self,data,accepted_media_type=None,renderer_context=None):
+        recorder = _current.get()
+        if recorder is None:
+            return super().render(data,accepted_media_type,renderer_context)
+
+        started = time.perf_counter()
+        try:
+            return super().render(data,accepted_media_type,renderer_context)
+        finally:
+            recorder.render += time.perf_counter() - started
+
+
+
+
+# per endpoint aggregates of this process. flushed to the shared cache every few seconds
+# under a per process key so the stats endpoint can merge every worker.
+
+class EndpointStats:
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.endpoints  = {}
+        self.worker     = f"{socket.gethostname()}:{os.getpid()}"
+        self.flushed_at = 0.0
+
+
+    def record(self,name,recorder,duration,budget):
+        with self.lock:
+            entry = self.endpoints.setdefault(name,{"requests":0,
+                                                    "queries":0,
+                                                    "max_queries":0,
+                                                    "db_ms":0.0,
+                                                    "serializer_ms":0.0,
+                                                    "render_ms":0.0,
+                                                    "total_ms":0.0,
+                                                    "duplicate_queries":0,
+                                                    "over_budget":0,
+                                                    "budget":budget,
+                                                    "fingerprints":{}
+                                                   })
+
+            entry["requests"]      += 1
+            entry["queries"]       += recorder.count
+            entry["max_queries"]    = max(entry["max_queries"],recorder.count)
+            entry["db_ms"]         += recorder.db_time * 1000
+            entry["serializer_ms"] += recorder.serializer * 1000
+            entry["render_ms"]     += recorder.render * 1000
+            entry["total_ms"]      += duration * 1000
+            entry["budget"]         = budget
+
+            if budget is not None and recorder.count > budget:
+                entry["over_budget"] += 1
+
+            for key,count in recorder.duplicates().items():
+                entry["duplicate_queries"] += count - 1
+
+                fingerprints = entry["fingerprints"]
+                if key in fingerprints:
+                    fingerprints[key]["count"] += count - 1
+                elif len(fingerprints) < MAX_FINGERPRINTS:
+                    fingerprints[key] = {"sql":recorder.statements[key][:500], "count":count - 1}
+
+            due = time.monotonic() - self.flushed_at >= settings.QUERY_STATS_FLUSH_INTERVAL
+
+        if due:
+            self.flush()
+
+
+    def flush(self):
+        with self.lock:
+            snapshot = {name:{**entry, "fingerprints":dict(entry["fingerprints"])} for name,entry in self.endpoints.items()}
+            self.flushed_at = time.monotonic()
+
+        key = STATS_WORKER_KEY.format(self.worker)
+        cache.set(key, snapshot, settings.QUERY_STATS_TIMEOUT)
+
+        # re-registered on every flush, a registration lost to a concurrent write comes back on the next one
+        workers = cache.get(STATS_REGISTRY_KEY) or []
+        if key not in workers:
+            cache.set(STATS_REGISTRY_KEY, [*workers,key], settings.QUERY_STATS_TIMEOUT)
+
+
+stats = EndpointStats()
+
+
+
+
+# merges the snapshots of every worker into one report per endpoint, heaviest endpoints first
+
+def get_query_stats():
+    stats.flush()
+
+    workers   = cache.get(STATS_REGISTRY_KEY) or []
+    snapshots = cache.get_many(workers)
+
+    merged = {}
+    for snapshot in snapshots.values():
+        for name,entry in snapshot.items():
+            total = merged.setdefault(name,{"requests":0,"queries":0,"max_queries":0,"db_ms":0.0,"serializer_ms":0.0,
+                                            "render_ms":0.0,"total_ms":0.0,"duplicate_queries":0,"over_budget":0,"budget":entry["budget"],
+                                            "fingerprints":{}
+                                           })
+
+            for field in ("requests","queries","db_ms","serializer_ms","render_ms","total_ms","duplicate_queries","over_budget"):
+                total[field] += entry.get(field,0)     # snapshots flushed before serializer_ms existed
+
+            total["max_queries"] = max(total["max_queries"],entry["max_queries"])
+
+            for key,duplicate in entry["fingerprints"].items():
+                found = total["fingerprints"].setdefault(key,{"sql":duplicate["sql"], "count":0})
+                found["count"] += duplicate["count"]
+
+
+    report = []
+    for name,total in merged.items():
+        requests = total["requests"] or 1
+
+        report.append({"endpoint":name,
+                       "requests":total["requests"],
+                       "avg_queries":round(total["queries"] / requests, 2),
+                       "max_queries":total["max_queries"],
+                       "avg_db_ms":round(total["db_ms"] / requests, 3),
+                       "avg_serializer_ms":round(total["serializer_ms"] / requests, 3),
+                       "avg_render_ms":round(total["render_ms"] / requests, 3),
+                       "avg_total_ms":round(total["total_ms"] / requests, 3),
+                       "duplicate_queries":total["duplicate_queries"],
+                       "budget":total["budget"],
+                       "over_budget":total["over_budget"],
+                       "duplicates":sorted(({"fingerprint":key, **duplicate} for key,duplicate in total["fingerprints"].items()),
+                                           key=lambda duplicate: duplicate["count"], reverse=True
+                                          )[:5]
+                      })
+
+    return sorted(report, key=lambda entry: entry["avg_queries"] * entry["requests"], reverse=True)
+
+
+
+
+def get_budget(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+
+    budgets   = settings.QUERY_BUDGETS
+    view_name = getattr(getattr(match.func,"view_class",None),"__name__",None)
+
+    for name in (match.view_name, match.url_name, view_name):
+        if name in budgets:
+            return budgets[name]
+
+    return settings.QUERY_BUDGET_DEFAULT
+
+
+
+
+# records query count, db time, duplicate queries, serializer and render time for every request and aggregates them
+# per resolved url name. staff (any request with DEBUG on) also get them in a Server-Timing header, anonymous
+# clients never learn how expensive an endpoint is. requests that go over their query budget are logged as a warning.
+
+class QueryBudgetMiddleware:
+
+    def __init__(self,get_response):
+        self.get_response = get_response
+
+
+    def __call__(self,request):
+        if not settings.QUERY_INSTRUMENTATION:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        token    = _current.set(recorder)
+        started  = time.perf_counter()
+
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(recorder))
+
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        duration = time.perf_counter() - started
+
+
+        user = getattr(request,"user",None)     # set on the django request by drf authentication
+
+        if settings.QUERY_SERVER_TIMING and (settings.DEBUG or getattr(user,"is_staff",False)):
+            response["Server-Timing"] = ", ".join([f'db;dur={recorder.db_time * 1000:.2f};desc="{recorder.count} queries"',
+                                                   f'serializer;dur={recorder.serializer * 1000:.2f}',
+                                                   f'render;dur={recorder.render * 1000:.2f}',
+                                                   f'app;dur={(duration - recorder.db_time - recorder.serializer - recorder.render) * 1000:.2f}',
+                                                   f'dup;desc="{sum(count - 1 for count in recorder.duplicates().values())} duplicate queries"',
+                                                   f'total;dur={duration * 1000:.2f}'
+                                                  ])
+
+        match = request.resolver_match
+        if match is None:
+            return response
+
+        name   = match.view_name
+        budget = get_budget(request)
+
+        stats.record(name,recorder,duration,budget)
+
+        if budget is not None and recorder.count > budget:
+            duplicates = sorted(recorder.duplicates().items(), key=lambda item: item[1], reverse=True)[:3]
+
+            logger.warning("%s %s ran %s queries (budget %s) in %.1f ms db time. duplicates: %s",
+                           request.method, name, recorder.count, budget, recorder.db_time * 1000,
+                           "; ".join(f"{count}x {recorder.statements[key][:200]}" for key,count in duplicates) or "none"
+                          )
+
+        return response
@@ -1,7 +1,205 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q, QuerySet
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import binascii
+import json
 
 
+
+# keyset pagination over (ordering field, pk). no OFFSET and, unless asked for, no COUNT(*).
+# the ordering field is taken from the queryset, -created_at when it is unordered.
+
+class KeysetPagination(BasePagination):
+    page_size = 10
+    max_page_size = 50
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    count_query_param = "with_count"
+    default_ordering = "-created_at"
+
+
+    @classmethod
+    def get_ordering(cls,queryset):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering or [cls.default_ordering]
+        first = ordering[0]
+
+        if not isinstance(first,str) or "__" in first:
+            return None
+
+        field_name = first.lstrip("-")
+
+        try:
+            field = queryset.model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            return None
+
+        if not field.concrete:
+            return None
+
+        return field, first.startswith("-")
+
+
+    @classmethod
+    def supports(cls,queryset):
+        return isinstance(queryset,QuerySet) and cls.get_ordering(queryset) is not None
+
+
+    def get_page_size(self,request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError,ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+
+        return min(page_size,self.max_page_size)
+
+
+    def encode_cursor(self,obj,reverse):
+        position = {"v":self.field.value_to_string(obj),
+                    "pk":obj.pk,
+                    "r":int(reverse)
+                   }
+        return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+    def decode_cursor(self,request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+            value    = self.field.to_python(position["v"])
+            pk       = self.pk_field.to_python(position["pk"])
+            reverse  = bool(position.get("r"))
+        except (TypeError,ValueError,KeyError,binascii.Error,ValidationError):
+            raise NotFound("Invalid cursor.")
+
+        # to_python() passes null through and None is not a valid filter value
+        if value is None or pk is None:
+            raise NotFound("Invalid cursor.")
+
+        return value,pk,reverse
+
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request   = request
+        self.page_size = self.get_page_size(request)
+
+        self.field,self.descending = self.get_ordering(queryset)
+        self.pk_field = queryset.model._meta.pk
+
+        with_count = request.query_params.get(self.count_query_param,"").lower() == "true"
+        self.count = queryset.count() if with_count else None
+
+        cursor  = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[2]
+
+        name = self.field.attname
+        # walking backwards flips both the comparison and the sort direction
+        descending = self.descending != reverse
+
+        if cursor is not None:
+            value,pk,_ = cursor
+            lookup = "lt" if descending else "gt"
+
+            queryset = queryset.filter(Q(**{f"{name}__{lookup}":value}) |
+                                       Q(**{name:value, f"pk__{lookup}":pk})
+                                      )
+
+        prefix   = "-" if descending else ""
+        queryset = queryset.order_by(f"{prefix}{name}",f"{prefix}pk")
+
+        results  = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results  = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next     = True
+            self.has_previous = has_more
+        else:
+            self.has_next     = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        return results
+
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1], reverse=False))
+
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[0], reverse=True))
+
+
+    def get_paginated_data(self,results):
+        data = {"next":self.get_next_link(),
+                "previous":self.get_previous_link(),
+                "results":results
+               }
+
+        if self.count is not None:
+            data = {"count":self.count, **data}
+
+        return data
+
+
+
+
+# page number pagination by default. clients opt into keyset pagination per request with
+# ?pagination=cursor (or by following a cursor link); querysets sorted on something that is
+# not a model field (search relevance for example) and plain lists (carts served from redis) stay on page numbers.
+
 class DefaultPagination(PageNumberPagination):
     page_size = 10
     max_page_size = 50
-    page_size_query_param = "page_size"
\ No newline at end of file
+    page_size_query_param = "page_size"
+    mode_query_param = "pagination"
+
+    keyset_class = KeysetPagination
+
+
+    def use_keyset(self,request,queryset):
+        wants_keyset = (request.query_params.get(self.mode_query_param,"").lower() == "cursor" or
+                        self.keyset_class.cursor_query_param in request.query_params
+                       )
+        return wants_keyset and self.keyset_class.supports(queryset)
+
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+
+        if self.use_keyset(request,queryset):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+
+        return super().paginate_queryset(queryset, request, view)
+
+
+    def get_paginated_data(self,results):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_data(results)
+
+        return {"count":self.page.paginator.count,
+                "next":self.get_next_link(),
+                "previous":self.get_previous_link(),
+                "results":results
+               }
@@ -65,7 +65,7 @@ class CreateAddressSuccessResponse(SuccessResponseSerializer):
 
 
 class AddressPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = accounts_serializers.AddressSerializer(many=True)
@@ -97,7 +97,7 @@ class AddressDetailSuccessResponse(SuccessResponseSerializer):
 
 
 class UserPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = accounts_serializers.AdminUserListSerializer(many=True)
@@ -115,7 +115,7 @@ class UserDetailSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class AuditLogPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = accounts_serializers.AdminAuditLogListSerializer()
@@ -134,7 +134,7 @@ class AuditLogDetailSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class OrderListPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = accounts_serializers.AdminOrderListSerializer(many=True)
@@ -164,7 +164,7 @@ class CategoryCreateSucccessResponseSerializer(SuccessResponseSerializer):
 
 
 class AdminCategoryListPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = products_serializers.AdminCategoryListSerializer(many=True)
@@ -176,7 +176,7 @@ class AdminCategoryListSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class CategoryListPaginatedDateSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = products_serializers.CategorySerializer(many=True)
@@ -227,7 +227,7 @@ class BrandCreateSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class AdminBrandPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = products_serializers.AdminBrandSerializer()
@@ -239,7 +239,7 @@ class AdminBrandListSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class BrandListPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = products_serializers.BrandSerializer(many=True)
@@ -290,7 +290,7 @@ class ProductCreateSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class AdminProductPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = products_serializers.AdminProductListSerializer(many=True)
@@ -302,10 +302,11 @@ class AdminProductListSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class ProductPaginatedDataSerializer(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = products_serializers.ProductSerializer(many=True)
+    facets   = serializers.DictField(required=False)
 
 class ProductListSuccessResponseSerializer(SuccessResponseSerializer):
     data = ProductPaginatedDataSerializer() 
@@ -358,7 +359,7 @@ class AddToCartSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class CartListPaginatedData(serializers.Serializer):
-    count = serializers.IntegerField()
+    count = serializers.IntegerField(required=False)
     next  = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results = carts_serializers.CartListSerializer(many=True)
@@ -385,6 +386,26 @@ class UpdateCartQuantitySuccessResponseSerializer(SuccessResponseSerializer):
 
 
 
+class BulkCartLineResult(serializers.Serializer):
+    index      = serializers.IntegerField()
+    product_id = serializers.IntegerField()
+    action     = serializers.CharField()
+    status     = serializers.ChoiceField(choices=["applied","failed"])
+    quantity   = serializers.IntegerField(allow_null=True)
+    message    = serializers.CharField(allow_null=True)
+    data       = serializers.DictField()
+
+class BulkCartResponse(serializers.Serializer):
+    applied = serializers.IntegerField()
+    failed  = serializers.IntegerField()
+    results = BulkCartLineResult(many=True)
+
+class BulkCartSuccessResponseSerializer(SuccessResponseSerializer):
+    data = BulkCartResponse()
+
+
+
+
 #------------------Order-----------------------
 
 class CheckoutPreviewSuccessResponseSerializer(SuccessResponseSerializer):
@@ -408,7 +429,7 @@ class CreateOrderSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class OrderListPaginatedData(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = orders_serializers.OrderListSerializer(many=True)
@@ -475,11 +496,40 @@ class PaymentStatusSuccessResponseSerializer(SuccessResponseSerializer):
 
 
 class AdminOrderPaymentHistoryPaginatedData(serializers.Serializer):
-    count    = serializers.IntegerField()
+    count    = serializers.IntegerField(required=False)
     next     = serializers.CharField(allow_null=True)
     previous = serializers.CharField(allow_null=True)
     results  = accounts_serializers.AdminOrderPaymentHistorySerializer(many=True)
 
 
 class AdminOrderPaymentHistorySuccessResponseSerializer(SuccessResponseSerializer):
-    data = AdminOrderPaymentHistoryPaginatedData()
\ No newline at end of file
+    data = AdminOrderPaymentHistoryPaginatedData()
+
+
+
+
+
+class QueryStatsDuplicateSerializer(serializers.Serializer):
+    fingerprint = serializers.CharField()
+    sql         = serializers.CharField()
+    count       = serializers.IntegerField()
+
+class QueryStatsEndpointSerializer(serializers.Serializer):
+    endpoint          = serializers.CharField()
+    requests          = serializers.IntegerField()
+    avg_queries       = serializers.FloatField()
+    max_queries       = serializers.IntegerField()
+    avg_db_ms         = serializers.FloatField()
+    avg_serializer_ms = serializers.FloatField()
+    avg_render_ms     = serializers.FloatField()
+    avg_total_ms      = serializers.FloatField()
+    duplicate_queries = serializers.IntegerField()
+    budget            = serializers.IntegerField(allow_null=True)
+    over_budget       = serializers.IntegerField()
+    duplicates        = QueryStatsDuplicateSerializer(many=True)
+
+class QueryStatsDataSerializer(serializers.Serializer):
+    endpoints = QueryStatsEndpointSerializer(many=True)
+
+class QueryStatsSuccessResponseSerializer(SuccessResponseSerializer):
+    data = QueryStatsDataSerializer()
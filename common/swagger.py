@@ -86,9 +86,12 @@ MAX_PRICE_PARAM = openapi.Parameter(
 SORT_PARAM = openapi.Parameter(
     name="sort",
     in_=openapi.IN_QUERY,
-    description="Sort products",
+    description=(
+        "Sort products.\n\n"
+        "- `relevance` → best search matches first, only applies together with `search`"
+    ),
     type=openapi.TYPE_STRING,
-    enum=["price_asc", "price_desc", "newest", "oldest"],
+    enum=["price_asc", "price_desc", "newest", "oldest", "relevance"],
     required=False,
 )
 
@@ -207,4 +210,67 @@ DATE_TO_PARAM = openapi.Parameter(
     ),
     type=openapi.TYPE_STRING,
     required=False
-)
\ No newline at end of file
+)
+
+
+
+# Pagination params
+
+PAGINATION_PARAM = openapi.Parameter(
+    name="pagination",
+    in_=openapi.IN_QUERY,
+    description=(
+        "Pagination mode.\n\n"
+        "- `page` → page number pagination (default)\n"
+        "- `cursor` → keyset pagination, follow the `next`/`previous` links"
+    ),
+    type=openapi.TYPE_STRING,
+    enum=["page", "cursor"],
+    required=False,
+)
+
+CURSOR_PARAM = openapi.Parameter(
+    name="cursor",
+    in_=openapi.IN_QUERY,
+    description="Opaque cursor taken from a previous `next`/`previous` link",
+    type=openapi.TYPE_STRING,
+    required=False,
+)
+
+WITH_COUNT_PARAM = openapi.Parameter(
+    name="with_count",
+    in_=openapi.IN_QUERY,
+    description="Include the total `count` in cursor mode (costs an extra COUNT query)",
+    type=openapi.TYPE_STRING,
+    enum=["true", "false"],
+    required=False,
+)
+
+FACETS_PARAM = openapi.Parameter(
+    name="facets",
+    in_=openapi.IN_QUERY,
+    description=(
+        "Include facet counts (brands, sub categories, price buckets, stock) under `data.facets`.\n\n"
+        "Each facet honours every other active filter but not its own."
+    ),
+    type=openapi.TYPE_STRING,
+    enum=["true", "false"],
+    required=False,
+)
+
+
+
+# Idempotency header
+
+IDEMPOTENCY_KEY_PARAM = openapi.Parameter(
+    name="Idempotency-Key",
+    in_=openapi.IN_HEADER,
+    description=(
+        "Optional unique key (e.g. a UUID) per logical request.\n\n"
+        "Retrying with the same key and body returns the original successful response with an "
+        "`Idempotent-Replayed: true` header instead of running the request again. "
+        "Reusing a key for a different body returns 422, a retry while the first request is still running returns 409."
+    ),
+    type=openapi.TYPE_STRING,
+    required=False,
+)
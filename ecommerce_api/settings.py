@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework_simplejwt.token_blacklist',
     'rest_framework',
     'drf_yasg',
@@ -63,18 +64,125 @@ INSTALLED_APPS = [
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAYKEY_SECRET = os.getenv("RAZORPAYKEY_SECRET")
 RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
+RAZORPAY_BASE_URL = os.getenv("RAZORPAY_BASE_URL")     # unset is the real api, point it at fake_razorpay_server for load tests
+
+# razorpay http client: seconds per call, bounded retries of transient failures, and the circuit breaker
+# that fails calls fast once RAZORPAY_CIRCUIT_THRESHOLD calls in a row failed
+RAZORPAY_CONNECT_TIMEOUT = 3.05
+RAZORPAY_READ_TIMEOUT = 10
+RAZORPAY_MAX_RETRIES = 2
+RAZORPAY_RETRY_BACKOFF = 0.2
+RAZORPAY_POOL_SIZE = 20
+RAZORPAY_ASYNC_POOL_SIZE = 200     # connections one ASGI worker may hold open to razorpay at once
+RAZORPAY_CIRCUIT_THRESHOLD = 5
+RAZORPAY_CIRCUIT_COOLDOWN = 30
+
+
+
+# Cache
+# redis in production (REDIS_URL), process local memory otherwise (tests, local development)
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+            'KEY_PREFIX': 'ecommerce_api',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ecommerce_api',
+        }
+    }
+
+
+# seconds a category slug -> descendant ids mapping stays in the shared cache
+CATEGORY_TREE_CACHE_TIMEOUT = 60 * 60
+
+# seconds a rendered public catalog response stays cached (writes invalidate it earlier)
+CATALOG_RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+
+# per request query count, db time, duplicate queries, serializer time of the list and retrieve views and render
+# time (common/instrumentation.py), off unless switched on. the Server-Timing header additionally needs DEBUG or a staff user.
+QUERY_INSTRUMENTATION = os.getenv("QUERY_INSTRUMENTATION", "False") == "True"
+QUERY_SERVER_TIMING   = os.getenv("QUERY_SERVER_TIMING", "False") == "True"
+
+# max queries per request keyed by url name or view class name, going over logs a warning
+QUERY_BUDGETS = {"checkout-preview":3,
+                 "order-create-list":25,
+                 "list-add-to-cart":6,
+                 "product-list":6,
+                }
+QUERY_BUDGET_DEFAULT = None
+
+QUERY_STATS_FLUSH_INTERVAL = 10
+QUERY_STATS_TIMEOUT = 60 * 60 * 24
+
+
+# "sync" writes each audit entry inside the caller's transaction, "buffered" queues them in process
+# and bulk inserts them from a background thread
+AUDIT_LOG_MODE = os.getenv("AUDIT_LOG_MODE", "sync")
+AUDIT_LOG_BUFFER_SIZE = 200
+AUDIT_LOG_FLUSH_INTERVAL = 2
+AUDIT_LOG_BATCH_SIZE = 500
+AUDIT_LOG_SPOOL_DIR = BASE_DIR / "logs" / "audit_spool"
+
+# monthly audit log partitions (postgres), see the rotate_audit_logs command
+AUDIT_LOG_PARTITIONS_AHEAD = 3
+AUDIT_LOG_RETENTION_MONTHS = 12
+AUDIT_LOG_ARCHIVE_DIR = BASE_DIR / "archive" / "audit_logs"
+AUDIT_LOG_ARCHIVE_CHUNK_SIZE = 2000
+
+
+# seconds an unpaid online order holds its stock, every payment attempt starts the clock again
+STOCK_RESERVATION_TTL = 60 * 30
+
+# seconds a stored Idempotency-Key response is replayed, and how long a request holding a key may run
+# before a retry with the same key is allowed to take over
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# stock ledger snapshots cover movements older than this many seconds, long enough for any open transaction to commit
+STOCK_SNAPSHOT_LAG = 60 * 10
+
+# times process_webhook_events applies a stored razorpay event before it gives up and marks it FAILED
+WEBHOOK_MAX_ATTEMPTS = 5
+
+# authenticated users are served from a per process LRU (seconds, entries) in front of the shared cache (seconds),
+# the shared tier is only used with REDIS_URL. see accounts.authentication
+AUTH_USER_LOCAL_TTL = 5
+AUTH_USER_LOCAL_SIZE = 10000
+AUTH_USER_CACHE_TIMEOUT = 60 * 5
+
+# where cart lines live between checkouts. carts.storage.DatabaseCartStorage reads and writes CartModel directly,
+# carts.storage.RedisCartStorage keeps a hash per user in redis (CART_REDIS_URL, fakeredis in process when unset)
+# and writes it behind to CartModel, see the flush_carts command
+CART_STORAGE_BACKEND = os.getenv("CART_STORAGE_BACKEND", "carts.storage.DatabaseCartStorage")
+CART_REDIS_URL = os.getenv("CART_REDIS_URL", os.getenv("REDIS_URL"))
+CART_REDIS_PREFIX = "cart"
+CART_REDIS_TTL = 60 * 60 * 24 * 7     # idle carts drop out of redis, the next request loads them from the database again
+CART_SYNC_LOCK_TIMEOUT = 30
 
 
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
 
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
 
+    'DEFAULT_RENDERER_CLASSES': (
+        'common.instrumentation.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+
     "DEFAULT_THROTTLE_CLASSES": [
         "rest_framework.throttling.UserRateThrottle",
         "rest_framework.throttling.AnonRateThrottle",
@@ -119,6 +227,21 @@ LOGGING = {
             "filename":  BASE_DIR / "logs" / "payments.log",
             "formatter":"verbose",
         },
+        "performance_file":{
+            "class":"logging.FileHandler",
+            "filename":  BASE_DIR / "logs" / "performance.log",
+            "formatter":"verbose",
+        },
+        "inventory_file":{
+            "class":"logging.FileHandler",
+            "filename":  BASE_DIR / "logs" / "inventory.log",
+            "formatter":"verbose",
+        },
+        "audit_file":{
+            "class":"logging.FileHandler",
+            "filename":  BASE_DIR / "logs" / "audit.log",
+            "formatter":"verbose",
+        },
     },
 
     "loggers":{
@@ -127,6 +250,21 @@ LOGGING = {
             "level":"INFO",
             "propagate":False,
         },
+        "performance":{
+            "handlers":["performance_file"],
+            "level":"WARNING",
+            "propagate":False,
+        },
+        "inventory":{
+            "handlers":["inventory_file"],
+            "level":"INFO",
+            "propagate":False,
+        },
+        "audit":{
+            "handlers":["audit_file"],
+            "level":"WARNING",
+            "propagate":False,
+        },
     },
 }
 
@@ -136,6 +274,7 @@ LOGGING = {
 
 
 MIDDLEWARE = [
+    'common.instrumentation.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
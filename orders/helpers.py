@@ -1,13 +1,47 @@
+from django.db.models import F, Q, Sum, Window, FilteredRelation
+from accounts import models as accounts_models
+from carts import models as carts_models
+from decimal import Decimal
 
 
-# queryset => cart itmes
+ADDRESS_FIELDS = ["id","name","phone","address_line","city","state","pincode"]
 
 
-def calculate_checkout_price(queryset):
-    subtotal = sum(cart_item.total_price for cart_item in queryset)
+
+# cart lines of a user with their product, brand and category, the user's default address and the cart
+# subtotal, all from one query. the address is joined onto every line (null when the user has none) and
+# the subtotal is a SUM() OVER () window so the database adds up the lines in the same statement.
+
+def checkout_cart_items(user):
+    address = {f"address_{field}":F(f"default_address__{field}") for field in ADDRESS_FIELDS}
+
+    return (carts_models.CartModel.objects.filter(user=user)
+                                          .select_related("product","product__brand","product__category")
+                                          .annotate(default_address=FilteredRelation("user__addresses", condition=Q(user__addresses__is_default=True)))
+                                          .annotate(cart_subtotal=Window(Sum("total_price")), **address)
+                                          .order_by("id")
+           )
+
+
+
+# the default address carried by the lines of checkout_cart_items(), None when the user has none
+
+def checkout_address(cart_items):
+    if not cart_items or cart_items[0].address_id is None:
+        return None
+
+    item = cart_items[0]
+    return accounts_models.AddressModel(**{field:getattr(item,f"address_{field}") for field in ADDRESS_FIELDS})
+
+
+
+# cart_items => lines loaded through checkout_cart_items(), the subtotal was summed by the database
+
+def calculate_checkout_price(cart_items):
+    subtotal = cart_items[0].cart_subtotal if cart_items else Decimal("0.00")
 
     shipping_fee = 0 if subtotal >= 500 else 99
 
     grand_total = subtotal + shipping_fee
 
-    return subtotal,shipping_fee,grand_total
\ No newline at end of file
+    return subtotal,shipping_fee,grand_total
@@ -0,0 +1,275 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Case, When, Value
+from django.utils import timezone
+from rest_framework import serializers as drf_serializers
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+from orders import models as orders_models
+from payments import models as payments_models
+from products import models as product_models
+from products.helpers import invalidate_stock
+from products.ledger import record_movements
+
+
+
+# product id -> total quantity, a product can only appear once in a cart but callers pass any iterable of lines
+
+def group_lines(lines):
+    quantities = {}
+    for product_id,quantity in lines:
+        quantities[product_id] = quantities.get(product_id,0) + quantity
+    return quantities
+
+
+
+# a stock change that landed between the conditional UPDATE and the re-read, retrying the order can go through
+
+class StockChanged(drf_serializers.ValidationError):
+    pass
+
+
+
+# raises the same errors checkout always raised, inactive products first, then the first line short of stock,
+# then products that no longer exist. returns when every line looks available again.
+
+def _raise_reservation_error(quantities):
+    products = product_models.ProductModel.objects.filter(id__in=quantities).only("id","name","slug","stock","is_active")
+
+    inactive_products = [product for product in products if not product.is_active]
+    if inactive_products:
+        raise drf_serializers.ValidationError({"error_message":"Some products are no longer available.",
+                                               "data":[{"product_id":p.id,
+                                                        "product_name":p.name,
+                                                        "product_slug":p.slug
+                                                       }for p in inactive_products
+                                                      ]
+                                             })
+
+    for product in sorted(products, key=lambda product: product.id):
+        if product.stock < quantities[product.id]:
+            raise drf_serializers.ValidationError({"error_message":"Insufficient stock.",
+                                                   "data":{"product_id":product.id,
+                                                           "product_name":product.name,
+                                                           "product_slug":product.slug
+                                                          }
+                                                 })
+
+    missing = [product_id for product_id in quantities if product_id not in {product.id for product in products}]
+    if missing:
+        raise drf_serializers.ValidationError({"error_message":"Some products are no longer available.",
+                                               "data":[{"product_id":product_id} for product_id in missing]
+                                             })
+
+
+
+# takes stock for every line with one conditional UPDATE:
+#   UPDATE product SET stock = stock - CASE id WHEN .. END WHERE (id = a AND stock >= qa) OR (id = b AND stock >= qb) ...
+# no row is read into python and locked first. with more than one product the rows are locked in id order
+# beforehand so two carts sharing products always lock them in the same order and cannot deadlock.
+# a row count short of the number of products means some line failed: the UPDATE is rolled back to its savepoint
+# and the products are re-read for the error. when they all look available again (stock came back in between)
+# the UPDATE is retried once, after that StockChanged is raised. products it sold out invalidate the catalog.
+# must run inside transaction.atomic().
+
+def reserve_stock(lines,order=None):
+    quantities = group_lines(lines)
+    if not quantities:
+        return
+
+    product_ids = sorted(quantities)
+
+    if len(product_ids) > 1:
+        list(product_models.ProductModel.objects.select_for_update().filter(id__in=product_ids).order_by("id").values_list("id",flat=True))
+
+    available = reduce(or_, (Q(id=product_id, stock__gte=quantities[product_id]) for product_id in product_ids))
+
+    for attempt in range(2):
+        savepoint = transaction.savepoint()
+        updated   = product_models.ProductModel.objects.filter(available, is_active=True).update(
+                        stock   = F("stock") - Case(*[When(id=product_id, then=Value(quantities[product_id])) for product_id in product_ids]),
+                        version = F("version") + 1
+                    )
+
+        if updated == len(product_ids):
+            transaction.savepoint_commit(savepoint)
+            break
+
+        transaction.savepoint_rollback(savepoint)     # the lines that did go through, so the re-read sees the stock as it is
+        _raise_reservation_error(quantities)
+    else:
+        raise StockChanged({"error_message":"Stock changed while the order was placed, please retry.",
+                            "data":[{"product_id":product_id} for product_id in product_ids]
+                          })
+
+    record_movements([(product_id, -quantities[product_id], order.id if order else None) for product_id in product_ids], "CHECKOUT")
+
+    invalidate_stock(list(product_models.ProductModel.objects.filter(id__in=product_ids, stock=0).values_list("id",flat=True)))
+
+
+
+
+# records the stock taken for an unpaid online order so it can be released when the payment never arrives
+
+def create_reservations(order,lines,ttl=None):
+    expires_at = timezone.now() + (ttl or timedelta(seconds=settings.STOCK_RESERVATION_TTL))
+
+    reservations = [orders_models.StockReservationModel(order      = order,
+                                                        product_id = product_id,
+                                                        quantity   = quantity,
+                                                        expires_at = expires_at
+                                                       ) for product_id,quantity in group_lines(lines).items()
+                   ]
+
+    return orders_models.StockReservationModel.objects.bulk_create(reservations)
+
+
+
+# a new payment attempt gets a fresh ttl
+
+def extend_reservations(order):
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+
+    return orders_models.StockReservationModel.objects.filter(order=order,status="ACTIVE").update(expires_at=expires_at)
+
+
+
+# the payment went through, the stock is sold for good
+
+def commit_reservations(order):
+    return orders_models.StockReservationModel.objects.filter(order=order,status="ACTIVE").update(status="COMMITTED")
+
+
+
+
+# gives stock back for {product id: quantity} with one UPDATE, rows locked in id order first like reserve_stock.
+# on postgres the quantities are joined in as a VALUES list:
+#   UPDATE product SET stock = stock + v.quantity FROM (VALUES (a, qa), (b, qb) ...) v(id, quantity) WHERE product.id = v.id
+# so the statement stays the same size however many products there are, RETURNING tells which products were
+# out of stock before. other backends fall back to CASE. must run inside transaction.atomic().
+
+def restore_stock(quantities):
+    quantities  = {product_id:quantity for product_id,quantity in quantities.items() if quantity > 0}
+    product_ids = sorted(quantities)
+    if not product_ids:
+        return 0
+
+    if len(product_ids) > 1:
+        list(product_models.ProductModel.objects.select_for_update().filter(id__in=product_ids).order_by("id").values_list("id",flat=True))
+
+    if connection.vendor != "postgresql":
+        sold_out = list(product_models.ProductModel.objects.filter(id__in=product_ids, stock=0).values_list("id",flat=True))
+        updated  = product_models.ProductModel.objects.filter(id__in=product_ids).update(
+                       stock   = F("stock") + Case(*[When(id=product_id, then=Value(quantities[product_id])) for product_id in product_ids]),
+                       version = F("version") + 1
+                   )
+        invalidate_stock(sold_out)
+        return updated
+
+    table  = connection.ops.quote_name(product_models.ProductModel._meta.db_table)
+    values = ", ".join(["(%s::bigint, %s::integer)"] * len(product_ids))
+    params = [param for product_id in product_ids for param in (product_id, quantities[product_id])]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {table} AS product SET stock = product.stock + restock.quantity, version = product.version + 1 "
+                       f"FROM (VALUES {values}) AS restock (id, quantity) WHERE product.id = restock.id "
+                       f"RETURNING product.id, product.stock - restock.quantity",
+                       params
+                      )
+        rows = cursor.fetchall()
+
+    invalidate_stock([product_id for product_id,previous in rows if previous == 0])
+    return len(rows)
+
+
+
+
+# puts the quantity of cancelled or returned order items back on the shelf, once per item.
+# the items still waiting for a restock are locked and stamped with restocked_at, so a second cancel or
+# return racing this one finds nothing left to restock. reservations of those lines are released as well,
+# otherwise the expiry sweeper would return the same units again.
+# reason is the ledger reason, CANCELLATION or RETURN.
+# must run inside transaction.atomic(), callers already hold the order lock.
+
+def restock_items(item_ids,reason):
+    now   = timezone.now()
+    items = list(orders_models.OrderItemModel.objects.select_for_update()
+                                                     .filter(id__in=item_ids, restocked_at__isnull=True)
+                                                     .order_by("id")
+                                                     .values_list("id","order_id","product_id","quantity")
+                )
+    if not items:
+        return {}
+
+    quantities = group_lines((product_id,quantity) for _,_,product_id,quantity in items)
+
+    orders_models.OrderItemModel.objects.filter(id__in=[item_id for item_id,_,_,_ in items]).update(restocked_at=now)
+
+    lines = reduce(or_, (Q(order_id=order_id, product_id=product_id) for _,order_id,product_id,_ in items))
+    orders_models.StockReservationModel.objects.filter(lines, status="ACTIVE").update(status="RELEASED", updated_at=now)
+
+    restore_stock(quantities)
+    record_movements([(product_id,quantity,order_id) for _,order_id,product_id,quantity in items], reason)
+
+    return quantities
+
+
+
+
+# cancels one batch of unpaid online orders whose reservations expired and puts their stock back.
+# rows are claimed with FOR UPDATE SKIP LOCKED, so several sweepers can run side by side and an order a
+# checkout or webhook is holding right now is simply picked up by a later batch. the payments are locked
+# before their orders, the order apply_event takes them in, and an order is only claimed when every one of
+# its payments was, otherwise a capture arriving mid sweep would wait on the order while the sweep waits on the payment.
+# orders whose payment succeeded in the meantime are left alone, the webhook commits their reservations.
+
+def release_expired_reservations(batch_size=100,now=None):
+    now = now or timezone.now()
+
+    expired = orders_models.StockReservationModel.objects.filter(status="ACTIVE", expires_at__lt=now).values("order_id")
+    paid    = payments_models.PaymentModel.objects.filter(status="SUCCESS").values("order_id")
+
+    with transaction.atomic():
+        candidates = list(orders_models.OrderModel.objects.filter(id__in=expired, status="PENDING")
+                                                          .exclude(id__in=paid)
+                                                          .order_by("id")
+                                                          .values_list("id",flat=True)[:batch_size]
+                         )
+        if not candidates:
+            return {"orders":0,"reservations":0,"units":0,"products":{}}
+
+        payments = payments_models.PaymentModel.objects.filter(order_id__in=candidates).order_by("id")
+        locked   = set(payments.select_for_update(skip_locked=True).values_list("id",flat=True))
+        busy     = {order_id for payment_id,order_id in payments.values_list("id","order_id") if payment_id not in locked}
+
+        order_ids = list(orders_models.OrderModel.objects.select_for_update(skip_locked=True)
+                                                         .filter(id__in=[order_id for order_id in candidates if order_id not in busy], status="PENDING")
+                                                         .exclude(id__in=paid)
+                                                         .order_by("id")
+                                                         .values_list("id",flat=True)
+                        )
+        if not order_ids:
+            return {"orders":0,"reservations":0,"units":0,"products":{}}
+
+
+        reservations = orders_models.StockReservationModel.objects.filter(order_id__in=order_ids, status="ACTIVE")
+        lines        = list(reservations.values_list("product_id","quantity","order_id"))
+        quantities   = group_lines((product_id,quantity) for product_id,quantity,_ in lines)
+
+        restore_stock(quantities)
+        record_movements(lines, "RESERVATION_EXPIRED")
+
+        released = reservations.update(status="RELEASED")
+
+        orders_models.OrderModel.objects.filter(id__in=order_ids).update(status="CANCELLED", updated_at=now)
+        orders_models.OrderItemModel.objects.filter(order_id__in=order_ids, status="PENDING").update(status="CANCELLED", restocked_at=now, updated_at=now)
+        payments_models.PaymentModel.objects.filter(order_id__in=order_ids, status="PENDING").update(status="FAILED", processing_started_at=None, updated_at=now)
+
+
+    return {"orders":len(order_ids),
+            "reservations":released,
+            "units":sum(quantities.values()),
+            "products":quantities
+           }
+
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from accounts import models as accounts_models
+from carts import models as carts_models
+from products import models as product_models
+import statistics
+import time
+import uuid
+
+
+
+URL = "/api/orders/checkout/"
+
+
+
+class Command(BaseCommand):
+    help = "Reports queries and latency of the checkout preview for carts of different sizes."
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1,20,200])
+        parser.add_argument("--repeat", type=int, default=20)
+
+
+    def create_fixtures(self,count):
+        token = uuid.uuid4().hex[:8]
+
+        self.user     = get_user_model().objects.create_user(username=f"preview-{token}", email=f"preview-{token}@example.com", password=uuid.uuid4().hex)
+        self.brand    = product_models.BrandModel.objects.create(name=f"preview-{token}", slug=f"preview-{token}")
+        self.category = product_models.CategoryModel.objects.create(name=f"preview-{token}", slug=f"preview-{token}")
+
+        accounts_models.AddressModel.objects.create(user=self.user, name="Preview Check", phone="+919999999999", address_line="1 Test Street",
+                                                    city="Pune", state="MH", pincode="411001", is_default=True
+                                                   )
+
+        products = [product_models.ProductModel(name=f"preview {token} {index}", slug=f"preview-{token}-{index}", brand=self.brand,
+                                                category=self.category, price=100 + index, stock=1000
+                                               ) for index in range(count)
+                   ]
+        self.products = product_models.ProductModel.objects.bulk_create(products)
+
+
+    def delete_fixtures(self):
+        carts_models.CartModel.objects.filter(user=self.user).delete()
+        product_models.ProductModel.objects.filter(id__in=[product.id for product in self.products]).delete()
+        self.brand.delete()
+        self.category.delete()
+        self.user.delete()
+
+
+    def fill_cart(self,lines):
+        carts_models.CartModel.objects.filter(user=self.user).delete()
+        carts_models.CartModel.objects.bulk_create([carts_models.CartModel(user=self.user, product=product, unit_price=product.price,
+                                                                           quantity=2, total_price=product.price * 2
+                                                                          ) for product in self.products[:lines]
+                                                   ])
+
+
+    def handle(self,*args,**options):
+        sizes = sorted(set(options["lines"]))
+
+        self.create_fixtures(max(sizes))
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        self.stdout.write(f"{URL}  repeat {options['repeat']}  (authentication queries not included)")
+
+        try:
+            with override_settings(ALLOWED_HOSTS=["*"]):
+                for lines in sizes:
+                    self.fill_cart(lines)
+
+                    with CaptureQueriesContext(connection) as queries:
+                        response = client.post(URL)
+
+                    if response.status_code != 200:
+                        raise CommandError(f"POST {URL} with {lines} lines returned {response.status_code}: {response.content[:200]}")
+
+                    count = len(queries)     # read now, the query log is reset by the next request
+
+                    timings = []
+                    for _ in range(options["repeat"]):
+                        started = time.perf_counter()
+                        client.post(URL)
+                        timings.append((time.perf_counter() - started) * 1000)
+
+                    timings.sort()
+                    self.stdout.write(f"{lines:>5} lines  queries: {count:>3}  "
+                                      f"p50: {statistics.median(timings):8.2f} ms  max: {timings[-1]:8.2f} ms")
+        finally:
+            self.delete_fixtures()
@@ -0,0 +1,140 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, OperationalError
+from rest_framework import serializers as drf_serializers
+from concurrent.futures import ThreadPoolExecutor
+from products import models as product_models
+from orders.inventory import reserve_stock
+import statistics
+import threading
+import time
+import uuid
+
+
+
+# what OrderAPIView.post used to do: lock the rows first, hold them through the rest of the order
+# writes, check and decrement in python, bulk_update at the end
+
+def legacy_checkout(product_id,quantity,work):
+    with transaction.atomic():
+        products = product_models.ProductModel.objects.select_for_update().filter(id__in=[product_id])
+        product_map = {product.id : product for product in products}
+
+        time.sleep(work)
+
+        product = product_map[product_id]
+        if quantity > product.stock:
+            raise drf_serializers.ValidationError({"error_message":"Insufficient stock."})
+
+        product.stock = product.stock - quantity
+        product_models.ProductModel.objects.bulk_update(products, ["stock"])
+
+
+
+# the order writes first, one conditional UPDATE right before the commit
+
+def conditional_checkout(product_id,quantity,work):
+    with transaction.atomic():
+        time.sleep(work)
+        reserve_stock([(product_id,quantity)])
+
+
+
+STRATEGIES = {"legacy":legacy_checkout,
+              "conditional":conditional_checkout
+             }
+
+
+
+
+class Command(BaseCommand):
+    help = ("Fires concurrent checkouts at a single product with the legacy select_for_update flow and the "
+            "conditional UPDATE reservation and reports throughput, latency and overselling.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--checkouts", type=int, default=300)
+        parser.add_argument("--workers", type=int, default=32)
+        parser.add_argument("--stock", type=int, default=100)
+        parser.add_argument("--quantity", type=int, default=1)
+        parser.add_argument("--work-ms", type=float, default=5, help="time spent on the other order writes inside the transaction")
+        parser.add_argument("--strategy", choices=["both",*STRATEGIES], default="both")
+
+
+    def create_product(self,stock):
+        token    = uuid.uuid4().hex[:8]
+        brand    = product_models.BrandModel.objects.create(name=f"bench-{token}", slug=f"bench-{token}")
+        category = product_models.CategoryModel.objects.create(name=f"bench-{token}", slug=f"bench-{token}")
+
+        return product_models.ProductModel.objects.create(name=f"bench-{token}", slug=f"bench-{token}", brand=brand,
+                                                          category=category, price=100, stock=stock
+                                                         )
+
+
+    def run_strategy(self,checkout,product,options):
+        product_models.ProductModel.objects.filter(id=product.id).update(stock=options["stock"])
+
+        work      = options["work_ms"] / 1000
+        latencies = []
+        outcomes  = {"sold":0,"rejected":0,"errors":0}
+        lock      = threading.Lock()
+
+        def attempt(_):
+            started = time.perf_counter()
+            try:
+                checkout(product.id,options["quantity"],work)
+                outcome = "sold"
+            except drf_serializers.ValidationError:
+                outcome = "rejected"
+            except OperationalError:     # deadlocks, lock timeouts, sqlite "database is locked"
+                outcome = "errors"
+            finally:
+                connection.close()
+
+            with lock:
+                outcomes[outcome] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            list(pool.map(attempt, range(options["checkouts"])))
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        expected = options["stock"] - outcomes["sold"] * options["quantity"]
+
+        latencies.sort()
+        return {**outcomes,
+                "elapsed":elapsed,
+                "throughput":options["checkouts"] / elapsed,
+                "p50":statistics.median(latencies),
+                "p95":latencies[int(len(latencies) * 0.95) - 1],
+                "final_stock":product.stock,
+                "consistent":product.stock == expected and product.stock >= 0
+               }
+
+
+    def handle(self,*args,**options):
+        if connection.vendor != "postgresql":
+            self.stdout.write(self.style.WARNING(f"{connection.vendor} has no row locks, numbers from this backend say little about contention."))
+
+        product = self.create_product(options["stock"])
+        names   = list(STRATEGIES) if options["strategy"] == "both" else [options["strategy"]]
+
+        self.stdout.write(f"{options['checkouts']} checkouts x {options['quantity']} over {options['workers']} workers, "
+                          f"stock {options['stock']}, {options['work_ms']} ms of other writes per order")
+
+        try:
+            for name in names:
+                result = self.run_strategy(STRATEGIES[name],product,options)
+
+                line = (f"{name:<12} {result['elapsed']:7.2f} s  {result['throughput']:8.1f} checkouts/s  "
+                        f"p50 {result['p50']:8.1f} ms  p95 {result['p95']:8.1f} ms  "
+                        f"sold {result['sold']}  rejected {result['rejected']}  errors {result['errors']}  stock left {result['final_stock']}")
+
+                style = self.style.SUCCESS if result["consistent"] else self.style.ERROR
+                self.stdout.write(style(line if result["consistent"] else f"{line}  OVERSOLD / INCONSISTENT"))
+        finally:
+            brand,category = product.brand,product.category
+            product.delete()
+            brand.delete()
+            category.delete()
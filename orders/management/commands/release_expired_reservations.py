@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, DatabaseError
+from orders.inventory import release_expired_reservations
+import logging
+import signal
+import time
+
+
+
+logger = logging.getLogger("inventory")
+
+
+
+class Command(BaseCommand):
+    help = ("Cancels unpaid online orders whose stock reservation expired and returns the stock. "
+            "Runs once by default, --loop keeps it running as a worker.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--loop", action="store_true", help="keep sweeping every --interval seconds until stopped")
+        parser.add_argument("--interval", type=float, default=30)
+
+
+    def sweep(self,batch_size):
+        totals = {"orders":0,"reservations":0,"units":0,"products":{},"failed":False}
+
+        while True:
+            started = time.perf_counter()
+            try:
+                result = release_expired_reservations(batch_size=batch_size)
+            except DatabaseError:     # deadlock victim or a dropped connection, the batch rolled back and waits for the next pass
+                logger.exception("reservation sweep batch failed")
+                close_old_connections()
+                totals["failed"] = True
+                break
+
+            if not result["orders"]:
+                break
+
+            for key in ("orders","reservations","units"):
+                totals[key] += result[key]
+            for product_id,units in result["products"].items():
+                totals["products"][product_id] = totals["products"].get(product_id,0) + units
+
+            logger.info("reservation sweep batch orders_cancelled=%s reservations_released=%s units_reclaimed=%s products=%s duration_ms=%.1f",
+                        result["orders"], result["reservations"], result["units"], len(result["products"]),
+                        (time.perf_counter() - started) * 1000
+                       )
+
+            if result["orders"] < batch_size:
+                break
+
+        return totals
+
+
+    def handle(self,*args,**options):
+        stopping = []
+        if options["loop"]:
+            signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+        while True:
+            close_old_connections()
+            totals = self.sweep(options["batch_size"])
+
+            if totals["orders"]:
+                top = sorted(totals["products"].items(), key=lambda item: item[1], reverse=True)[:5]
+                self.stdout.write(self.style.SUCCESS(f"cancelled {totals['orders']} orders, released {totals['reservations']} reservations, "
+                                                     f"reclaimed {totals['units']} units across {len(totals['products'])} products "
+                                                     f"(top: {', '.join(f'#{product_id} +{units}' for product_id,units in top)})"
+                                                    ))
+            elif not options["loop"] and not totals["failed"]:
+                self.stdout.write("nothing expired")
+
+            if totals["failed"] and not options["loop"]:
+                raise CommandError("a sweep batch failed, see logs/inventory.log")
+
+            if not options["loop"] or stopping:
+                break
+
+            time.sleep(options["interval"])
+            if stopping:
+                break
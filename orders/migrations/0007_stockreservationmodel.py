@@ -0,0 +1,31 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_orderitemmodel_orderitem_order_status_idx_and_more'),
+        ('products', '0007_productmodel_product_active_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservationModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('ACTIVE', 'Active'), ('COMMITTED', 'Committed'), ('RELEASED', 'Released')], default='ACTIVE', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.ordermodel')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='products.productmodel')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['expires_at'], name='reservation_active_expiry_idx')],
+            },
+        ),
+    ]
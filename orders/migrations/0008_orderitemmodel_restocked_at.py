@@ -0,0 +1,18 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_stockreservationmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitemmodel',
+            name='restocked_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
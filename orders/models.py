@@ -57,6 +57,10 @@ class OrderModel(models.Model):
         return f"{self.order_id}"
 
 
+    class Meta:
+        indexes = [models.Index(fields=["user","-created_at"], name="order_user_created_idx")]
+
+
 
     
 
@@ -92,11 +96,48 @@ class OrderItemModel(models.Model):
     
     status      = models.CharField(max_length=50, choices=ORDER_ITEM_STATUS_CHOICES, null=False, blank=False, default="PENDING")
 
+    restocked_at = models.DateTimeField(null=True, blank=True, editable=False)     # set once the quantity went back to stock
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
 
     def __str__(self):
         return f"{self.order.order_id} - {self.product_name}"
-    
+
+
+    class Meta:
+        indexes = [models.Index(fields=["order","status"], name="orderitem_order_status_idx")]
+
+
+
+
+
+# stock held by an unpaid online order. stock is decremented when the order is placed, the reservation
+# records what goes back to the shelf if the payment never completes before expires_at.
+
+class StockReservationModel(models.Model):
+
+    STATUS_CHOICES = [("ACTIVE","Active"),
+                      ("COMMITTED","Committed"),
+                      ("RELEASED","Released")
+                     ]
+
+    order   = models.ForeignKey(OrderModel, related_name="reservations", on_delete=models.CASCADE, null=False, blank=False)
+    product = models.ForeignKey(product_models.ProductModel, related_name="reservations", on_delete=models.PROTECT, null=False, blank=False)
+
+    quantity   = models.PositiveIntegerField(null=False, blank=False)
+    status     = models.CharField(max_length=20, choices=STATUS_CHOICES, default="ACTIVE", null=False, blank=False)
+    expires_at = models.DateTimeField(null=False, blank=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    def __str__(self):
+        return f"{self.order.order_id} - {self.product_id} x {self.quantity} ({self.status})"
+
+
+    class Meta:
+        indexes = [models.Index(fields=["expires_at"], condition=models.Q(status="ACTIVE"), name="reservation_active_expiry_idx")]
 
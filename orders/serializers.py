@@ -5,6 +5,7 @@ from orders import models
 from payments import models as payment_models
 from django.db import transaction
 from orders import models as orders_model
+from orders.inventory import restock_items
 
 class CheckoutPreviewRequestSerializer(serializers.ModelSerializer):
     pass
@@ -28,7 +29,7 @@ class OrderCreateSerializer(serializers.Serializer):
 
 
 class OrderListSerializer(serializers.ModelSerializer):
-    items_count = serializers.IntegerField(source="items.count", read_only=True)    
+    items_count = serializers.IntegerField(read_only=True)     # annotated by the list view, Count("items")
 
     class Meta:
         model = models.OrderModel
@@ -75,7 +76,7 @@ class OrderCancelSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"error_message":"Order contains items that cannot be cancelled",
                                                "data":{"order_id":instance.order_id,
                                                        "order_item_id":item.id,
-                                                       "order_item_name":item.name
+                                                       "order_item_name":item.product_name
                                                       }
                                              }) 
         
@@ -96,6 +97,7 @@ class OrderCancelSerializer(serializers.ModelSerializer):
             instance.save(update_fields=["status"])
 
             order_items.update(status="CANCELLED")        
+            restock_items(list(order_items.values_list("id",flat=True)), "CANCELLATION")
 
         return instance
     
@@ -129,6 +131,7 @@ class OrderItemCancelSerializer(serializers.ModelSerializer):
 
             instance.status = "CANCELLED"
             instance.save(update_fields=["status"])
+            restock_items([instance.id], "CANCELLATION")
 
             order_items = order.items.all()
 
@@ -162,7 +165,7 @@ class OrderReturnSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"error_message":"Order cannot be returned.",
                                                "data":{"order_id":instance.order_id,
                                                        "order_item_id":item.id,
-                                                       "order_item_name":item.name
+                                                       "order_item_name":item.product_name
                                                       }
                                              })
         
@@ -1,3 +1,174 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from rest_framework import serializers as drf_serializers
+from rest_framework.test import APIClient
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from accounts.serializers import AdminMarkOrderItemReturnedSerializer
+from orders import models as orders_models
+from orders.inventory import release_expired_reservations, create_reservations
+from orders.serializers import OrderCancelSerializer, OrderItemCancelSerializer
+from payments import models as payments_models
+from products import models as product_models
+import threading
 
-# Create your tests here.
+
+
+def create_product(name,price=100,stock=10):
+    brand,_    = product_models.BrandModel.objects.get_or_create(name="Acme", slug="acme")
+    category,_ = product_models.CategoryModel.objects.get_or_create(name="Tools", slug="tools")
+
+    return product_models.ProductModel.objects.create(name=name, slug=name.lower(), brand=brand, category=category, price=price, stock=stock)
+
+
+def create_order(user,products,quantity=1,status="PENDING",item_status=None):
+    subtotal = sum(product.price * quantity for product in products)
+    order    = orders_models.OrderModel.objects.create(user=user, name="Test User", phone="+919876543210", address_line="1 Main Road",
+                                                       city="Pune", state="Maharashtra", pincode="411001", subtotal=subtotal,
+                                                       shipping_fee=0, grand_total=subtotal, status=status
+                                                      )
+
+    for product in products:
+        orders_models.OrderItemModel.objects.create(order=order, product=product, product_name=product.name, category_name=product.category.name,
+                                                    brand_name=product.brand.name, product_slug=product.slug, category_slug=product.category.slug,
+                                                    brand_slug=product.brand.slug, unit_price=product.price, quantity=quantity,
+                                                    total_price=product.price * quantity, status=item_status or status
+                                                   )
+    return order
+
+
+
+
+# the order list runs a fixed number of queries whatever the page size, items_count is an annotation
+
+class OrderListQueryCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        products = [create_product("Hammer"),create_product("Wrench")]
+
+        for _ in range(12):
+            create_order(cls.user,products)
+
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+    def assert_list_queries(self,params,queries,rows):
+        with self.assertNumQueries(queries):
+            response = self.client.get("/api/orders/",params)
+
+        self.assertEqual(response.status_code,200)
+        results = response.json()["data"]["results"]
+        self.assertEqual(len(results),rows)
+        self.assertTrue(all(order["items_count"] == 2 for order in results))
+
+
+    def test_page_number_pagination(self):
+        # COUNT(*) and the page
+        self.assert_list_queries({"page_size":1},2,1)
+        self.assert_list_queries({"page_size":12},2,12)
+
+
+    def test_cursor_pagination(self):
+        self.assert_list_queries({"page_size":1,"pagination":"cursor"},1,1)
+        self.assert_list_queries({"page_size":12,"pagination":"cursor"},1,12)
+
+
+
+
+# cancels, item cancels, the reservation sweeper and admin returns fired at the same order at once put the
+# quantity back exactly once. sqlite has no row locks and serialises every write, nothing to race there.
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentRestockTests(TransactionTestCase):
+    STOCK    = 50
+    QUANTITY = 3
+    THREADS  = 8
+
+
+    def setUp(self):
+        self.user    = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        self.product = create_product("Hammer", stock=self.STOCK - self.QUANTITY)     # checkout already took the order's units
+
+
+    # what checkout leaves behind. a pending order also has an online payment whose reservation already expired
+    def place_order(self,item_status):
+        order_status = "DELIVERED" if item_status == "RETURN_REQUESTED" else "PENDING"
+        order = create_order(self.user, [self.product], quantity=self.QUANTITY, status=order_status, item_status=item_status)
+
+        if order_status == "PENDING":
+            payments_models.PaymentModel.objects.create(order=order, method="RAZORPAY", status="PENDING", amount=order.grand_total)
+            create_reservations(order, [(self.product.id,self.QUANTITY)], ttl=timedelta(seconds=-1))
+
+        return order,order.items.get()
+
+
+    def race(self,attempts):
+        barrier = threading.Barrier(self.THREADS)
+
+        def attempt(index):
+            barrier.wait()
+            try:
+                attempts[index % len(attempts)]()
+            except drf_serializers.ValidationError:     # lost to an attempt that already changed the status
+                pass
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(attempt, range(self.THREADS)))
+
+
+    def assert_restocked_once(self,item):
+        item.refresh_from_db()
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.stock,self.STOCK)
+        self.assertIsNotNone(item.restocked_at)
+
+
+    def cancel_order(self,order):
+        serializer = OrderCancelSerializer(instance=orders_models.OrderModel.objects.get(id=order.id), data={}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+    def cancel_item(self,item):
+        serializer = OrderItemCancelSerializer(instance=orders_models.OrderItemModel.objects.get(id=item.id), data={}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+    def mark_returned(self,item):
+        serializer = AdminMarkOrderItemReturnedSerializer(instance=orders_models.OrderItemModel.objects.get(id=item.id), data={})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+    def test_order_cancels(self):
+        order,item = self.place_order("PENDING")
+        self.race([lambda: self.cancel_order(order)])
+        self.assert_restocked_once(item)
+
+
+    def test_order_and_item_cancels(self):
+        order,item = self.place_order("PENDING")
+        self.race([lambda: self.cancel_order(order), lambda: self.cancel_item(item)])
+        self.assert_restocked_once(item)
+
+
+    def test_cancels_and_sweeper(self):
+        order,item = self.place_order("PENDING")
+        self.race([lambda: self.cancel_order(order), lambda: self.cancel_item(item), release_expired_reservations])
+        self.assert_restocked_once(item)
+
+
+    def test_returns(self):
+        order,item = self.place_order("RETURN_REQUESTED")
+        self.race([lambda: self.mark_returned(item)])
+        self.assert_restocked_once(item)
@@ -5,18 +5,23 @@ from rest_framework.permissions import AllowAny,IsAuthenticated
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.response import Response
 from rest_framework import status
-from orders.helpers import calculate_checkout_price
+from orders.helpers import calculate_checkout_price, checkout_cart_items, checkout_address
+from orders.inventory import reserve_stock, create_reservations, StockChanged
 from django.db import transaction
+from django.db.models import Count
 from common.pagination import DefaultPagination
+from common.swagger import PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM,IDEMPOTENCY_KEY_PARAM
+from accounts.idempotency import idempotent
 from rest_framework import serializers as drf_serializers
 from products import models as product_models
 from payments import models as payment_models
 from accounts import models as accounts_models
 from carts import models as carts_models
+from carts.storage import cart_storage
 from orders import models as orders_models
-from orders.helpers import calculate_checkout_price
 from orders import serializers as orders_serializers
 from common.helpers import success_response,error_response, normalize_validation_errors
+from common.instrumentation import timed_data
 from common.schemas import SuccessResponseSerializer,ErrorResponseSerializer,CheckoutPreviewSuccessResponseSerializer,CreateOrderSuccessResponseSerializer,OrderListSuccessResponseSerializer,OrderDetailSuccessResponseSerializer,OrderCancelSuccessResponseSerializer,OrderItemCancelSuccessResponseSerializer,OrderReturnSuccessResponseSerializer,OrderItemReturnSuccessResponseSerializer
 
 # Create your views here.
@@ -32,27 +37,30 @@ class CheckoutPreviewAPIView(APIView):
                                    }
                         )
     def post(self,request):
-        default_address = accounts_models.AddressModel.objects.filter(user=request.user,is_default=True).first()
+        # lines priced before their product changed take the current price first, see carts.helpers.reprice_stale_items
+        cart_storage.reprice(request.user)
+        cart_storage.sync(request.user)
 
-        if not default_address:
+        # address, lines, products and subtotal in one query, everything below is checked in memory
+        cart_items      = list(checkout_cart_items(request.user))
+        default_address = checkout_address(cart_items)
+
+        # an empty cart has no line to carry the address, only then is it looked up on its own
+        has_address = default_address is not None if cart_items else accounts_models.AddressModel.objects.filter(user=request.user,is_default=True).exists()
+
+        if not has_address:
             return error_response(message = "please add an address to continue checkout.",
                                   status_code = status.HTTP_400_BAD_REQUEST
                                  )        
         
-        cart_items = carts_models.CartModel.objects.filter(user=request.user).select_related('product','product__brand','product__category')
-        
-        if not cart_items.exists():
+        if not cart_items:
             return error_response(message = "Please add items to your cart to checkout.",
                                   status_code = status.HTTP_400_BAD_REQUEST
                                  )
         
 
-        product_ids = cart_items.values_list("product_id",flat=True)
-        products = product_models.ProductModel.objects.filter(id__in=product_ids)
-
-
         try:
-            inactive_products = [product for product in products if not product.is_active]
+            inactive_products = [item.product for item in cart_items if not item.product.is_active]
 
             if inactive_products:
                 raise drf_serializers.ValidationError({"error_message":"Some products are no longer available.",
@@ -106,11 +114,15 @@ class OrderAPIView(APIView):
     pagination_class = DefaultPagination
 
     @swagger_auto_schema(tags=["Order"], request_body = orders_serializers.OrderCreateSerializer,
+                         manual_parameters=[IDEMPOTENCY_KEY_PARAM],
                          responses = {201 : CreateOrderSuccessResponseSerializer,
                                       400 : ErrorResponseSerializer,
+                                      409 : ErrorResponseSerializer,
+                                      422 : ErrorResponseSerializer,
                                       500 : ErrorResponseSerializer
                                      }
                         )
+    @idempotent
     def post(self,request):
 
         serializer = orders_serializers.OrderCreateSerializer(data=request.data)
@@ -146,51 +158,20 @@ class OrderAPIView(APIView):
                                  )
 
 
-        cart_items = carts_models.CartModel.objects.filter(user=request.user).select_related("product","product__brand","product__category")
+        # the cart storage may hold writes CartModel has not seen yet, the order is built from CartModel only
+        cart_storage.sync(request.user)
+        cart_items = list(checkout_cart_items(request.user))
         
-        if not cart_items.exists():
+        if not cart_items:
             return error_response(message = "Please add items to your cart place an order.",
                                   status_code = status.HTTP_400_BAD_REQUEST
                                  )
 
 
-        product_ids = cart_items.values_list("product_id", flat=True)
+        lines = [(cart_item.product_id, cart_item.quantity) for cart_item in cart_items]
 
         try:
             with transaction.atomic():
-                products = product_models.ProductModel.objects.select_for_update().filter(id__in=product_ids)
-
-                inactive_products = [product for product in products if not product.is_active]
-
-                if inactive_products:
-                    raise drf_serializers.ValidationError({"error_message":"Some products are no longer available.",
-                                                           "data":[{"product_id":p.id,
-                                                                    "product_name":p.name,
-                                                                    "product_slug":p.slug
-                                                                   }for p in inactive_products
-                                                                  ]
-                                                          })
-
-                product_map = {product.id : product for product in products}
-            
-                # stock validation   
-                for cart_item in cart_items:
-                    product_instance = product_map[cart_item.product_id]
-
-                    if cart_item.quantity > product_instance.stock:
-                        raise drf_serializers.ValidationError({"error_message":"Insufficient stock.",
-                                                               "data":{"product_id":product_instance.id,
-                                                                       "product_name":product_instance.name,
-                                                                       "product_slug":product_instance.slug
-                                                                      }
-                                                              })
-                    else:
-                        product_instance.stock = product_instance.stock - cart_item.quantity
-
-                product_models.ProductModel.objects.bulk_update(products, ["stock"])
-
-
-
                 subtotal,shipping_fee,grand_total = calculate_checkout_price(cart_items)
                 
                 order = orders_models.OrderModel.objects.create(user         = request.user,
@@ -230,8 +211,15 @@ class OrderAPIView(APIView):
                                                            amount   = grand_total,
                                                            currency = "INR",
                                                           )
+
+                # stock goes last, the product rows stay locked only from here to the commit
+                reserve_stock(lines, order=order)
+
+                if payment_method == "RAZORPAY":
+                    create_reservations(order,lines)
                 
-                cart_items.delete()
+                carts_models.CartModel.objects.filter(id__in=[cart_item.id for cart_item in cart_items]).delete()
+                transaction.on_commit(lambda: cart_storage.discard(request.user,dict(lines)))
                 return success_response(message = "Order info created successfuly.",
                                         data    = {"order_id"        : order.order_id,
                                                    "order_status"    : order.status,
@@ -239,6 +227,14 @@ class OrderAPIView(APIView):
                                                   },
                                         status_code = status.HTTP_201_CREATED
                                        )
+
+        except StockChanged as e:
+            message,data = normalize_validation_errors(e.detail)
+
+            return error_response(message = message,
+                                  data    = data,
+                                  status_code = status.HTTP_409_CONFLICT
+                                 )
         
         except drf_serializers.ValidationError as e:
             message,data = normalize_validation_errors(e.detail)
@@ -251,24 +247,22 @@ class OrderAPIView(APIView):
 
     
     
-    @swagger_auto_schema(tags=["Order"], request_body=None, responses={200 : OrderListSuccessResponseSerializer,
-                                                                       400 : ErrorResponseSerializer,
-                                                                       500 : ErrorResponseSerializer
-                                                                      }
+    @swagger_auto_schema(tags=["Order"], request_body=None,
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
+                         responses = {200 : OrderListSuccessResponseSerializer,
+                                      400 : ErrorResponseSerializer,
+                                      500 : ErrorResponseSerializer
+                                     }
                         )
     def get(self,request):
-        orders = orders_models.OrderModel.objects.filter(user=request.user).order_by('-created_at')
+        orders = orders_models.OrderModel.objects.filter(user=request.user).annotate(items_count=Count("items")).order_by('-created_at')
 
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(orders, request)
 
         serializer = orders_serializers.OrderListSerializer(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Order list fetched successfuly.",
                                 data = paginated_data,
@@ -302,7 +296,7 @@ class OrderDetailAPIView(GenericAPIView):
         serializer = self.get_serializer(instance=order_instance)
 
         return success_response(message = "Order detail fetched successfuly,",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     
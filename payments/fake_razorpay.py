@@ -0,0 +1,156 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+
+
+
+# a stand-in for the razorpay orders api to load test the gateway offline. behaviour is set on the server:
+# latency (+ random jitter) before every answer, a share of 500s, and a share of requests that hang for
+# hang seconds, longer than any sane read timeout. GET /v1/payments pages through server.payments, payment
+# entities loaded from a json lines fixture, so the reconciliation job can run against it.
+
+class FakeRazorpayHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"     # keep-alive, so connection pooling on the client side shows
+
+
+    def log_message(self,format,*args):
+        pass
+
+
+    def _send(self,status,body):
+        payload = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def _behave(self):
+        server = self.server
+        server.count()
+
+        roll = random.random()
+        if roll < server.hang_rate:
+            time.sleep(server.hang)
+        elif roll < server.hang_rate + server.error_rate:
+            time.sleep(server.latency)
+            self._send(500,{"error":{"code":"SERVER_ERROR","description":"The server encountered an error."}})
+            return False
+
+        time.sleep(server.latency + random.uniform(0,server.jitter))
+        return True
+
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if self.path.rstrip("/") != "/v1/orders":
+            self._send(404,{"error":{"code":"BAD_REQUEST_ERROR","description":"The requested URL was not found on the server."}})
+            return
+
+        if not self._behave():
+            return
+
+        data = json.loads(body or b"{}")
+        if not isinstance(data.get("amount"),int) or data["amount"] < 100:
+            self._send(400,{"error":{"code":"BAD_REQUEST_ERROR","description":"The amount must be atleast INR 1.00"}})
+            return
+
+        order = {"id":f"order_{uuid.uuid4().hex[:14]}",
+                 "entity":"order",
+                 "amount":data["amount"],
+                 "amount_paid":0,
+                 "amount_due":data["amount"],
+                 "currency":data.get("currency","INR"),
+                 "receipt":data.get("receipt"),
+                 "status":"created",
+                 "attempts":0,
+                 "created_at":int(time.time())
+                }
+        self.server.orders[order["id"]] = order
+        self._send(200,order)
+
+
+    def _list_payments(self):
+        query = {key:int(values[0]) for key,values in parse_qs(urlsplit(self.path).query).items() if key in ("from","to","count","skip")}
+
+        since,until = query.get("from",0), query.get("to",2 ** 62)
+        skip,count  = query.get("skip",0), min(query.get("count",10),100)
+
+        payments = [payment for payment in self.server.payments if since <= payment.get("created_at",0) <= until]
+        items    = payments[skip:skip + count]
+
+        self._send(200,{"entity":"collection","count":len(items),"items":items})
+
+
+    def do_GET(self):
+        if urlsplit(self.path).path.rstrip("/") == "/v1/payments":
+            if self._behave():
+                self._list_payments()
+            return
+
+        prefix = "/v1/orders/"
+        if not self.path.startswith(prefix):
+            self._send(404,{"error":{"code":"BAD_REQUEST_ERROR","description":"The requested URL was not found on the server."}})
+            return
+
+        if not self._behave():
+            return
+
+        order = self.server.orders.get(self.path[len(prefix):].strip("/"))
+        if order is None:
+            self._send(400,{"error":{"code":"BAD_REQUEST_ERROR","description":"The id provided does not exist"}})
+            return
+
+        self._send(200,order)
+
+
+
+
+class FakeRazorpayServer(ThreadingHTTPServer):
+
+    daemon_threads     = True
+    request_queue_size = 1024     # load tests open hundreds of connections at once
+
+    def __init__(self,port=0,latency=0.05,jitter=0.0,error_rate=0.0,hang_rate=0.0,hang=30.0,payments=None):
+        super().__init__(("127.0.0.1",port),FakeRazorpayHandler)
+
+        self.latency    = latency
+        self.jitter     = jitter
+        self.error_rate = error_rate
+        self.hang_rate  = hang_rate
+        self.hang       = hang
+        self.orders     = {}
+        self.payments   = sorted(payments or [], key=lambda payment: payment.get("created_at",0), reverse=True)
+        self.requests   = 0
+        self.lock       = threading.Lock()
+
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+    # clients that timed out have hung up by the time a slow answer is written
+    def handle_error(self,request,client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request,client_address)
+
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="fake-razorpay", daemon=True)
+        thread.start()
+        return self
@@ -0,0 +1,310 @@
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from razorpay.constants.url import URL
+import razorpay
+import requests
+import httpx
+import asyncio
+import weakref
+import logging
+import random
+import threading
+import time
+
+
+
+logger = logging.getLogger("payments")
+
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+# the circuit is open, the call was not attempted
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    pass
+
+
+# razorpay rejected the request itself (4xx), retrying the same call cannot help
+class PaymentGatewayRejected(PaymentGatewayError):
+    pass
+
+
+
+
+# per process circuit breaker. `threshold` failures in a row open the circuit and every call fails fast for
+# `cooldown` seconds. after that a single trial call is let through (half open), its outcome closes the
+# circuit again or restarts the cooldown.
+
+class CircuitBreaker:
+
+    CLOSED    = "closed"
+    OPEN      = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,threshold,cooldown):
+        self.threshold = threshold
+        self.cooldown  = cooldown
+        self.lock      = threading.Lock()
+        self.failures  = 0
+        self.opened_at = None
+        self.trial     = False
+
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+
+    def record_success(self):
+        with self.lock:
+            self.failures  = 0
+            self.opened_at = None
+            self.trial     = False
+
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                if self.opened_at is None or self.trial:
+                    logger.warning("Razorpay circuit opened after %s consecutive failures", self.failures)
+                self.opened_at = time.monotonic()
+                self.trial     = False
+
+
+
+
+def backoff_delay(backoff,attempt):
+    delay = backoff * (2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+
+def pooled_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+
+
+# everything the payment views need from razorpay. http goes through one pooled session with connect and
+# read timeouts on every call, transient failures are retried a bounded number of times with jittered
+# exponential backoff, and the circuit breaker stops the request threads from queueing behind a provider
+# that is already failing. every failure surfaces as a PaymentGatewayError.
+
+class RazorpayGateway:
+
+    # errors where the request never reached razorpay, the only ones retried for calls that are not idempotent
+    NOT_SENT = (requests.ConnectionError, requests.ConnectTimeout)
+
+    def __init__(self,key_id,key_secret,base_url=None,timeout=(3.05,10),retries=2,backoff=0.2,
+                 pool_size=20,failure_threshold=5,cooldown=30):
+
+        options = {"base_url":base_url} if base_url else {}
+
+        self.client   = razorpay.Client(session=pooled_session(pool_size), auth=(key_id,key_secret), **options)
+        self.timeout  = timeout
+        self.retries  = retries
+        self.backoff  = backoff
+        self.breaker  = CircuitBreaker(failure_threshold,cooldown)
+
+
+    @classmethod
+    def from_settings(cls):
+        return cls(key_id            = settings.RAZORPAY_KEY_ID,
+                   key_secret        = settings.RAZORPAYKEY_SECRET,
+                   base_url          = settings.RAZORPAY_BASE_URL,
+                   timeout           = (settings.RAZORPAY_CONNECT_TIMEOUT, settings.RAZORPAY_READ_TIMEOUT),
+                   retries           = settings.RAZORPAY_MAX_RETRIES,
+                   backoff           = settings.RAZORPAY_RETRY_BACKOFF,
+                   pool_size         = settings.RAZORPAY_POOL_SIZE,
+                   failure_threshold = settings.RAZORPAY_CIRCUIT_THRESHOLD,
+                   cooldown          = settings.RAZORPAY_CIRCUIT_COOLDOWN
+                  )
+
+
+    def _sleep(self,attempt):
+        time.sleep(backoff_delay(self.backoff,attempt))
+
+
+    # calls that are not idempotent are only retried when the request never left, after a read timeout or a
+    # 5xx the provider may already have acted on it
+    def _call(self,operation,call,idempotent):
+        if not self.breaker.allow():
+            raise PaymentGatewayUnavailable(f"Razorpay circuit is open, {operation} not attempted")
+
+        for attempt in range(self.retries + 1):
+            try:
+                result = call()
+
+            except razorpay.errors.BadRequestError as e:
+                self.breaker.record_success()     # the provider answered, it is healthy
+                raise PaymentGatewayRejected(str(e)) from e
+
+            except (requests.ConnectionError, requests.Timeout, razorpay.errors.ServerError, razorpay.errors.GatewayError, ValueError) as e:
+                retriable = idempotent or isinstance(e,self.NOT_SENT)
+
+                if retriable and attempt < self.retries:
+                    logger.info("Razorpay %s failed (%s), retrying", operation, e.__class__.__name__, extra={"attempt":attempt + 1})
+                    self._sleep(attempt)
+                    continue
+
+                self.breaker.record_failure()
+                raise PaymentGatewayError(f"Razorpay {operation} failed: {e.__class__.__name__}") from e
+
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                raise PaymentGatewayError(f"Razorpay {operation} failed: {e.__class__.__name__}") from e
+
+            self.breaker.record_success()
+            return result
+
+
+    def create_order(self,amount,receipt,currency="INR"):
+        return self._call("order.create",
+                          lambda: self.client.order.create({"amount":amount,"currency":currency,"receipt":receipt}, timeout=self.timeout),
+                          idempotent=False
+                         )
+
+
+    def fetch_order(self,provider_order_id):
+        return self._call("order.fetch",
+                          lambda: self.client.order.fetch(provider_order_id, timeout=self.timeout),
+                          idempotent=True
+                         )
+
+
+    # one page of payments created between since and until (unix seconds), newest first like the api returns them
+    def fetch_payments(self,since,until,count=100,skip=0):
+        return self._call("payment.all",
+                          lambda: self.client.payment.all({"from":since,"to":until,"count":count,"skip":skip}, timeout=self.timeout),
+                          idempotent=True
+                         )
+
+
+    # local hmac check, no http involved
+    def verify_webhook_signature(self,payload,signature,secret):
+        return self.client.utility.verify_webhook_signature(payload,signature,secret)
+
+
+
+
+# the same gateway for async views, with the same retry, timeout and circuit breaker rules as RazorpayGateway.
+# the razorpay sdk is blocking, so this one calls the rest api itself through an httpx.AsyncClient. connections
+# belong to the event loop that opened them, so every loop gets its own pooled client: under an ASGI server
+# that is one client for the whole worker.
+
+class AsyncRazorpayGateway:
+
+    # errors where the request never reached razorpay, safe to retry for any call
+    NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+    def __init__(self,key_id,key_secret,base_url=None,timeout=(3.05,10),retries=2,backoff=0.2,
+                 pool_size=200,failure_threshold=5,cooldown=30):
+
+        self.base_url = (base_url or URL.BASE_URL).rstrip("/") + URL.V1
+        self.auth     = (key_id or "", key_secret or "")
+        self.timeout  = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.limits   = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.retries  = retries
+        self.backoff  = backoff
+        self.breaker  = CircuitBreaker(failure_threshold,cooldown)
+        self.clients  = weakref.WeakKeyDictionary()
+
+
+    @classmethod
+    def from_settings(cls):
+        return cls(key_id            = settings.RAZORPAY_KEY_ID,
+                   key_secret        = settings.RAZORPAYKEY_SECRET,
+                   base_url          = settings.RAZORPAY_BASE_URL,
+                   timeout           = (settings.RAZORPAY_CONNECT_TIMEOUT, settings.RAZORPAY_READ_TIMEOUT),
+                   retries           = settings.RAZORPAY_MAX_RETRIES,
+                   backoff           = settings.RAZORPAY_RETRY_BACKOFF,
+                   pool_size         = settings.RAZORPAY_ASYNC_POOL_SIZE,
+                   failure_threshold = settings.RAZORPAY_CIRCUIT_THRESHOLD,
+                   cooldown          = settings.RAZORPAY_CIRCUIT_COOLDOWN
+                  )
+
+
+    def _client(self):
+        loop   = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+
+        if client is None:
+            client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout, limits=self.limits)
+            self.clients[loop] = client
+
+        return client
+
+
+    # read timeouts, dropped connections and 5xx are only retried for idempotent calls, like RazorpayGateway
+    async def _call(self,operation,method,path,idempotent,**request):
+        if not self.breaker.allow():
+            raise PaymentGatewayUnavailable(f"Razorpay circuit is open, {operation} not attempted")
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self._client().request(method, f"{self.base_url}{path}", **request)
+
+            except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+                failure   = e.__class__.__name__
+                retriable = idempotent or isinstance(e,self.NOT_SENT)
+
+            except httpx.HTTPError as e:
+                self.breaker.record_failure()
+                raise PaymentGatewayError(f"Razorpay {operation} failed: {e.__class__.__name__}") from e
+
+            else:
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    return response.json()
+
+                if response.status_code < 500:
+                    self.breaker.record_success()     # the provider answered, it is healthy
+                    try:
+                        description = response.json()["error"]["description"]
+                    except (ValueError, KeyError, TypeError):
+                        description = response.text
+                    raise PaymentGatewayRejected(description)
+
+                failure   = f"HTTP {response.status_code}"
+                retriable = idempotent
+
+            if retriable and attempt < self.retries:
+                logger.info("Razorpay %s failed (%s), retrying", operation, failure, extra={"attempt":attempt + 1})
+                await asyncio.sleep(backoff_delay(self.backoff,attempt))
+                continue
+
+            self.breaker.record_failure()
+            raise PaymentGatewayError(f"Razorpay {operation} failed: {failure}")
+
+
+    async def create_order(self,amount,receipt,currency="INR"):
+        return await self._call("order.create", "POST", URL.ORDER_URL,
+                                idempotent=False,
+                                json={"amount":amount,"currency":currency,"receipt":receipt}
+                               )
+
+
+    async def fetch_order(self,provider_order_id):
+        return await self._call("order.fetch", "GET", f"{URL.ORDER_URL}/{provider_order_id}", idempotent=True)
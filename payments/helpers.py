@@ -0,0 +1,325 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework import serializers as drf_serializers
+from orders import models as orders_model
+from payments import models as payments_model
+from payments import serializers as payments_serializers
+from payments.gateway import PaymentGatewayUnavailable
+from common.helpers import error_response,success_response,normalize_validation_errors
+from orders.inventory import extend_reservations
+from datetime import timedelta
+from decimal import Decimal,ROUND_HALF_UP
+import logging
+
+
+
+logger = logging.getLogger("payments")
+
+
+
+# the payment flows split around the razorpay call: a database step before it, the gateway call, and a database
+# step after it. the sync views run the three in a row, the async views await the gateway call and run only
+# the database steps through sync_to_async, so no transaction is ever held open across the http call.
+
+
+
+def to_paise(amount):
+    return int((amount * Decimal(100)).quantize(Decimal("1"),rounding=ROUND_HALF_UP))
+
+
+
+def gateway_error_response(e):
+    if isinstance(e,PaymentGatewayUnavailable):
+        return error_response(message = "Payment gateway is temporarily unavailable, please try again shortly.",
+                              status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+                             )
+
+    return error_response(message = "Payment gateway failed, please try again.",
+                          status_code = status.HTTP_502_BAD_GATEWAY
+                         )
+
+
+
+# the gateway call failed, let the customer try again straight away
+
+def release_payment(payment_id):
+    with transaction.atomic():
+        payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=payment_id)
+        payment_instance.processing_started_at = None
+        payment_instance.save(update_fields=["processing_started_at"])
+
+
+
+
+# returns (payment, order id, None) when razorpay has to be called for the payment,
+# (None, order id, response) when the request is answered without it
+
+def begin_initiation(user,data):
+    serializer = payments_serializers.PaymentInitiateSerializer(data=data)
+    order_id   = None
+
+    try:
+        if serializer.is_valid(raise_exception = True):
+            order_id = serializer.validated_data["order_id"]
+
+        order_instance = orders_model.OrderModel.objects.get(order_id=order_id,user=user)
+
+    except drf_serializers.ValidationError as e:
+        message,data = normalize_validation_errors(e.detail)
+
+        return None,order_id,error_response(message = message,
+                                            data    = data,
+                                            status_code = status.HTTP_400_BAD_REQUEST
+                                           )
+
+    except orders_model.OrderModel.DoesNotExist:
+        return None,order_id,error_response(message = "Invalid order id.",
+                                            data    = {"order_id":order_id},
+                                            status_code = status.HTTP_404_NOT_FOUND
+                                           )
+
+
+    if order_instance.status == "PAID":
+        return None,order_id,error_response(message = "Order already paid.",
+                                            data    = {"order_id":order_id},
+                                            status_code = status.HTTP_400_BAD_REQUEST
+                                           )
+
+
+    if order_instance.items.filter(status__in=orders_model.OrderItemModel.BLOCKED_STATUSES_PAYMENT).exists():
+        return None,order_id,error_response(message = "Payment cannot be made for this order.",
+                                            data    = {"order_id":order_id},
+                                            status_code =  status.HTTP_409_CONFLICT
+                                           )
+
+    try:
+        with transaction.atomic():
+
+            payment_instance = payments_model.PaymentModel.objects.select_for_update().filter(order=order_instance,method="RAZORPAY",status="PENDING").first()
+
+            if not payment_instance:
+                raise drf_serializers.ValidationError({"error_message":"Payment not eligible.",
+                                                       "data":{"order_id":order_id}
+                                                     })
+
+
+            if payment_instance.provider_order_id:
+                return None,order_id,success_response(message = "payment was already initiated.",
+                                                      data    = {"razorpay_order_id":payment_instance.provider_order_id,
+                                                                 "razorpay_key": settings.RAZORPAY_KEY_ID,
+                                                                 "order_id":order_id,
+                                                                 "amount": to_paise(payment_instance.amount),
+                                                                 "currency":"INR"
+                                                                },
+                                                      status_code = status.HTTP_200_OK
+                                                     )
+
+
+            payment_processing_timeout = timezone.now() - timedelta(minutes=2)
+
+            if payment_instance.processing_started_at:
+                if payment_instance.processing_started_at >= payment_processing_timeout:
+                    raise drf_serializers.ValidationError({"error_message":"Payment is already being processed.",
+                                                           "data":{"order_id":order_id}
+                                                         })
+
+            payment_instance.processing_started_at = timezone.now()
+            payment_instance.save(update_fields=["processing_started_at"])
+
+            extend_reservations(order_instance)     # keep the stock while the customer is paying
+
+    except drf_serializers.ValidationError as e:
+        message,data = normalize_validation_errors(e.detail)
+
+        return None,order_id,error_response(message = message,
+                                            data    = data,
+                                            status_code = status.HTTP_400_BAD_REQUEST
+                                           )
+
+    return payment_instance,order_id,None
+
+
+
+def finish_initiation(payment_id,order_id,razorpay_order):
+    with transaction.atomic():
+        payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=payment_id)
+
+        payment_instance.provider_order_id = razorpay_order["id"]
+        payment_instance.processing_started_at = None
+        payment_instance.save(update_fields=["provider_order_id","processing_started_at"])
+
+
+    return success_response(message = "Payment initiation successful",
+                            data    = {"razorpay_order_id":razorpay_order["id"],
+                                       "razorpay_key":settings.RAZORPAY_KEY_ID,
+                                       "order_id":order_id,
+                                       "amount":razorpay_order["amount"],
+                                       "currency":"INR"
+                                      },
+                            status_code = status.HTTP_200_OK
+                           )
+
+
+
+
+# same contract as begin_initiation, the payment is the previous attempt that the retry replaces
+
+def begin_retry(user,data):
+    serializer = payments_serializers.PaymentInitiateSerializer(data=data)
+    order_id   = None
+
+    try:
+        if serializer.is_valid(raise_exception=True):
+            order_id = serializer.validated_data["order_id"]
+
+        order_instance = orders_model.OrderModel.objects.get(order_id=order_id,user=user)
+
+
+        if order_instance.status == "PAID":
+            raise drf_serializers.ValidationError({"error_message":"Payment already done",
+                                                   "data":{"order_id":order_id}
+                                                 })
+
+
+        if order_instance.items.filter(status__in=orders_model.OrderItemModel.BLOCKED_STATUSES_PAYMENT).exists():
+            raise drf_serializers.ValidationError({"error_message":"Payment cannot be made for this order",
+                                                   "data":{"order_id":order_id}
+                                                 })
+
+        with transaction.atomic():
+
+            prev_payment_instance = payments_model.PaymentModel.objects.select_for_update().filter(order=order_instance,method="RAZORPAY").order_by('-created_at').first()
+
+
+            if not prev_payment_instance:
+                raise drf_serializers.ValidationError({"error_message":"No initial payment attempt found.",
+                                                       "data":{"order_id":order_id}
+                                                     })
+
+
+            if prev_payment_instance.status == "SUCCESS":
+                raise drf_serializers.ValidationError({"error_message":"Payment already completed",
+                                                       "data":{"order_id":order_id}
+                                                     })
+
+
+            if prev_payment_instance.status == "REFUNDED":
+                raise drf_serializers.ValidationError({"error_message":"Payment was refunded, retry not available",
+                                                       "data":{"order_id":order_id}
+                                                     })
+
+
+            cutoff_time = timezone.now() - timedelta(minutes=15)
+
+            if prev_payment_instance.status == "PENDING":
+                if prev_payment_instance.created_at >= cutoff_time:
+                    raise drf_serializers.ValidationError({"error_message":"Previous payment is still in progress",
+                                                           "data":{"order_id":order_id}
+                                                         })
+
+
+            payment_processing_timeout = timezone.now() - timedelta(minutes=2)
+
+            if prev_payment_instance.processing_started_at:
+                if prev_payment_instance.processing_started_at >= payment_processing_timeout:
+                    raise drf_serializers.ValidationError({"error_message":"Payment is being processed.",
+                                                           "data":{"order_id":order_id}
+                                                         })
+
+
+            prev_payment_instance.processing_started_at = timezone.now()
+            prev_payment_instance.save(update_fields=["processing_started_at"])
+
+            extend_reservations(order_instance)
+
+
+    except drf_serializers.ValidationError as e:
+        message,data = normalize_validation_errors(e.detail)
+
+        return None,order_id,error_response(message = message,
+                                            data    = data,
+                                            status_code = status.HTTP_400_BAD_REQUEST
+                                           )
+
+    except orders_model.OrderModel.DoesNotExist:
+        return None,order_id,error_response(message = "Invalid order id",
+                                            data={"order_id":order_id},
+                                            status_code = status.HTTP_400_BAD_REQUEST
+                                           )
+
+    return prev_payment_instance,order_id,None
+
+
+
+def finish_retry(prev_payment_id,order_id,razorpay_order):
+    with transaction.atomic():
+        prev_payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=prev_payment_id)
+
+        payments_model.PaymentModel.objects.create(order_id = prev_payment_instance.order_id,
+                                                   method   = "RAZORPAY",
+                                                   status   = "PENDING",
+                                                   amount   = prev_payment_instance.amount,
+                                                   currency = "INR",
+                                                   provider_order_id = razorpay_order["id"]
+                                                  )
+        prev_payment_instance.status = "FAILED"
+        prev_payment_instance.processing_started_at = None
+        prev_payment_instance.save(update_fields=["status","processing_started_at"])
+
+
+    logger.info("Payment retry initiated",extra={"order_id":order_id,
+                                                 "previous_payment_status":prev_payment_instance.status,
+                                                 "previous_payment_id":prev_payment_instance.id
+                                                }
+               )
+
+    return success_response(message = "Payment re-initiation successful",
+                            data    = {"razorpay_order_id":razorpay_order["id"],
+                                       "razorpay_key":settings.RAZORPAY_KEY_ID,
+                                       "order_id":order_id,
+                                       "amount":razorpay_order["amount"],
+                                       "currency":razorpay_order["currency"],
+                                      },
+                            status_code = status.HTTP_200_OK
+                           )
+
+
+
+
+def payment_status_response(user,order_id):
+    try:
+        order_instance = orders_model.OrderModel.objects.get(order_id=order_id,user=user)
+    except orders_model.OrderModel.DoesNotExist:
+        return error_response(message = "Invalid order id",
+                              data    = {"order_id":order_id},
+                              status_code = status.HTTP_404_NOT_FOUND
+                             )
+
+    payment_instance = order_instance.payments.order_by('-created_at').first()
+
+    if payment_instance is None:
+        return error_response(message = "No payment attempts done.",
+                              data    =  {"order_id":order_id},
+                              status_code = status.HTTP_404_NOT_FOUND
+                             )
+
+    cutoff_time = timezone.now() - timedelta(minutes=15)
+    retry_allowed = False
+    if payment_instance.status == "FAILED" or (payment_instance.status == "PENDING" and payment_instance.created_at < cutoff_time):
+        retry_allowed = True
+
+
+    data = {"order_id":order_instance.order_id,
+            "order_status":order_instance.status,
+            "payment_status": payment_instance.status,
+            "retry_allowed": retry_allowed
+           }
+
+    serializer = payments_serializers.PaymentStatusSerializer(instance=data)
+
+    return success_response(message = "Payment status fetched successfuly.",
+                            data    = serializer.data,
+                            status_code = status.HTTP_200_OK
+                           )
@@ -0,0 +1,178 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from orders import models as orders_models
+from payments import models as payments_models
+from payments.fake_razorpay import FakeRazorpayServer
+from decimal import Decimal
+import asyncio
+import httpx
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+
+
+BENCH_USER = "payment-bench"
+
+# the per user throttle allows 100 requests a minute, the load is spread over enough users to stay under it
+REQUESTS_PER_USER = 50
+
+
+# (label, server command, payment initiation path). {port}, {workers} and {threads} are filled in per run.
+
+SERVERS = [("wsgi", ["gunicorn", "ecommerce_api.wsgi:application", "--bind", "127.0.0.1:{port}",
+                     "--workers", "{workers}", "--threads", "{threads}", "--log-level", "warning"],
+            "/api/payments/initiate/"),
+           ("asgi", ["uvicorn", "ecommerce_api.asgi:application", "--port", "{port}",
+                     "--workers", "{asgi_workers}", "--log-level", "warning"],
+            "/api/payments/async/initiate/"),
+          ]
+
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1",0))
+        return sock.getsockname()[1]
+
+
+
+def wait_for_port(port,process,timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f"server exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1",port),timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f"server did not listen on {port} within {timeout}s")
+
+
+
+
+class Command(BaseCommand):
+    help = ("Compares payment initiation throughput of the sync views under gunicorn (WSGI) and the async views "
+            "under uvicorn (ASGI) against a fake razorpay that takes --latency-ms per call. Creates its own users "
+            "and orders and deletes them afterwards.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=200)
+        parser.add_argument("--latency-ms", type=float, default=500)
+        parser.add_argument("--workers", type=int, default=1, help="gunicorn worker processes")
+        parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+        parser.add_argument("--asgi-workers", type=int, default=1, help="uvicorn worker processes")
+        parser.add_argument("--only", choices=[label for label,_,_ in SERVERS])
+
+
+    def users(self,count):
+        users = []
+        for number in range(count):
+            user,_ = get_user_model().objects.get_or_create(username=f"{BENCH_USER}-{number}", defaults={"email":f"{BENCH_USER}-{number}@example.com"})
+            users.append((user,str(RefreshToken.for_user(user).access_token)))
+        return users
+
+
+    # [(order id, access token of its owner)]
+    def orders(self,users,count):
+        orders = orders_models.OrderModel.objects.bulk_create([orders_models.OrderModel(user         = users[number % len(users)][0],
+                                                                                        order_id     = str(uuid.uuid4()),
+                                                                                        name         = "Bench",
+                                                                                        phone        = "+919999999999",
+                                                                                        address_line = "1 Bench Street",
+                                                                                        city         = "Bengaluru",
+                                                                                        state        = "KA",
+                                                                                        pincode      = "560001",
+                                                                                        subtotal     = Decimal("500.00"),
+                                                                                        shipping_fee = Decimal("0.00"),
+                                                                                        grand_total  = Decimal("500.00")
+                                                                                       ) for number in range(count)
+                                                              ])
+        tokens = {user.id:token for user,token in users}
+        orders = orders_models.OrderModel.objects.filter(order_id__in=[order.order_id for order in orders])
+
+        payments_models.PaymentModel.objects.bulk_create([payments_models.PaymentModel(order=order, method="RAZORPAY", amount=order.grand_total)
+                                                          for order in orders
+                                                         ])
+        return [(order.order_id,tokens[order.user_id]) for order in orders]
+
+
+    def cleanup(self,users):
+        payments_models.PaymentModel.objects.filter(order__user__in=[user for user,_ in users]).delete()
+        orders_models.OrderModel.objects.filter(user__in=[user for user,_ in users]).delete()
+
+
+    async def load(self,base_url,path,orders,concurrency):
+        limits    = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        statuses  = {}
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+
+            async def initiate(order_id,token):
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(path, json={"order_id":order_id}, headers={"Authorization":f"Bearer {token}"})
+                        code     = response.status_code
+                    except httpx.HTTPError as e:
+                        code = e.__class__.__name__
+                    latencies.append(time.perf_counter() - started)
+                    statuses[code] = statuses.get(code,0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*[initiate(order_id,token) for order_id,token in orders])
+            elapsed = time.perf_counter() - started
+
+        return elapsed,latencies,statuses
+
+
+    def run(self,label,command,path,options,gateway,orders):
+        port = free_port()
+        argv = [sys.executable, "-m"] + [part.format(port=port, **options) for part in command]
+        env  = dict(os.environ, RAZORPAY_BASE_URL=gateway.url)
+
+        process = subprocess.Popen(argv, cwd=settings.BASE_DIR, env=env)
+        try:
+            wait_for_port(port,process)
+            before = gateway.requests
+            elapsed,latencies,statuses = asyncio.run(self.load(f"http://127.0.0.1:{port}", path, orders, options["concurrency"]))
+        finally:
+            process.terminate()
+            process.wait(10)
+
+        latencies.sort()
+        self.stdout.write(f"{label}: {len(orders)} initiations in {elapsed:.2f}s = {len(orders) / elapsed:.1f} req/s, "
+                          f"p50 {statistics.median(latencies) * 1000:.0f}ms, p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms, "
+                          f"gateway calls {gateway.requests - before}, statuses {statuses}"
+                         )
+
+
+    def handle(self,*args,**options):
+        options = {**options, "workers":str(options["workers"]), "threads":str(options["threads"]), "asgi_workers":str(options["asgi_workers"])}
+
+        users   = self.users(-(-options["requests"] // REQUESTS_PER_USER))
+        gateway = FakeRazorpayServer(latency=options["latency_ms"] / 1000).start()
+
+        self.stdout.write(f"fake razorpay at {gateway.url}, {options['latency_ms']:.0f}ms per call, "
+                          f"{options['requests']} requests at concurrency {options['concurrency']}, "
+                          f"gunicorn {options['workers']}x{options['threads']} threads vs uvicorn {options['asgi_workers']} worker(s)"
+                         )
+
+        try:
+            for label,command,path in SERVERS:
+                if options["only"] in (None,label):
+                    self.run(label, command, path, options, gateway, self.orders(users,options["requests"]))
+        finally:
+            self.cleanup(users)
+            gateway.shutdown()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from payments.fake_razorpay import FakeRazorpayServer
+from payments.reconciliation import iter_file_records
+
+
+
+class Command(BaseCommand):
+    help = ("Runs a local fake of the razorpay orders api. Point RAZORPAY_BASE_URL at it to exercise "
+            "the payment views without the network.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=float, default=50)
+        parser.add_argument("--jitter-ms", type=float, default=0)
+        parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered with a 500")
+        parser.add_argument("--hang-rate", type=float, default=0, help="share of requests that never answer in time")
+        parser.add_argument("--hang-seconds", type=float, default=30)
+        parser.add_argument("--payments", help="json lines or csv file of payment entities served on GET /v1/payments")
+
+
+    def handle(self,*args,**options):
+        server = FakeRazorpayServer(port       = options["port"],
+                                    latency    = options["latency_ms"] / 1000,
+                                    jitter     = options["jitter_ms"] / 1000,
+                                    error_rate = options["error_rate"],
+                                    hang_rate  = options["hang_rate"],
+                                    hang       = options["hang_seconds"],
+                                    payments   = list(iter_file_records(options["payments"])) if options["payments"] else None
+                                   )
+
+        self.stdout.write(f"fake razorpay listening on {server.url}, set RAZORPAY_BASE_URL={server.url}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"served {server.requests} requests")
@@ -0,0 +1,117 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from payments.fake_razorpay import FakeRazorpayServer
+from payments.gateway import RazorpayGateway, PaymentGatewayError, PaymentGatewayUnavailable, PaymentGatewayRejected
+import razorpay
+import statistics
+import threading
+import time
+
+
+
+class Command(BaseCommand):
+    help = ("Load tests the razorpay gateway adapter against the local fake razorpay server (or --base-url) "
+            "and reports latency, failures and calls the circuit breaker failed fast. --compare runs the same "
+            "load through a bare razorpay.Client (no timeouts, retries or breaker).")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--calls", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=20, help="concurrent callers, think request threads")
+        parser.add_argument("--base-url", help="an already running fake, by default one is started in process")
+        parser.add_argument("--latency-ms", type=float, default=50)
+        parser.add_argument("--jitter-ms", type=float, default=20)
+        parser.add_argument("--error-rate", type=float, default=0)
+        parser.add_argument("--hang-rate", type=float, default=0)
+        parser.add_argument("--hang-seconds", type=float, default=5)
+        parser.add_argument("--read-timeout", type=float, default=1)
+        parser.add_argument("--retries", type=int, default=2)
+        parser.add_argument("--threshold", type=int, default=5)
+        parser.add_argument("--cooldown", type=float, default=5)
+        parser.add_argument("--compare", action="store_true")
+
+
+    def run(self,create,calls,workers):
+        outcomes  = {"ok":0,"rejected":0,"failed":0,"fast_failed":0}
+        latencies = []
+        lock      = threading.Lock()
+
+        def call(index):
+            started = time.perf_counter()
+            try:
+                create(index)
+                outcome = "ok"
+            except PaymentGatewayUnavailable:
+                outcome = "fast_failed"
+            except PaymentGatewayRejected:
+                outcome = "rejected"
+            except Exception:
+                outcome = "failed"
+
+            with lock:
+                outcomes[outcome] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(call, range(calls)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {**outcomes,
+                "elapsed":elapsed,
+                "p50":statistics.median(latencies),
+                "p95":latencies[max(int(len(latencies) * 0.95) - 1, 0)],
+                "max":latencies[-1]
+               }
+
+
+    def report(self,label,result,requests):
+        self.stdout.write(f"{label:<10} {result['elapsed']:7.2f} s  p50 {result['p50']:8.1f} ms  p95 {result['p95']:8.1f} ms  "
+                          f"max {result['max']:8.1f} ms  ok {result['ok']}  failed {result['failed']}  "
+                          f"fast failed {result['fast_failed']}  rejected {result['rejected']}  provider requests {requests}")
+
+
+    def handle(self,*args,**options):
+        server = None
+        if options["base_url"]:
+            base_url = options["base_url"]
+        else:
+            server = FakeRazorpayServer(latency    = options["latency_ms"] / 1000,
+                                        jitter     = options["jitter_ms"] / 1000,
+                                        error_rate = options["error_rate"],
+                                        hang_rate  = options["hang_rate"],
+                                        hang       = options["hang_seconds"]
+                                       ).start()
+            base_url = server.url
+
+        self.stdout.write(f"{options['calls']} order.create calls over {options['workers']} workers against {base_url}")
+
+        gateway = RazorpayGateway(key_id            = "rzp_test_fake",
+                                  key_secret        = "fake",
+                                  base_url          = base_url,
+                                  timeout           = (1, options["read_timeout"]),
+                                  retries           = options["retries"],
+                                  backoff           = 0.05,
+                                  pool_size         = options["workers"],
+                                  failure_threshold = options["threshold"],
+                                  cooldown          = options["cooldown"]
+                                 )
+
+        try:
+            runs = [("adapter", lambda index: gateway.create_order(amount=50000, receipt=f"load-{index}"))]
+
+            if options["compare"]:
+                client = razorpay.Client(auth=("rzp_test_fake","fake"), base_url=base_url)
+                runs.append(("bare", lambda index: client.order.create({"amount":50000,"currency":"INR","receipt":f"load-{index}"})))
+
+            for label,create in runs:
+                before = server.requests if server else 0
+                result = self.run(create,options["calls"],options["workers"])
+                self.report(label, result, server.requests - before if server else "-")
+
+            self.stdout.write(f"circuit: {gateway.breaker.state}")
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from payments.webhooks import process_pending_events
+import logging
+import signal
+import threading
+import time
+
+
+
+logger = logging.getLogger("payments")
+
+
+
+class Command(BaseCommand):
+    help = ("Applies the razorpay webhook events stored by the webhook view. --workers threads drain the inbox "
+            "in batches, runs once by default, --loop keeps the pool running until stopped.")
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--loop", action="store_true", help="keep polling every --interval seconds until stopped")
+        parser.add_argument("--interval", type=float, default=1)
+
+
+    def drain(self,batch_size,totals,lock):
+        while True:
+            started = time.perf_counter()
+            result  = process_pending_events(batch_size=batch_size)
+
+            with lock:
+                for key,count in result.items():
+                    totals[key] += count
+
+            if result["processed"] or result["failed"] or result["retrying"]:
+                logger.info("webhook batch processed=%s failed=%s retrying=%s deferred=%s duration_ms=%.1f",
+                            result["processed"], result["failed"], result["retrying"], result["deferred"],
+                            (time.perf_counter() - started) * 1000
+                           )
+
+            # an empty batch, or only events waiting on an older event another worker holds
+            if not (result["processed"] or result["failed"] or result["retrying"]):
+                return
+
+
+    def work(self,options,totals,lock,stopping):
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    self.drain(options["batch_size"],totals,lock)
+                except Exception:     # a lost connection or deadlock, the events stay pending for the next pass
+                    logger.exception("webhook worker pass failed")
+                    if not options["loop"]:
+                        raise
+
+                if not options["loop"] or stopping.wait(options["interval"]):
+                    return
+        finally:
+            connection.close()
+
+
+    def handle(self,*args,**options):
+        stopping = threading.Event()
+        if options["loop"]:
+            signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+        totals = {"processed":0,"failed":0,"retrying":0,"deferred":0}
+        lock   = threading.Lock()
+
+        workers = [threading.Thread(target=self.work, args=(options,totals,lock,stopping), name=f"webhook-worker-{number}")
+                   for number in range(max(options["workers"],1))
+                  ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            stopping.set()
+            for worker in workers:
+                worker.join()
+
+        self.stdout.write(self.style.SUCCESS(f"processed {totals['processed']} events, {totals['failed']} failed for good, "
+                                             f"{totals['retrying']} attempts to retry"
+                                            ))
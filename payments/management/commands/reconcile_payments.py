@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from payments.reconciliation import CHUNK_SIZE, reconcile, iter_file_records, iter_api_records
+from payments.razorpay import razorpay_gateway
+from datetime import datetime, timedelta
+import json
+import os
+import sys
+import time
+
+
+
+class Command(BaseCommand):
+    help = ("Matches razorpay payment records against local payments and fixes the ones left PENDING or FAILED "
+            "by a lost webhook. Reads an export file (--file, csv or json lines) or pages the payments api (--api). "
+            "Dry run unless --apply, rows that need a human are written as json lines to --report.")
+
+
+    def add_arguments(self,parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument("--file", help="payments export, .csv with api field names as columns or json lines")
+        source.add_argument("--api", action="store_true", help="page through the razorpay payments api")
+
+        parser.add_argument("--since", help="api window start, YYYY-MM-DD (default: 2 days ago)")
+        parser.add_argument("--until", help="api window end, YYYY-MM-DD (default: now)")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--apply", action="store_true", help="write the corrections, otherwise only count them")
+        parser.add_argument("--report", help="file for rows that need review (default: stdout)")
+
+
+    def window(self,options):
+        def parse(value):
+            try:
+                return int(datetime.strptime(value,"%Y-%m-%d").replace(tzinfo=timezone.get_current_timezone()).timestamp())
+            except ValueError:
+                raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+        since = parse(options["since"]) if options["since"] else int((timezone.now() - timedelta(days=2)).timestamp())
+        until = parse(options["until"]) if options["until"] else int(timezone.now().timestamp())
+        return since,until
+
+
+    def handle(self,*args,**options):
+        if options["file"]:
+            if not os.path.isfile(options["file"]):
+                raise CommandError(f"No such file: {options['file']}")
+            records = iter_file_records(options["file"])
+        else:
+            records = iter_api_records(razorpay_gateway,*self.window(options))
+
+        output = open(options["report"],"w") if options["report"] else sys.stdout
+
+        def report(kind,record,payment):
+            output.write(json.dumps({"kind":kind,
+                                     "razorpay_payment_id":record.get("id"),
+                                     "razorpay_order_id":record.get("order_id"),
+                                     "provider_status":record.get("status"),
+                                     "provider_amount":record.get("amount"),
+                                     "payment_id":payment.id if payment else None,
+                                     "payment_status":payment.status if payment else None,
+                                     "order_status":payment.order.status if payment else None
+                                    }) + "\n")
+
+        started = time.perf_counter()
+        try:
+            totals = reconcile(records, apply=options["apply"], chunk_size=options["chunk_size"], report=report)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        verb = "corrected" if options["apply"] else "would correct"
+        self.stderr.write(self.style.SUCCESS(f"{totals['records']} provider records ({totals['skipped']} skipped), {totals['matched']} matched, "
+                                             f"{verb} {totals['captured']} to SUCCESS and {totals['failed']} to FAILED, "
+                                             f"{totals['review']} to review, {totals['unmatched']} captured with no local payment "
+                                             f"in {time.perf_counter() - started:.1f}s"
+                                            ))
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_orderitemmodel_orderitem_order_status_idx_and_more'),
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentmodel',
+            index=models.Index(fields=['order', 'method', 'status'], name='payment_order_meth_status_idx'),
+        ),
+    ]
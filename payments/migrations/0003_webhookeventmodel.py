@@ -0,0 +1,31 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_paymentmodel_payment_order_meth_status_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEventModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event', models.CharField(max_length=100)),
+                ('provider_order_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSED', 'Processed'), ('FAILED', 'Failed')], default='PENDING', max_length=50)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'received_at'], name='webhook_status_received_idx'), models.Index(fields=['provider_order_id', 'received_at'], name='webhook_order_received_idx')],
+            },
+        ),
+    ]
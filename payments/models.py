@@ -35,6 +35,10 @@ class PaymentModel(models.Model):
         return f"{self.order.order_id} - {self.provider} - {self.status}"
 
 
+    class Meta:
+        indexes = [models.Index(fields=["order","method","status"], name="payment_order_meth_status_idx")]
+
+
 
 
 
@@ -78,4 +82,39 @@ class RefundItemModel(models.Model):
 
     
     def __str__(self):
-        return f"{self.item.name} - {self.status}"
\ No newline at end of file
+        return f"{self.item.name} - {self.status}"
+
+
+
+
+# inbox of verified razorpay webhook events. the webhook only stores the raw event, process_webhook_events
+# applies them later. event_id is razorpay's X-Razorpay-Event-Id, so a redelivered event is stored once.
+
+class WebhookEventModel(models.Model):
+
+    STATUS_CHOICES = [("PENDING","Pending"),
+                      ("PROCESSED","Processed"),
+                      ("FAILED","Failed"),
+                     ]
+
+    event_id          = models.CharField(max_length=255, unique=True, null=False, blank=False)
+    event             = models.CharField(max_length=100, null=False, blank=False)
+    provider_order_id = models.CharField(max_length=255, null=True, blank=True)
+    payload           = models.JSONField()
+
+    status     = models.CharField(max_length=50, choices=STATUS_CHOICES, default="PENDING")
+    attempts   = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+
+    received_at  = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+
+    def __str__(self):
+        return f"{self.event_id} - {self.event} - {self.status}"
+
+
+    class Meta:
+        indexes = [models.Index(fields=["status","received_at"], name="webhook_status_received_idx"),
+                   models.Index(fields=["provider_order_id","received_at"], name="webhook_order_received_idx"),
+                  ]
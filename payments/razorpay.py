@@ -1,6 +1,5 @@
-import razorpay
-from django.conf import settings
+from payments.gateway import RazorpayGateway, AsyncRazorpayGateway
 
-razorpay_client = razorpay.Client(
-                                  auth=(settings.RAZORPAY_KEY_ID,settings.RAZORPAYKEY_SECRET)
-                                 )
\ No newline at end of file
+razorpay_gateway = RazorpayGateway.from_settings()
+
+async_razorpay_gateway = AsyncRazorpayGateway.from_settings()
@@ -0,0 +1,182 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from orders import models as orders_model
+from payments import models as payments_model
+from payments.helpers import to_paise
+from itertools import islice
+import csv
+import json
+import logging
+
+
+
+logger = logging.getLogger("payments")
+
+
+CHUNK_SIZE = 5000
+
+
+
+# provider payment records are razorpay payment entities (id, order_id, status, amount in paise, currency,
+# created_at). both sources below are generators, nothing is read ahead of the chunk being reconciled.
+
+# a dashboard/report export, csv with the api field names as columns or json lines (one entity per line)
+
+def iter_file_records(path):
+    with open(path, newline="", encoding="utf-8") as export:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(export):
+                row["amount"] = int(row["amount"]) if row.get("amount") else None
+                yield row
+            return
+
+        for line in export:
+            if line.strip():
+                yield json.loads(line)
+
+
+
+# the payments api, page by page. since and until are unix seconds.
+
+def iter_api_records(gateway,since,until,page_size=100):
+    skip = 0
+
+    while True:
+        items = gateway.fetch_payments(since,until,count=page_size,skip=skip).get("items",[])
+        yield from items
+
+        if len(items) < page_size:
+            return
+        skip += len(items)
+
+
+
+def chunks(records,size):
+    records = iter(records)
+    while chunk := list(islice(records,size)):
+        yield chunk
+
+
+
+# builds the hash indexes for one chunk: razorpay order id -> record and razorpay payment id -> record.
+# an order can carry several payment attempts, a captured one wins over the failed ones.
+
+def _index(chunk,totals,report):
+    by_order   = {}
+    by_payment = {}
+
+    for record in chunk:
+        totals["records"] += 1
+
+        if not record.get("id") or not record.get("order_id"):
+            totals["skipped"] += 1
+            continue
+
+        by_payment[record["id"]] = record
+
+        current = by_order.get(record["order_id"])
+        if current is None or current["status"] != "captured":
+            by_order[record["order_id"]] = record
+
+        elif record["status"] == "captured" and record["id"] != current["id"]:
+            report("duplicate_capture", record, None)
+            totals["review"] += 1
+
+    return by_order,by_payment
+
+
+
+
+# reconciles one chunk in one transaction. local razorpay payments are looked up by both ids with one query
+# and compared in memory:
+#   provider captured, local PENDING/FAILED, order still PENDING and amounts agree -> payment SUCCESS, order and items PAID
+#   provider failed, local PENDING                                                 -> payment FAILED
+#   captured but the order moved on (cancelled by the sweeper, ...) or the amount differs -> reported for review
+#   captured with no local payment at all                                          -> reported for review
+# with apply the payments and their orders are locked first and every correction is a handful of bulk updates.
+
+def _reconcile_chunk(chunk,apply,totals,report):
+    by_order,by_payment = _index(chunk,totals,report)
+    if not by_order:
+        return
+
+    with transaction.atomic():
+        payments = (payments_model.PaymentModel.objects.filter(method="RAZORPAY")
+                                                       .filter(Q(provider_order_id__in=list(by_order)) | Q(provider_payment_id__in=list(by_payment)))
+                                                       .select_related("order")
+                                                       .only("id","status","amount","currency","provider_order_id","provider_payment_id","order__id","order__status")
+                                                       .order_by("id")
+                   )
+        if apply:
+            payments = payments.select_for_update()
+
+        captured = []
+        failed   = []
+        seen     = set()
+
+        for payment in payments:
+            record = by_payment.get(payment.provider_payment_id) or by_order.get(payment.provider_order_id)
+            if record is None:
+                continue
+
+            seen.add(record["order_id"])
+            totals["matched"] += 1
+
+            if record["status"] == "captured" and payment.status in ["PENDING","FAILED"]:
+                if record.get("amount") != to_paise(payment.amount):
+                    report("amount_mismatch", record, payment)
+                    totals["review"] += 1
+                elif payment.order.status != "PENDING":
+                    report("captured_after_order_closed", record, payment)
+                    totals["review"] += 1
+                else:
+                    payment.status              = "SUCCESS"
+                    payment.provider_payment_id = record["id"]
+                    captured.append(payment)
+
+            elif record["status"] == "failed" and payment.status == "PENDING" and not payment.provider_payment_id:
+                payment.status              = "FAILED"
+                payment.provider_payment_id = record["id"]
+                failed.append(payment)
+
+        for order_id,record in by_order.items():
+            if record["status"] == "captured" and order_id not in seen:
+                report("unknown_payment", record, None)
+                totals["unmatched"] += 1
+
+        totals["captured"] += len(captured)
+        totals["failed"]   += len(failed)
+
+        if not apply or not (captured or failed):
+            return
+
+        now = timezone.now()
+        for payment in captured + failed:
+            payment.updated_at = now
+
+        payments_model.PaymentModel.objects.bulk_update(captured + failed, ["status","provider_payment_id","updated_at"])
+
+        order_ids = [payment.order_id for payment in captured]
+        if order_ids:
+            orders_model.OrderModel.objects.filter(id__in=order_ids, status="PENDING").update(status="PAID", updated_at=now)
+            orders_model.OrderItemModel.objects.filter(order_id__in=order_ids, status="PENDING").update(status="PAID", updated_at=now)
+            orders_model.StockReservationModel.objects.filter(order_id__in=order_ids, status="ACTIVE").update(status="COMMITTED", updated_at=now)
+
+        logger.info("Reconciliation corrected payments", extra={"captured":len(captured), "failed":len(failed)})
+
+
+
+
+# streams provider records through the matcher chunk_size at a time, so memory stays flat however long the
+# export is. nothing is written unless apply is set. report(kind, record, payment) gets every row that needs
+# a human, payment is None when there is no local row.
+
+def reconcile(records,apply=False,chunk_size=CHUNK_SIZE,report=None):
+    totals = {"records":0,"skipped":0,"matched":0,"captured":0,"failed":0,"review":0,"unmatched":0}
+    report = report or (lambda kind,record,payment: None)
+
+    for chunk in chunks(records,chunk_size):
+        _reconcile_chunk(chunk,apply,totals,report)
+
+    return totals
@@ -1,3 +1,189 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from unittest import mock
+from datetime import timedelta
+from orders.inventory import create_reservations, release_expired_reservations
+from orders.tests import create_order, create_product
+from payments import models as payments_models
+from payments.gateway import RazorpayGateway, PaymentGatewayError
+from payments.reconciliation import iter_file_records, reconcile
+from payments.webhooks import store_event, process_pending_events
+from products import models as product_models
+import json
+import os
+import razorpay
+import requests
+import tempfile
 
-# Create your tests here.
+
+
+# order.create is only retried when the request never reached razorpay, fetches are retried on any transient error
+
+class GatewayRetryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.gateway = RazorpayGateway("key", "secret", retries=2, backoff=0)
+
+
+    def attempts(self,method,error,call):
+        with mock.patch.object(self.gateway.client.order, method, side_effect=error) as patched:
+            with self.assertRaises(PaymentGatewayError):
+                call()
+        return patched.call_count
+
+
+    def test_create_order_retries_unsent_requests(self):
+        for error in [requests.ConnectionError(), requests.ConnectTimeout()]:
+            self.assertEqual(self.attempts("create", error, lambda: self.gateway.create_order(100,"receipt")),3)
+
+
+    def test_create_order_does_not_retry_sent_requests(self):
+        for error in [requests.ReadTimeout(), razorpay.errors.ServerError("down"), razorpay.errors.GatewayError("bad"), ValueError()]:
+            self.assertEqual(self.attempts("create", error, lambda: self.gateway.create_order(100,"receipt")),1)
+
+
+    def test_fetch_order_retries_transient_errors(self):
+        for error in [requests.ReadTimeout(), razorpay.errors.ServerError("down")]:
+            self.assertEqual(self.attempts("fetch", error, lambda: self.gateway.fetch_order("order_1")),3)
+
+
+
+
+# a capture that lands after its payment was written off is never dropped: the order is paid, restored or refunded
+
+class LateCaptureTests(TestCase):
+
+    def setUp(self):
+        self.user    = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        self.product = create_product("Hammer", stock=8)     # checkout already took the order's 2 units
+        self.order   = create_order(self.user, [self.product], quantity=2)
+        self.payment = payments_models.PaymentModel.objects.create(order=self.order, method="RAZORPAY", status="PENDING",
+                                                                   amount=self.order.grand_total, provider_order_id="order_late"
+                                                                  )
+        create_reservations(self.order, [(self.product.id,2)], ttl=timedelta(seconds=-1))
+
+
+    def capture(self):
+        payload = {"event":"payment.captured",
+                   "payload":{"payment":{"entity":{"id":"pay_late","order_id":"order_late","status":"captured"}}}
+                  }
+        store_event("evt_late", "", payload)
+
+        with self.assertLogs("payments", level="WARNING") as logs:
+            self.assertEqual(process_pending_events()["processed"],1)
+
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.payment.status,"SUCCESS")
+        self.assertEqual(self.payment.provider_payment_id,"pay_late")
+        return logs
+
+
+    def test_pending_order_is_paid(self):
+        payments_models.PaymentModel.objects.filter(id=self.payment.id).update(status="FAILED")     # the customer retried
+        self.capture()
+
+        self.assertEqual(self.order.status,"PAID")
+        self.assertEqual(self.product.stock,8)
+        self.assertEqual(self.order.reservations.get().status,"COMMITTED")
+
+
+    def test_expired_order_is_restored(self):
+        release_expired_reservations()
+        self.capture()
+
+        item = self.order.items.get()
+        self.assertEqual(self.order.status,"PAID")
+        self.assertEqual((item.status,item.restocked_at),("PAID",None))
+        self.assertEqual(self.product.stock,8)
+        self.assertFalse(payments_models.RefundModel.objects.exists())
+
+
+    def test_sold_out_order_is_refunded(self):
+        release_expired_reservations()
+        product_models.ProductModel.objects.filter(id=self.product.id).update(stock=1)
+        logs = self.capture()
+
+        self.assertEqual(self.order.status,"CANCELLED")
+        self.assertEqual(self.product.stock,1)
+        self.assertTrue(any(record.levelname == "ERROR" for record in logs.records))
+
+        refund = payments_models.RefundModel.objects.get()
+        self.assertEqual((refund.payment_id,refund.amount,refund.status),(self.payment.id,self.order.grand_total,"PENDING"))
+
+
+
+
+# a razorpay export streamed through the matcher. amounts are in paise, every local order costs 100.00
+
+class ReconciliationTests(TestCase):
+
+    RECORDS = [{"id":"pay_captured","order_id":"order_captured","status":"captured","amount":10000,"currency":"INR"},
+               {"id":"pay_failed","order_id":"order_failed","status":"failed","amount":10000,"currency":"INR"},
+               {"id":"pay_mismatch","order_id":"order_mismatch","status":"captured","amount":9900,"currency":"INR"},
+               {"id":"pay_closed","order_id":"order_closed","status":"captured","amount":10000,"currency":"INR"},
+               {"id":"pay_unknown","order_id":"order_unknown","status":"captured","amount":10000,"currency":"INR"}
+              ]
+
+
+    @classmethod
+    def setUpTestData(cls):
+        user    = get_user_model().objects.create_user(username="buyer", email="buyer@example.com")
+        product = create_product("Hammer")
+
+        cls.payments = {}
+        for name,order_status in [("captured","PENDING"),("failed","PENDING"),("mismatch","PENDING"),("closed","CANCELLED")]:
+            order = create_order(user, [product], status=order_status)
+            cls.payments[name] = payments_models.PaymentModel.objects.create(order=order, method="RAZORPAY", amount=order.grand_total,
+                                                                             status="FAILED" if order_status == "CANCELLED" else "PENDING",
+                                                                             provider_order_id=f"order_{name}"
+                                                                            )
+
+
+    def setUp(self):
+        descriptor,self.path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(descriptor,"w") as export:
+            export.write("\n".join(json.dumps(record) for record in self.RECORDS) + "\n")
+
+        self.addCleanup(os.remove,self.path)
+
+
+    def reconcile(self,apply):
+        reported = []
+        totals   = reconcile(iter_file_records(self.path), apply=apply, chunk_size=2,
+                             report=lambda kind,record,payment: reported.append((kind,record["id"]))
+                            )
+
+        for payment in self.payments.values():
+            payment.refresh_from_db()
+            payment.order.refresh_from_db()
+
+        return totals,sorted(reported)
+
+
+    def test_dry_run_reports_and_writes_nothing(self):
+        totals,reported = self.reconcile(apply=False)
+
+        self.assertEqual(reported,[("amount_mismatch","pay_mismatch"),("captured_after_order_closed","pay_closed"),("unknown_payment","pay_unknown")])
+        self.assertEqual(totals,{"records":5,"skipped":0,"matched":4,"captured":1,"failed":1,"review":2,"unmatched":1})
+        self.assertEqual(self.payments["captured"].status,"PENDING")
+        self.assertEqual(self.payments["failed"].status,"PENDING")
+
+
+    def test_apply(self):
+        totals,reported = self.reconcile(apply=True)
+
+        self.assertEqual(len(reported),3)
+        self.assertEqual((totals["captured"],totals["failed"]),(1,1))
+
+        captured = self.payments["captured"]
+        self.assertEqual((captured.status,captured.provider_payment_id,captured.order.status),("SUCCESS","pay_captured","PAID"))
+        self.assertEqual(captured.order.items.get().status,"PAID")
+
+        failed = self.payments["failed"]
+        self.assertEqual((failed.status,failed.provider_payment_id,failed.order.status),("FAILED","pay_failed","PENDING"))
+
+        self.assertEqual((self.payments["mismatch"].status,self.payments["mismatch"].order.status),("PENDING","PENDING"))
+        self.assertEqual((self.payments["closed"].status,self.payments["closed"].order.status),("FAILED","CANCELLED"))
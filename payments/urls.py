@@ -7,4 +7,9 @@ urlpatterns = [
 
     path('retry/', views.PaymentRetryAPIView.as_view(), name="payment-retry"),
     path('status/<str:order_id>/',views.PaymentStatusAPIView.as_view(), name="payment-status"),
+
+    # same flows as async views, for ASGI deployments
+    path('async/initiate/',views.AsyncPaymentInitiateAPIView.as_view(), name="payment-initiate-async"),
+    path('async/retry/', views.AsyncPaymentRetryAPIView.as_view(), name="payment-retry-async"),
+    path('async/status/<str:order_id>/',views.AsyncPaymentStatusAPIView.as_view(), name="payment-status-async"),
 ]
\ No newline at end of file
@@ -1,23 +1,22 @@
 from django.shortcuts import render
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import AllowAny,IsAuthenticated
+from adrf.generics import GenericAPIView as AsyncGenericAPIView
+from asgiref.sync import sync_to_async
 from drf_yasg.utils import swagger_auto_schema
 from payments import serializers as payments_serializers
-from orders import models as orders_model
-from payments import models as payments_model
-from common.helpers import error_response,success_response,normalize_validation_errors
-from rest_framework import status
-from payments.razorpay import razorpay_client
+from payments.razorpay import razorpay_gateway, async_razorpay_gateway
+from payments.gateway import PaymentGatewayError
+from payments.helpers import (to_paise, gateway_error_response, release_payment, begin_initiation, finish_initiation,
+                              begin_retry, finish_retry, payment_status_response)
 from django.conf import settings
-from rest_framework import serializers as drf_serializers
 from common.schemas import ErrorResponseSerializer,PaymentInitiateSuccessResponseSerializer,PaymentStatusSuccessResponseSerializer
+from common.swagger import IDEMPOTENCY_KEY_PARAM
+from accounts.idempotency import idempotent
 import razorpay
 import json
 from rest_framework.response import Response
-from django.db import transaction
-from django.utils import timezone
-from datetime import timedelta
-from decimal import Decimal,ROUND_HALF_UP
+from payments.webhooks import store_event
 import logging
 logger = logging.getLogger("payments")
 
@@ -29,143 +28,45 @@ class PaymentInitiateAPIView(GenericAPIView):
     serializer_class = payments_serializers.PaymentInitiateSerializer
 
     @swagger_auto_schema(tags=["Payment"], request_body = payments_serializers.PaymentInitiateSerializer,
+                         manual_parameters=[IDEMPOTENCY_KEY_PARAM],
                          responses = {200 : PaymentInitiateSuccessResponseSerializer,
                                       500 : ErrorResponseSerializer,
                                       400 : ErrorResponseSerializer,
                                       404 : ErrorResponseSerializer,
-                                      502 : ErrorResponseSerializer
+                                      409 : ErrorResponseSerializer,
+                                      422 : ErrorResponseSerializer,
+                                      502 : ErrorResponseSerializer,
+                                      503 : ErrorResponseSerializer
                                      }
                         )
+    @idempotent
     def post(self,request):
 
-        serializer = self.serializer_class(data=request.data)
-        
-        try:
-            if serializer.is_valid(raise_exception = True):
-                order_id = serializer.validated_data["order_id"]
-        
-            order_instance = orders_model.OrderModel.objects.get(order_id=order_id,user=request.user)
-
-        except drf_serializers.ValidationError as e:
-            message,data = normalize_validation_errors(e.detail)
-
-            return error_response(message = message,
-                                  data    = data,
-                                  status_code = status.HTTP_400_BAD_REQUEST
-                                 )
-
-        except orders_model.OrderModel.DoesNotExist:
-            return error_response(message = "Invalid order id.",
-                                  data    = {"order_id":order_id},
-                                  status_code = status.HTTP_404_NOT_FOUND
-                                 )
-        
-
-        if order_instance.status == "PAID":
-            return error_response(message = "Order already paid.",
-                                  data    = {"order_id":order_id},
-                                  status_code = status.HTTP_400_BAD_REQUEST
-                                 )
-
-
-        if order_instance.items.filter(status__in=orders_model.OrderItemModel.BLOCKED_STATUSES_PAYMENT).exists():
-            return error_response(message = "Payment cannot be made for this order.",
-                                  data    = {"order_id":order_id},
-                                  status_code =  status.HTTP_409_CONFLICT
-                                 )
-        
-        try:
-            with transaction.atomic():
-
-                payment_instance = payments_model.PaymentModel.objects.select_for_update().filter(order=order_instance,method="RAZORPAY",status="PENDING").first()
-                
-                if not payment_instance:
-                    raise drf_serializers.ValidationError({"error_message":"Payment not eligible.",
-                                                           "data":{"order_id":order_id}
-                                                         })
-                
-
-                razorpay_amount = int((payment_instance.amount * Decimal(100)).quantize(Decimal("1"),rounding=ROUND_HALF_UP))
-                
-                if payment_instance.provider_order_id:
-                    return success_response(message = "payment was already initiated.",
-                                            data    = {"razorpay_order_id":payment_instance.provider_order_id,
-                                                       "razorpay_key": settings.RAZORPAY_KEY_ID,
-                                                       "order_id":order_id,
-                                                       "amount": razorpay_amount,
-                                                       "currency":"INR"
-                                                      },
-                                            status_code = status.HTTP_200_OK
-                                        )
-                
-
-                payment_processing_timeout = timezone.now() - timedelta(minutes=2)
-
-                if payment_instance.processing_started_at:
-                    if payment_instance.processing_started_at >= payment_processing_timeout:
-                        raise drf_serializers.ValidationError({"error_message":"Payment is already being processed.",
-                                                               "data":{"order_id":order_id}
-                                                             })
-
-                payment_instance.processing_started_at = timezone.now()
-                payment_instance.save(update_fields=["processing_started_at"])
-
-        except drf_serializers.ValidationError as e:
-            message,data = normalize_validation_errors(e.detail)
-
-            return error_response(message = message,
-                                  data    = data,
-                                  status_code = status.HTTP_400_BAD_REQUEST
-                                 )
-        
-            
-
+        payment_instance,order_id,response = begin_initiation(request.user,request.data)
+        if response is not None:
+            return response
 
 
         try:
+            razorpay_order = razorpay_gateway.create_order(amount   = to_paise(payment_instance.amount),
+                                                           receipt  = order_id,
+                                                           currency = "INR"
+                                                          )
 
-            razorpay_order = razorpay_client.order.create({"amount":razorpay_amount,
-                                                           "currency":"INR",
-                                                           "receipt":order_id
-                                                         })
-            
             logger.info("Razorpay order created",extra={"order_id":order_id,
                                                         "razorpay_order_id":razorpay_order["id"]
                                                        }
                        )
-        
-        except razorpay.errors.RazorpayError:
-            with transaction.atomic():
-                payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=payment_instance.id)
-                payment_instance.processing_started_at = None
-                payment_instance.save(update_fields=["processing_started_at"])
 
-            logger.warning("Razorpay failed to respond for order creation",extra={"order_id":order_id})
+        except PaymentGatewayError as e:
+            release_payment(payment_instance.id)
 
-            return error_response(message = "Payment gateway failed, please try again.",
-                                  status_code = status.HTTP_502_BAD_GATEWAY
-                                 )
-    
+            logger.warning("Razorpay failed to respond for order creation",extra={"order_id":order_id, "error":str(e)})
 
-    
-        with transaction.atomic():
-            payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=payment_instance.id)
-            
-            payment_instance.provider_order_id = razorpay_order["id"]
-            payment_instance.processing_started_at = None 
-            payment_instance.save(update_fields=["provider_order_id","processing_started_at"])
+            return gateway_error_response(e)
 
 
-        return success_response(message = "Payment initiation successful",
-                                data    = {"razorpay_order_id":razorpay_order["id"],
-                                           "razorpay_key":settings.RAZORPAY_KEY_ID,
-                                           "order_id":order_id,
-                                           "amount":razorpay_order["amount"],
-                                           "currency":"INR"
-                                          },
-                                status_code = status.HTTP_200_OK
-                               )
-    
+        return finish_initiation(payment_instance.id,order_id,razorpay_order)
 
 
 
@@ -185,7 +86,7 @@ class PaymentWebhookAPIView(GenericAPIView):
         
 
         try:
-            razorpay_client.utility.verify_webhook_signature(payload,
+            razorpay_gateway.verify_webhook_signature(payload,
                                                              received_signature,
                                                              settings.RAZORPAY_WEBHOOK_SECRET
                                                             )
@@ -197,235 +98,173 @@ class PaymentWebhookAPIView(GenericAPIView):
         
 
 
-        payload = json.loads(payload)
-
-        event = payload.get("event")
-        if event not in ["payment.captured","payment.failed"]:
-            return Response(status=200)
-        
         try:
-            payment_entity = payload["payload"]["payment"]["entity"]
-        except KeyError:
+            event = json.loads(payload)
+        except ValueError:
             logger.warning("Razorpay payload is not correct")
             return Response(status=200)
 
 
-        razorpay_order_id   = payment_entity["order_id"]
-        razorpay_payment_id = payment_entity["id"]
-        payment_status      = payment_entity["status"] 
+        # the event is applied by process_webhook_events, razorpay only waits for it to be stored
+        store_event(request.headers.get("X-Razorpay-Event-Id"), payload, event)
 
+        return Response(status=200)
 
-        try: 
-            with transaction.atomic():
-                payment_instance = payments_model.PaymentModel.objects.select_for_update().get(provider_order_id=razorpay_order_id)
 
-                if payment_instance.status in ["SUCCESS","FAILED","REFUNDED"]:    
-                    logger.info("Reattempt by webhook", extra={"razorpay_order_id":razorpay_order_id,
-                                                               "razorpay_payment_id":razorpay_payment_id,
-                                                               "payment_status":payment_instance.status
-                                                              }
-                               )
-                    return Response(status=200)
-                
 
-                order = orders_model.OrderModel.objects.select_for_update().get(id=payment_instance.order.id)
-                order_items = orders_model.OrderItemModel.objects.select_for_update().filter(order=order,status="PENDING")                
+class PaymentRetryAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = payments_serializers.PaymentInitiateSerializer
+    @swagger_auto_schema(tags=["Payment"], request_body=payments_serializers.PaymentInitiateSerializer,
+                         manual_parameters=[IDEMPOTENCY_KEY_PARAM],
+                         responses={200 : PaymentInitiateSuccessResponseSerializer,
+                                    500 : ErrorResponseSerializer,
+                                    400 : ErrorResponseSerializer,
+                                    404 : ErrorResponseSerializer,
+                                    409 : ErrorResponseSerializer,
+                                    422 : ErrorResponseSerializer,
+                                    502 : ErrorResponseSerializer,
+                                    503 : ErrorResponseSerializer
+                                    })
+    @idempotent
+    def post(self,request):
 
+        prev_payment_instance,order_id,response = begin_retry(request.user,request.data)
+        if response is not None:
+            return response
 
-                if payment_status == "captured":
-    
-                    payment_instance.status = "SUCCESS"
-                    payment_instance.provider_payment_id = razorpay_payment_id
-                    payment_instance.save(update_fields=["status","provider_payment_id"])
-    
 
-                    order.status = "PAID"
-                    order.save(update_fields=["status"])
+        try:
+            razorpay_order = razorpay_gateway.create_order(amount   = to_paise(prev_payment_instance.amount),
+                                                           receipt  = order_id,
+                                                           currency = "INR"
+                                                          )
 
-                    order_items.update(status="PAID")
+        except PaymentGatewayError as e:
+            release_payment(prev_payment_instance.id)
 
-                    logger.info("Payment captured successfuly", extra={"razorpay_order_id":razorpay_order_id,
-                                                                        "razorpay_payment_id":razorpay_payment_id
-                                                                       }
-                               )
+            logger.warning("Razorpay failed to respond to payment reattempt.",extra={"order_id":order_id, "error":str(e)})
 
-                elif payment_status == "failed":
+            return gateway_error_response(e)
 
-                    payment_instance.status = "FAILED"
-                    payment_instance.provider_payment_id = razorpay_payment_id
 
-                    payment_instance.save(update_fields=["status","provider_payment_id"])
+        return finish_retry(prev_payment_instance.id,order_id,razorpay_order)
 
-                    logger.info("Payment failed", extra={"razorpay_order_id":razorpay_order_id,
-                                                         "razorpay_payment_id":razorpay_payment_id
-                                                        }
-                               )
 
-            return Response(status=200)
 
-        
-        except payments_model.PaymentModel.DoesNotExist:
-            logger.warning("Payment record not found", extra={"razorpay_order_id":razorpay_order_id,
-                                                              "razorpay_payment_id":razorpay_payment_id
-                                                             }
-                          )
-            return Response(status=200)
+class PaymentStatusAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = payments_serializers.PaymentStatusSerializer
+    lookup_field = "order_id"
 
+    @swagger_auto_schema(tags=["Payment"],
+                        responses = {200 : PaymentStatusSuccessResponseSerializer,
+                                     500 : ErrorResponseSerializer,
+                                     404 : ErrorResponseSerializer
+                                    }
+                       )
+    def get(self,request,order_id):
 
+        return payment_status_response(request.user,order_id)
 
-class PaymentRetryAPIView(GenericAPIView):
+
+
+
+
+
+
+# async twins of the initiate, retry and status views for ASGI deployments. the razorpay call is awaited on
+# the async gateway and only the database steps go through sync_to_async, so one worker keeps hundreds of
+# gateway calls in flight instead of one per thread. responses are the same as the sync views.
+
+INITIATE_RESPONSES = {200 : PaymentInitiateSuccessResponseSerializer,
+                      500 : ErrorResponseSerializer,
+                      400 : ErrorResponseSerializer,
+                      404 : ErrorResponseSerializer,
+                      409 : ErrorResponseSerializer,
+                      422 : ErrorResponseSerializer,
+                      502 : ErrorResponseSerializer,
+                      503 : ErrorResponseSerializer
+                     }
+
+
+
+class AsyncPaymentInitiateAPIView(AsyncGenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = payments_serializers.PaymentInitiateSerializer
-    @swagger_auto_schema(tags=["Payment"], request_body=payments_serializers.PaymentInitiateSerializer,
-                         responses={200 : PaymentInitiateSuccessResponseSerializer,
-                                    500 : ErrorResponseSerializer,
-                                    400 : ErrorResponseSerializer,
-                                    404 : ErrorResponseSerializer,
-                                    409 : ErrorResponseSerializer,
-                                    502 : ErrorResponseSerializer
-                                    })
 
-    def post(self,request):
-        serializer = self.serializer_class(data=request.data)
+    @swagger_auto_schema(tags=["Payment"], request_body = payments_serializers.PaymentInitiateSerializer,
+                         manual_parameters=[IDEMPOTENCY_KEY_PARAM],
+                         responses = INITIATE_RESPONSES
+                        )
+    @idempotent
+    async def post(self,request):
+
+        payment_instance,order_id,response = await sync_to_async(begin_initiation)(request.user,request.data)
+        if response is not None:
+            return response
+
 
         try:
-            if serializer.is_valid(raise_exception=True):
-                order_id = serializer.validated_data["order_id"]
-            
-            order_instance = orders_model.OrderModel.objects.get(order_id=order_id,user=request.user)        
-
-
-            if order_instance.status == "PAID":
-                raise drf_serializers.ValidationError({"error_message":"Payment already done",
-                                                           "data":{"order_id":order_id}
-                                                         })
-                
-
-            if order_instance.items.filter(status__in=orders_model.OrderItemModel.BLOCKED_STATUSES_PAYMENT).exists():
-                raise drf_serializers.ValidationError({"error_message":"Payment cannot be made for this order",
-                                                       "data":{"order_id":order_id}
-                                                     })
-
-            with transaction.atomic():
-
-                prev_payment_instance = payments_model.PaymentModel.objects.select_for_update().filter(order=order_instance,method="RAZORPAY").order_by('-created_at').first()
-                
-
-                if not prev_payment_instance:
-                    raise drf_serializers.ValidationError({"error_message":"No initial payment attempt found.",
-                                                           "data":{"order_id":order_id}
-                                                         })
-                
-
-                if prev_payment_instance.status == "SUCCESS":
-                    raise drf_serializers.ValidationError({"error_message":"Payment already completed",
-                                                           "data":{"order_id":order_id}
-                                                         })
-                
-                
-                if prev_payment_instance.status == "REFUNDED":
-                    raise drf_serializers.ValidationError({"error_message":"Payment was refunded, retry not available",
-                                                           "data":{"order_id":order_id}
-                                                         })
-                
-                
-                cutoff_time = timezone.now() - timedelta(minutes=15)
-                
-                if prev_payment_instance.status == "PENDING":
-                    if prev_payment_instance.created_at >= cutoff_time:
-                        raise drf_serializers.ValidationError({"error_message":"Previous payment is still in progress",
-                                                               "data":{"order_id":order_id}
-                                                             })
-                    
-                
-                payment_processing_timeout = timezone.now() - timedelta(minutes=2)
-
-                if prev_payment_instance.processing_started_at:
-                    if prev_payment_instance.processing_started_at >= payment_processing_timeout:
-                        raise drf_serializers.ValidationError({"error_message":"Payment is being processed.",
-                                                               "data":{"order_id":order_id}
-                                                             })
-
-
-                prev_payment_instance.processing_started_at = timezone.now()
-                prev_payment_instance.save(update_fields=["processing_started_at"])
-                    
-                    
-        except drf_serializers.ValidationError as e:
-            message,data = normalize_validation_errors(e.detail)
-
-            return error_response(message = message,
-                                  data    = data,
-                                  status_code = status.HTTP_400_BAD_REQUEST
-                                 )
-        
-        except orders_model.OrderModel.DoesNotExist:
-            return error_response(message = "Invalid order id",
-                                  data={"order_id":order_id},
-                                  status_code = status.HTTP_400_BAD_REQUEST
-                                 )
-        
+            razorpay_order = await async_razorpay_gateway.create_order(amount   = to_paise(payment_instance.amount),
+                                                                       receipt  = order_id,
+                                                                       currency = "INR"
+                                                                      )
+
+            logger.info("Razorpay order created",extra={"order_id":order_id,
+                                                        "razorpay_order_id":razorpay_order["id"]
+                                                       }
+                       )
+
+        except PaymentGatewayError as e:
+            await sync_to_async(release_payment)(payment_instance.id)
+
+            logger.warning("Razorpay failed to respond for order creation",extra={"order_id":order_id, "error":str(e)})
+
+            return gateway_error_response(e)
+
+
+        return await sync_to_async(finish_initiation)(payment_instance.id,order_id,razorpay_order)
+
+
+
+
+class AsyncPaymentRetryAPIView(AsyncGenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = payments_serializers.PaymentInitiateSerializer
+
+    @swagger_auto_schema(tags=["Payment"], request_body=payments_serializers.PaymentInitiateSerializer,
+                         manual_parameters=[IDEMPOTENCY_KEY_PARAM],
+                         responses=INITIATE_RESPONSES
+                        )
+    @idempotent
+    async def post(self,request):
+
+        prev_payment_instance,order_id,response = await sync_to_async(begin_retry)(request.user,request.data)
+        if response is not None:
+            return response
 
-        
 
         try:
-            razorpay_amount = int((prev_payment_instance.amount * Decimal(100)).quantize(Decimal("1"),rounding=ROUND_HALF_UP))
-
-            razorpay_order = razorpay_client.order.create(amount  = razorpay_amount,
-                                                          receipt = order_id,
-                                                          currency = "INR"
-                                                         )
-            
-        except razorpay.errors.RazorpayError:
-            with transaction.atomic():
-                prev_payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=prev_payment_instance.id)
-                prev_payment_instance.processing_started_at = None 
-                prev_payment_instance.save(update_fields=["processing_started_at"])
-
-            logger.warning("Razorpay failed to respond to payment reattempt.",extra={"order_id":order_id})
-
-            return error_response(message = "Payment gateway unavailable.",
-                                  status_code = status.HTTP_502_BAD_GATEWAY
-                                 )
-        
+            razorpay_order = await async_razorpay_gateway.create_order(amount   = to_paise(prev_payment_instance.amount),
+                                                                       receipt  = order_id,
+                                                                       currency = "INR"
+                                                                      )
 
-        with transaction.atomic():
-            prev_payment_instance = payments_model.PaymentModel.objects.select_for_update().get(id=prev_payment_instance.id)
-            
-            payments_model.PaymentModel.objects.create(order    = order_instance,
-                                                       method   = "RAZORPAY",
-                                                       status   = "PENDING",
-                                                       amount   = prev_payment_instance.amount,
-                                                       currency = "INR",
-                                                       provider_order_id = razorpay_order["id"]
-                                                      )
-            prev_payment_instance.status = "FAILED"
-            prev_payment_instance.processing_started_at = None
-            prev_payment_instance.save(update_fields=["status","processing_started_at"])
-
-
-        logger.info("Payment retry initiated",extra={"order_id":order_id,
-                                                     "previous_payment_status":prev_payment_instance.status,
-                                                     "previous_payment_id":prev_payment_instance.id
-                                                    }
-                   )
-        
-        return success_response(message = "Payment re-initiation successful",
-                                data    = {"razorpay_order_id":razorpay_order["id"],
-                                           "razorpay_key":settings.RAZORPAY_KEY_ID,
-                                           "order_id":order_id,
-                                           "amount":razorpay_order["amount"],
-                                           "currency":razorpay_order["currency"],
-                                          },
-                                status_code = status.HTTP_200_OK
-                                )
-        
-        
+        except PaymentGatewayError as e:
+            await sync_to_async(release_payment)(prev_payment_instance.id)
 
-        
+            logger.warning("Razorpay failed to respond to payment reattempt.",extra={"order_id":order_id, "error":str(e)})
 
+            return gateway_error_response(e)
 
-class PaymentStatusAPIView(GenericAPIView):
+
+        return await sync_to_async(finish_retry)(prev_payment_instance.id,order_id,razorpay_order)
+
+
+
+
+class AsyncPaymentStatusAPIView(AsyncGenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = payments_serializers.PaymentStatusSerializer
     lookup_field = "order_id"
@@ -436,39 +275,6 @@ class PaymentStatusAPIView(GenericAPIView):
                                      404 : ErrorResponseSerializer
                                     }
                        )
-    def get(self,request,order_id):
-        try:
-            order_instance = orders_model.OrderModel.objects.get(order_id=order_id,user=request.user)
-        except orders_model.OrderModel.DoesNotExist:
-            return error_response(message = "Invalid order id",
-                                  data    = {"order_id":order_id},
-                                  status_code = status.HTTP_404_NOT_FOUND
-                                 )
-        
-        if not order_instance.payments.exists():
-            return error_response(message = "No payment attempts done.",
-                                  data    =  {"order_id":order_id},
-                                  status_code = status.HTTP_404_NOT_FOUND
-                                 )
-        
-        payment_instance = order_instance.payments.order_by('-created_at').first()
-
-        cutoff_time = timezone.now() - timedelta(minutes=15)
-        retry_allowed = False
-        if payment_instance.status == "FAILED" or (payment_instance.status == "PENDING" and payment_instance.created_at < cutoff_time):
-            retry_allowed = True 
-
-        
-        data = {"order_id":order_instance.order_id,
-                "order_status":order_instance.status,
-                "payment_status": payment_instance.status,
-                "retry_allowed": retry_allowed
-               }
-        
-        serializer = self.serializer_class(instance=data)
+    async def get(self,request,order_id):
 
-        return success_response(message = "Payment status fetched successfuly.",
-                                data    = serializer.data,
-                                status_code = status.HTTP_200_OK
-                               )
-        
+        return await sync_to_async(payment_status_response)(request.user,order_id)
@@ -0,0 +1,252 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from orders import models as orders_model
+from payments import models as payments_model
+from orders.inventory import commit_reservations, reserve_stock
+from products import models as product_models
+from rest_framework import serializers as drf_serializers
+import hashlib
+import logging
+
+
+
+logger = logging.getLogger("payments")
+
+
+HANDLED_EVENTS = ["payment.captured","payment.failed"]
+
+
+
+# stores a verified webhook body in the inbox, returns False for events we do not handle or cannot read.
+# razorpay sends the same X-Razorpay-Event-Id on every redelivery, without it the body hash stands in.
+
+def store_event(event_id,body,payload):
+    event = payload.get("event") if isinstance(payload,dict) else None
+    if event not in HANDLED_EVENTS:
+        return False
+
+    try:
+        payment_entity = payload["payload"]["payment"]["entity"]
+        provider_order_id = payment_entity["order_id"]
+        if not payment_entity["id"] or not payment_entity["status"]:
+            raise KeyError("id")
+    except (KeyError, TypeError):
+        logger.warning("Razorpay payload is not correct", extra={"event_id":event_id})
+        return False
+
+    event_id = event_id or hashlib.sha256(body.encode()).hexdigest()
+
+    _,created = payments_model.WebhookEventModel.objects.get_or_create(event_id = event_id,
+                                                                       defaults = {"event":event,
+                                                                                   "provider_order_id":provider_order_id,
+                                                                                   "payload":payload
+                                                                                  }
+                                                                      )
+    if not created:
+        logger.info("Duplicate webhook event", extra={"event_id":event_id, "razorpay_order_id":provider_order_id})
+
+    return True
+
+
+
+
+# applies one stored event to the payment, order and order items. runs inside the worker's transaction.
+
+def apply_event(webhook_event):
+    payment_entity = webhook_event.payload["payload"]["payment"]["entity"]
+
+    razorpay_order_id   = payment_entity["order_id"]
+    razorpay_payment_id = payment_entity["id"]
+    payment_status      = payment_entity["status"]
+
+    payment_instance = payments_model.PaymentModel.objects.select_for_update().filter(provider_order_id=razorpay_order_id).first()
+
+    if payment_instance is None:
+        logger.warning("Payment record not found", extra={"razorpay_order_id":razorpay_order_id,
+                                                          "razorpay_payment_id":razorpay_payment_id
+                                                         }
+                      )
+        return
+
+    late_capture = payment_instance.status == "FAILED" and payment_status == "captured"
+
+    if payment_instance.status in ["SUCCESS","FAILED","REFUNDED"] and not late_capture:
+        logger.info("Reattempt by webhook", extra={"razorpay_order_id":razorpay_order_id,
+                                                   "razorpay_payment_id":razorpay_payment_id,
+                                                   "payment_status":payment_instance.status
+                                                  }
+                   )
+        return
+
+
+    order = orders_model.OrderModel.objects.select_for_update().get(id=payment_instance.order_id)
+
+    if late_capture:
+        apply_late_capture(payment_instance,order,razorpay_payment_id)
+        return
+
+    order_items = orders_model.OrderItemModel.objects.select_for_update().filter(order=order,status="PENDING")
+
+
+    if payment_status == "captured":
+
+        payment_instance.status = "SUCCESS"
+        payment_instance.provider_payment_id = razorpay_payment_id
+        payment_instance.save(update_fields=["status","provider_payment_id"])
+
+        order.status = "PAID"
+        order.save(update_fields=["status"])
+
+        order_items.update(status="PAID")
+
+        commit_reservations(order)
+
+        logger.info("Payment captured successfuly", extra={"razorpay_order_id":razorpay_order_id,
+                                                            "razorpay_payment_id":razorpay_payment_id
+                                                           }
+                   )
+
+    elif payment_status == "failed":
+
+        payment_instance.status = "FAILED"
+        payment_instance.provider_payment_id = razorpay_payment_id
+        payment_instance.save(update_fields=["status","provider_payment_id"])
+
+        logger.info("Payment failed", extra={"razorpay_order_id":razorpay_order_id,
+                                             "razorpay_payment_id":razorpay_payment_id
+                                            }
+                   )
+
+
+
+
+# a capture for an attempt that was already written off: the sweeper let its reservation expire, or the
+# customer retried and this attempt was marked FAILED. the money is taken either way, so the payment is SUCCESS.
+#   order still PENDING                                      -> paid by this attempt
+#   order cancelled by the sweeper alone and stock is there  -> stock taken again, order and items PAID
+#   anything else (paid by another attempt, cancelled by the customer, sold out since) -> PENDING refund
+# runs with the payment and the order locked.
+
+def apply_late_capture(payment_instance,order,razorpay_payment_id):
+    log_extra = {"razorpay_order_id":payment_instance.provider_order_id,
+                 "razorpay_payment_id":razorpay_payment_id,
+                 "order_id":order.order_id,
+                 "order_status":order.status
+                }
+
+    payment_instance.status = "SUCCESS"
+    payment_instance.provider_payment_id = razorpay_payment_id
+    payment_instance.save(update_fields=["status","provider_payment_id"])
+
+
+    if order.status == "PENDING":
+        order.status = "PAID"
+        order.save(update_fields=["status"])
+
+        orders_model.OrderItemModel.objects.filter(order=order,status="PENDING").update(status="PAID")
+        commit_reservations(order)
+
+        logger.warning("Late capture paid the order", extra=log_extra)
+        return
+
+
+    if order.status == "CANCELLED":
+        reasons = set(product_models.StockMovementModel.objects.filter(order=order).values_list("reason",flat=True))
+
+        if "RESERVATION_EXPIRED" in reasons and "CANCELLATION" not in reasons:
+            order_items = orders_model.OrderItemModel.objects.select_for_update().filter(order=order,status="CANCELLED")
+
+            try:
+                reserve_stock(order_items.values_list("product_id","quantity"), order)
+            except drf_serializers.ValidationError:
+                pass
+            else:
+                order.status = "PAID"
+                order.save(update_fields=["status"])
+
+                order_items.update(status="PAID", restocked_at=None)
+
+                logger.warning("Late capture restored an expired order", extra=log_extra)
+                return
+
+
+    payments_model.RefundModel.objects.create(order    = order,
+                                              payment  = payment_instance,
+                                              amount   = payment_instance.amount,
+                                              currency = payment_instance.currency,
+                                              method   = payment_instance.method,
+                                              reason   = "Payment captured after the order was closed."
+                                             )
+
+    logger.error("Late capture on a closed order, refund queued", extra=log_extra)
+
+
+
+
+# processes up to batch_size pending events, oldest first. workers claim events with SKIP LOCKED so they
+# never wait on each other. events of one razorpay order are applied in the order they were received: an
+# event is left for a later pass while an earlier event of its order is held by another worker or failed
+# in this batch. a failing event is retried on later passes and marked FAILED after WEBHOOK_MAX_ATTEMPTS.
+
+def process_pending_events(batch_size=50):
+    result = {"processed":0,"failed":0,"retrying":0,"deferred":0}
+
+    with transaction.atomic():
+        events = list(payments_model.WebhookEventModel.objects.select_for_update(skip_locked=True)
+                                                              .filter(status="PENDING")
+                                                              .order_by("received_at","id")[:batch_size]
+                     )
+        if not events:
+            return result
+
+        claimed = {event.id for event in events}
+
+        # the oldest pending event of each order outside this batch. one older than an event of ours can only be
+        # there because another worker holds it
+        held = {}
+        for provider_order_id,received_at,event_id in (payments_model.WebhookEventModel.objects.filter(status="PENDING", provider_order_id__in={event.provider_order_id for event in events})
+                                                                                                .exclude(id__in=claimed)
+                                                                                                .values_list("provider_order_id","received_at","id")):
+            held[provider_order_id] = min(held.get(provider_order_id,(received_at,event_id)), (received_at,event_id))
+
+        blocked = set()
+        handled = []
+        now     = timezone.now()
+
+        for event in events:
+            earlier = held.get(event.provider_order_id)
+            if event.provider_order_id in blocked or (earlier and earlier < (event.received_at,event.id)):
+                blocked.add(event.provider_order_id)
+                result["deferred"] += 1
+                continue
+
+            event.attempts += 1
+
+            try:
+                with transaction.atomic():
+                    apply_event(event)
+
+            except Exception as e:
+                logger.exception("Webhook event processing failed", extra={"event_id":event.event_id, "attempt":event.attempts})
+
+                event.last_error = f"{e.__class__.__name__}: {e}"
+                blocked.add(event.provider_order_id)
+
+                if event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                    event.status = "FAILED"
+                    result["failed"] += 1
+                else:
+                    result["retrying"] += 1
+
+            else:
+                event.status       = "PROCESSED"
+                event.processed_at = now
+                event.last_error   = None
+                result["processed"] += 1
+
+            handled.append(event)
+
+        payments_model.WebhookEventModel.objects.bulk_update(handled, ["status","attempts","last_error","processed_at"])
+
+    return result
@@ -2,6 +2,7 @@ from django.db.models import Q
 from rest_framework import serializers as drf_serializers
 from decimal import Decimal, InvalidOperation
 from products import models
+from products.helpers import get_category_descendant_ids
 
 
 def admin_products_list(request,queryset):
@@ -28,11 +29,10 @@ def admin_products_list(request,queryset):
     if category_slug:
         category_slug = category_slug.lower()
 
-        category_instance = models.CategoryModel.objects.filter(slug=category_slug).first()
+        category_ids = get_category_descendant_ids(category_slug)
 
-        if category_instance is not None:
-            children = category_instance.get_descendants(include_self=True)
-            queryset = queryset.filter(category__in=children)
+        if category_ids:
+            queryset = queryset.filter(category_id__in=category_ids)
         else:
             queryset = queryset.none()
     
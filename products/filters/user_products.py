@@ -1,26 +1,38 @@
-from django.db.models import Q
+from django.db.models import Q, Count
 from rest_framework import serializers as drf_serializers
 from decimal import Decimal, InvalidOperation
 from products import models
+from products.helpers import search_products, get_category_descendant_ids, get_active_brands, get_facet_categories
 
 
 SORT_OPTIONS = {"price_asc":"price",
                "price_desc":"-price",
                "newest":"-created_at",
-               "oldest":"created_at"
+               "oldest":"created_at",
+               "relevance":"-rank"
               }
 
+# lower bound inclusive, upper bound exclusive
+PRICE_FACET_BUCKETS = [(None,500),
+                       (500,1000),
+                       (1000,5000),
+                       (5000,None)
+                      ]
 
-def user_products_list(request,queryset):
+
+# facetable filters as separate Q objects keyed by dimension, so the facet of one dimension
+# can be counted under all the other filters but not its own.
+
+def user_products_filters(request):
 
     category  = request.query_params.get("category")
     brand     = request.query_params.get("brand")
     min_price = request.query_params.get("min_price") 
     max_price = request.query_params.get("max_price")
-    search    = request.query_params.get("search") 
-    sort      = request.query_params.get("sort")
     in_stock  = request.query_params.get("in_stock")
 
+    filters = {}
+
 
 
     try:
@@ -36,21 +48,14 @@ def user_products_list(request,queryset):
     if category:
         category = category.lower()
 
-        category_instance = models.CategoryModel.objects.filter(slug=category,is_active=True).first()
-        
-        if category_instance is not None:
-            children = category_instance.get_descendants(include_self=True)
-
-            queryset = queryset.filter(category__in=children)
-        else:
-            queryset = queryset.none()
+        filters["category"] = Q(category_id__in=get_category_descendant_ids(category,active_only=True))
 
 
 
     if brand:
         brand = brand.lower()
 
-        queryset = queryset.filter(brand__slug=brand)
+        filters["brand"] = Q(brand__slug=brand)
 
 
 
@@ -58,23 +63,52 @@ def user_products_list(request,queryset):
         raise drf_serializers.ValidationError({"price":"min_price cannot be greater than max_price."})
         
     if min_price:
-        queryset = queryset.filter(price__gte=min_price)
+        filters["price"] = Q(price__gte=min_price)
         
     if max_price:
-        queryset = queryset.filter(price__lte=max_price)
+        filters["price"] = filters.get("price",Q()) & Q(price__lte=max_price)
 
 
 
-        
+    if in_stock:
+        in_stock = in_stock.lower()
+
+        if in_stock == "true":
+            filters["stock"] = Q(stock__gt=0)
+        elif in_stock == "false":
+            filters["stock"] = Q(stock=0)
+
+
+    return filters
+
+
+
+
+def user_products_search(request,queryset):
+
+    search = request.query_params.get("search") 
+
     if search:
         search = search.strip()
 
-        queryset = queryset.filter(Q(name__icontains=search)|
-                                   Q(category__name__icontains=search)|
-                                   Q(brand__name__icontains=search)|
-                                   Q(slug__icontains=search)|
-                                   Q(description__icontains=search)
-                                   )
+        if search:
+            queryset = search_products(queryset,search)
+
+    return queryset,search
+
+
+
+
+def user_products_list(request,queryset):
+
+    sort = request.query_params.get("sort")
+
+    filters = user_products_filters(request)
+
+    if filters:
+        queryset = queryset.filter(*filters.values())
+
+    queryset,search = user_products_search(request,queryset)
             
 
     if sort:
@@ -82,18 +116,99 @@ def user_products_list(request,queryset):
 
         order_by = SORT_OPTIONS.get(sort)
 
+        if sort == "relevance" and not search:     # rank only exists on searched querysets
+            order_by = None
+
         if order_by is not None:
-            queryset = queryset.order_by(order_by)
+            queryset = queryset.order_by(order_by,"-created_at")
 
 
+    return queryset
 
-    if in_stock:
-        in_stock = in_stock.lower()
 
-        if in_stock == "true":
-            queryset = queryset.filter(stock__gt=0)
-        elif in_stock == "false":
-            queryset = queryset.filter(stock=0)
 
 
-    return queryset
\ No newline at end of file
+def _except(filters,dimension):
+    condition = Q()
+    for name,q in filters.items():
+        if name != dimension:
+            condition &= q
+    return condition
+
+
+
+# facet counts in three queries whatever the size of the catalog: one aggregate with conditional counts
+# (COUNT ... FILTER (WHERE ...)) for the total, price buckets and stock, and one GROUP BY each for brands and
+# categories. search always applies, each facet ignores only its own filter, so the frontend can offer
+# "other brands" while a brand is selected.
+
+def user_products_facets(request,queryset):
+
+    filters = user_products_filters(request)
+    queryset,_ = user_products_search(request,queryset)
+    queryset   = queryset.order_by()
+
+    brands     = get_active_brands()
+    categories = get_facet_categories(request.query_params.get("category","").lower() or None)
+
+    price_scope = _except(filters,"price")
+    stock_scope = _except(filters,"stock")
+
+
+    aggregates = {"total":Count("id", filter=_except(filters,None)),
+                  "in_stock":Count("id", filter=stock_scope & Q(stock__gt=0)),
+                  "out_of_stock":Count("id", filter=stock_scope & Q(stock=0))
+                 }
+
+    for index,(low,high) in enumerate(PRICE_FACET_BUCKETS):
+        bucket = price_scope
+        if low is not None:
+            bucket &= Q(price__gte=low)
+        if high is not None:
+            bucket &= Q(price__lt=high)
+
+        aggregates[f"price_{index}"] = Count("id", filter=bucket)
+
+    counts = queryset.aggregate(**aggregates)
+
+
+    brand_counts = dict(queryset.filter(_except(filters,"brand"))
+                                .values("brand_id").annotate(count=Count("id")).values_list("brand_id","count"))
+
+    # the facet categories are disjoint subtrees, every product category belongs to at most one of them
+    facet_of = {category_id:category["id"] for category in categories for category_id in category["ids"]}
+
+    category_counts = {}
+    if facet_of:
+        rows = (queryset.filter(_except(filters,"category"), category_id__in=list(facet_of))
+                        .values("category_id").annotate(count=Count("id")).values_list("category_id","count"))
+
+        for category_id,count in rows:
+            category_counts[facet_of[category_id]] = category_counts.get(facet_of[category_id],0) + count
+
+    counts.update({f"brand_{brand_id}":count for brand_id,count in brand_counts.items()})
+    counts.update({f"category_{category_id}":count for category_id,count in category_counts.items()})
+
+
+    return {"total":counts["total"],
+            "brands":[{"id":brand["id"],
+                       "name":brand["name"],
+                       "slug":brand["slug"],
+                       "count":counts[f"brand_{brand['id']}"]
+                      } for brand in brands if counts.get(f"brand_{brand['id']}")
+                     ],
+            "categories":[{"id":category["id"],
+                           "name":category["name"],
+                           "slug":category["slug"],
+                           "count":counts[f"category_{category['id']}"]
+                          } for category in categories if counts.get(f"category_{category['id']}")
+                         ],
+            "price":[{"min":low,
+                      "max":high,
+                      "count":counts[f"price_{index}"]
+                     } for index,(low,high) in enumerate(PRICE_FACET_BUCKETS)
+                    ],
+            "stock":{"in_stock":counts["in_stock"],
+                     "out_of_stock":counts["out_of_stock"]
+                    }
+           }
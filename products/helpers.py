@@ -0,0 +1,243 @@
+from django.db import connection
+from django.conf import settings
+from django.core.cache import cache
+import threading
+from django.db.models import Q, F, Value, Case, When, IntegerField, TextField, OuterRef, Subquery
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from products import models
+from common.cache import get_generation, bump_generations
+
+
+
+SEARCH_CONFIG = "english"
+
+SEARCHABLE_FIELDS = {"name","slug","description","brand","brand_id","category","category_id"}
+
+
+
+def full_text_search_enabled():
+    return connection.vendor == "postgresql"
+
+
+
+# the weighted search document of a product. over the row being updated by default; given a product, over the
+# values it is about to be saved with, since an UPDATE computing it in its own SET clause only sees the old row.
+# brand and category names are pulled in through subqueries since UPDATE cannot join.
+
+def search_document(product=None):
+    if product is None:
+        name,slug,description = F("name"),F("slug"),F("description")
+        brand_id,category_id  = OuterRef("brand_id"),OuterRef("category_id")
+    else:
+        name,slug,description = [Value(getattr(product,field), output_field=TextField()) for field in ("name","slug","description")]
+        brand_id,category_id  = product.brand_id,product.category_id
+
+    brand_name    = Subquery(models.BrandModel.objects.filter(pk=brand_id).values("name")[:1])
+    category_name = Subquery(models.CategoryModel.objects.filter(pk=category_id).values("name")[:1])
+
+    document = (SearchVector(name, weight="A", config=SEARCH_CONFIG) +
+                SearchVector(brand_name, weight="B", config=SEARCH_CONFIG) +
+                SearchVector(category_name, weight="B", config=SEARCH_CONFIG) +
+                SearchVector(slug, weight="C", config=SEARCH_CONFIG) +
+                SearchVector(description, weight="D", config=SEARCH_CONFIG)
+               )
+    return document
+
+
+
+# rebuilds the search document for every product in the queryset with a single UPDATE
+
+def refresh_search_vectors(queryset):
+    if not full_text_search_enabled():
+        return 0
+
+    return queryset.order_by().update(search_vector=search_document())
+
+
+
+# filters the queryset by the search term and annotates a "rank" usable for sort=relevance.
+# postgres uses the GIN indexed search_vector, other backends fall back to icontains lookups.
+
+def search_products(queryset,search):
+
+    if full_text_search_enabled():
+        query = SearchQuery(search, search_type="websearch", config=SEARCH_CONFIG)
+
+        return queryset.filter(search_vector=query).annotate(rank=SearchRank(F("search_vector"), query))
+
+
+    queryset = queryset.filter(Q(name__icontains=search)|
+                               Q(category__name__icontains=search)|
+                               Q(brand__name__icontains=search)|
+                               Q(slug__icontains=search)|
+                               Q(description__icontains=search)
+                              )
+
+    return queryset.annotate(rank=Case(When(name__icontains=search, then=Value(4)),
+                                       When(Q(brand__name__icontains=search)|Q(category__name__icontains=search), then=Value(3)),
+                                       When(slug__icontains=search, then=Value(2)),
+                                       default=Value(1),
+                                       output_field=IntegerField()
+                                      )
+                            )
+
+
+
+
+
+
+# ---------------- catalog cache generations ----------------
+
+PRODUCT_GENERATION  = "catalog:product"
+BRAND_GENERATION    = "catalog:brand"
+CATEGORY_GENERATION = "catalog:category"
+
+CATALOG_GENERATIONS = (PRODUCT_GENERATION,BRAND_GENERATION,CATEGORY_GENERATION)
+
+
+
+def invalidate_products():
+    bump_generations(PRODUCT_GENERATION)
+
+
+# checkouts, cancels and returns change stock all the time. they only invalidate the catalog when a product runs
+# out or comes back (ids of products whose stock crossed zero), what in_stock filters and stock facets depend on.
+# the stock numbers in cached product payloads are refreshed on every hit by live_stock() instead.
+
+def invalidate_stock(crossed_zero):
+    if crossed_zero:
+        invalidate_products()
+
+
+# cached_response live hook for product list and detail payloads: one indexed read for the stock of the products on the page
+
+def live_stock(payload):
+    data     = payload.get("data")
+    products = data.get("results",[data]) if isinstance(data,dict) else []
+    products = [product for product in products if isinstance(product,dict) and "id" in product and "stock" in product]
+
+    if products:
+        stock = dict(models.ProductModel.objects.filter(id__in=[product["id"] for product in products]).values_list("id","stock"))
+        for product in products:
+            product["stock"] = stock.get(product["id"],product["stock"])
+
+    return payload
+
+
+def invalidate_brands():
+    bump_generations(BRAND_GENERATION)
+
+
+# any category write can move lft/rght values across the whole tree, so the descendant cache is keyed
+# on the category generation as well.
+
+def invalidate_category_tree():
+    bump_generations(CATEGORY_GENERATION)
+
+
+
+
+# ---------------- category descendant cache ----------------
+
+_local_descendants = {"version":None, "entries":{}}
+_local_lock = threading.Lock()
+
+
+
+# returns the ids of the category with this slug and all of its descendants.
+# resolved from the mptt columns once, then served from process memory and the shared cache
+# until the category generation is bumped by a category write.
+
+def get_category_descendant_ids(slug,active_only=False):
+    version = get_generation(CATEGORY_GENERATION)
+    key     = f"catalog:category_descendants:{version}:{int(active_only)}:{slug}"
+
+    with _local_lock:
+        if _local_descendants["version"] != version:
+            _local_descendants["version"] = version
+            _local_descendants["entries"] = {}
+
+        ids = _local_descendants["entries"].get(key)
+
+    if ids is not None:
+        return ids
+
+
+    ids = cache.get(key)
+
+    if ids is None:
+        categories = models.CategoryModel.objects.filter(slug=slug)
+        if active_only:
+            categories = categories.filter(is_active=True)
+
+        category = categories.values("tree_id","lft","rght").first()
+
+        if category is None:
+            ids = ()
+        else:
+            ids = tuple(models.CategoryModel.objects.filter(tree_id = category["tree_id"],
+                                                            lft__gte = category["lft"],
+                                                            rght__lte = category["rght"]
+                                                           ).values_list("id",flat=True)
+                       )
+
+        cache.set(key, ids, settings.CATEGORY_TREE_CACHE_TIMEOUT)
+
+
+    with _local_lock:
+        if _local_descendants["version"] == version:
+            _local_descendants["entries"][key] = ids
+
+    return ids
+
+
+
+
+# ---------------- facet lookups ----------------
+
+# active brands as plain dicts, cached until the next brand write
+
+def get_active_brands():
+    key    = f"catalog:active_brands:{get_generation(BRAND_GENERATION)}"
+    brands = cache.get(key)
+
+    if brands is None:
+        brands = list(models.BrandModel.objects.filter(is_active=True).order_by("name").values("id","name","slug"))
+        cache.set(key, brands, settings.CATEGORY_TREE_CACHE_TIMEOUT)
+
+    return brands
+
+
+
+# active direct children of the category with this slug (root categories when slug is None),
+# each with the ids of its subtree so product counts can include descendants.
+
+def get_facet_categories(slug=None):
+    key        = f"catalog:facet_categories:{get_generation(CATEGORY_GENERATION)}:{slug or ''}"
+    categories = cache.get(key)
+
+    if categories is None:
+        children = models.CategoryModel.objects.filter(is_active=True)
+
+        if slug:
+            children = children.filter(parent__slug=slug, parent__is_active=True)
+        else:
+            children = children.filter(level=0)
+
+        children = list(children.order_by("name").values("id","name","slug","tree_id","lft","rght"))
+
+        nodes = models.CategoryModel.objects.filter(tree_id__in={child["tree_id"] for child in children})
+        nodes = list(nodes.values_list("id","tree_id","lft","rght"))
+
+        categories = [{"id":child["id"],
+                       "name":child["name"],
+                       "slug":child["slug"],
+                       "ids":[node_id for node_id,tree_id,lft,rght in nodes
+                              if tree_id == child["tree_id"] and lft >= child["lft"] and rght <= child["rght"]
+                             ]
+                      } for child in children
+                     ]
+
+        cache.set(key, categories, settings.CATEGORY_TREE_CACHE_TIMEOUT)
+
+    return categories
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db.models import F, Sum, Value, Subquery, OuterRef, DateTimeField, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from products import models
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+
+# appends one movement per (product id, signed quantity, order id) row in a single insert, zero rows are skipped.
+# call it in the same transaction that changes ProductModel.stock so the two never drift apart.
+
+def record_movements(rows,reason,user=None):
+    movements = [models.StockMovementModel(product_id = product_id,
+                                           order_id   = order_id,
+                                           user       = user,
+                                           quantity   = quantity,
+                                           reason     = reason
+                                          ) for product_id,quantity,order_id in rows if quantity
+                ]
+
+    return models.StockMovementModel.objects.bulk_create(movements)
+
+
+
+
+# annotates ledger_stock on a product queryset: the latest snapshot taken at or before `at` plus the movements
+# recorded after it (and before `at`). each product costs one index lookup into the snapshots and one range
+# scan of the movements since, never the whole history.
+
+def with_ledger_stock(products,at=None):
+    snapshots = models.StockSnapshotModel.objects.filter(product=OuterRef("pk"))
+    movements = models.StockMovementModel.objects.filter(product=OuterRef("pk"), created_at__gte=OuterRef("snapshot_at"))
+
+    if at is not None:
+        snapshots = snapshots.filter(taken_at__lte=at)
+        movements = movements.filter(created_at__lt=at)
+
+    snapshots = snapshots.order_by("-taken_at")
+    moved     = movements.order_by().values("product").annotate(total=Sum("quantity")).values("total")
+
+    return products.annotate(snapshot_stock = Coalesce(Subquery(snapshots.values("stock")[:1]), Value(0)),
+                             snapshot_at    = Coalesce(Subquery(snapshots.values("taken_at")[:1]), Value(EPOCH), output_field=DateTimeField()),
+                             moved          = Subquery(moved, output_field=IntegerField()),
+                            ).annotate(ledger_stock = F("snapshot_stock") + Coalesce(F("moved"), Value(0)))
+
+
+
+# {product id: stock} as the ledger has it, now or at any earlier point in time
+
+def ledger_stock(product_ids,at=None):
+    products = models.ProductModel.objects.filter(id__in=product_ids)
+    return dict(with_ledger_stock(products,at).values_list("id","ledger_stock"))
+
+
+
+
+# writes a snapshot for every product that moved since its last one. the snapshot is taken STOCK_SNAPSHOT_LAG
+# seconds in the past so a movement created inside a transaction that commits later is still inside the window.
+
+def take_snapshots(now=None):
+    taken_at = (now or timezone.now()) - timedelta(seconds=settings.STOCK_SNAPSHOT_LAG)
+
+    balances = with_ledger_stock(models.ProductModel.objects.all(), at=taken_at).filter(moved__isnull=False).values_list("id","ledger_stock")
+
+    snapshots = [models.StockSnapshotModel(product_id=product_id, stock=stock, taken_at=taken_at) for product_id,stock in balances.iterator()]
+
+    return models.StockSnapshotModel.objects.bulk_create(snapshots, batch_size=1000, ignore_conflicts=True)
+
+
+
+
+# products whose stock column disagrees with the ledger, as (product id, stock, ledger stock)
+
+def find_discrepancies():
+    products = with_ledger_stock(models.ProductModel.objects.all())
+    return list(products.exclude(stock=F("ledger_stock")).order_by("id").values_list("id","stock","ledger_stock"))
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from products import models
+from products.filters.user_products import user_products_facets, user_products_filters, user_products_search, PRICE_FACET_BUCKETS
+from products.helpers import get_active_brands, get_facet_categories
+import time
+
+
+
+# the old frontend approach, one filtered COUNT per facet value
+
+def separate_counts(request,queryset):
+
+    filters = user_products_filters(request)
+    queryset,_ = user_products_search(request,queryset)
+
+    def count(dimension,condition=Q()):
+        scoped = queryset
+        for name,q in filters.items():
+            if name != dimension:
+                scoped = scoped.filter(q)
+        return scoped.filter(condition).count()
+
+
+    counts = {"total":count(None),
+              "in_stock":count("stock",Q(stock__gt=0)),
+              "out_of_stock":count("stock",Q(stock=0))
+             }
+
+    for brand in get_active_brands():
+        counts[f"brand_{brand['id']}"] = count("brand",Q(brand_id=brand["id"]))
+
+    for category in get_facet_categories(request.query_params.get("category","").lower() or None):
+        counts[f"category_{category['id']}"] = count("category",Q(category_id__in=category["ids"]))
+
+    for index,(low,high) in enumerate(PRICE_FACET_BUCKETS):
+        bucket = Q()
+        if low is not None:
+            bucket &= Q(price__gte=low)
+        if high is not None:
+            bucket &= Q(price__lt=high)
+
+        counts[f"price_{index}"] = count("price",bucket)
+
+    return counts
+
+
+
+
+class Command(BaseCommand):
+    help = "Compares the single query product facets against one filtered COUNT per facet value."
+
+
+    def add_arguments(self,parser):
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--category")
+        parser.add_argument("--brand")
+        parser.add_argument("--search")
+        parser.add_argument("--min-price")
+        parser.add_argument("--max-price")
+        parser.add_argument("--in-stock", choices=["true","false"])
+
+
+    def handle(self,*args,**options):
+        params = {"category":options["category"],
+                  "brand":options["brand"],
+                  "search":options["search"],
+                  "min_price":options["min_price"],
+                  "max_price":options["max_price"],
+                  "in_stock":options["in_stock"]
+                 }
+        params = {key:value for key,value in params.items() if value}
+
+        request  = Request(APIRequestFactory().get("/api/catalog/products/", params))
+        queryset = models.ProductModel.objects.filter(is_active=True)
+
+        # warm the brand and category lookups so both sides only pay for the counts
+        get_active_brands()
+        get_facet_categories(params.get("category","").lower() or None)
+
+        self.stdout.write(f"products: {queryset.count()}  params: {params or '-'}  repeat: {options['repeat']}")
+
+        for label,run in (("single aggregate",user_products_facets),("separate counts",separate_counts)):
+            with CaptureQueriesContext(connection) as queries:
+                run(request,queryset)
+
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                run(request,queryset)
+            elapsed = (time.perf_counter() - started) / options["repeat"] * 1000
+
+            self.stdout.write(f"{label:<18} queries: {len(queries):>4}  avg: {elapsed:8.2f} ms")
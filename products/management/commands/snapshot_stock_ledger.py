@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from products.ledger import take_snapshots
+import time
+
+
+
+class Command(BaseCommand):
+    help = "Snapshots the stock ledger balance of every product that moved since its last snapshot. Meant to run periodically."
+
+
+    def handle(self,*args,**options):
+        started   = time.perf_counter()
+        snapshots = take_snapshots()
+
+        self.stdout.write(self.style.SUCCESS(f"{len(snapshots)} product snapshots written in {(time.perf_counter() - started) * 1000:.1f} ms"))
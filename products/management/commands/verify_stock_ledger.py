@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.ledger import find_discrepancies
+
+
+
+class Command(BaseCommand):
+    help = "Compares ProductModel.stock of every product with its stock ledger balance and lists the products that disagree."
+
+
+    def handle(self,*args,**options):
+        discrepancies = find_discrepancies()
+
+        for product_id,stock,ledger_stock in discrepancies:
+            self.stdout.write(self.style.ERROR(f"product #{product_id}: stock {stock}, ledger {ledger_stock} ({stock - ledger_stock:+d})"))
+
+        if discrepancies:
+            raise CommandError(f"{len(discrepancies)} products disagree with the stock ledger")
+
+        self.stdout.write(self.style.SUCCESS("stock matches the ledger for every product"))
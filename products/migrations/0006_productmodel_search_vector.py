@@ -0,0 +1,45 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:08
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def populate_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    ProductModel  = apps.get_model("products", "ProductModel")
+    BrandModel    = apps.get_model("products", "BrandModel")
+    CategoryModel = apps.get_model("products", "CategoryModel")
+
+    SearchVector  = django.contrib.postgres.search.SearchVector
+    brand_name    = Subquery(BrandModel.objects.filter(pk=OuterRef("brand_id")).values("name")[:1])
+    category_name = Subquery(CategoryModel.objects.filter(pk=OuterRef("category_id")).values("name")[:1])
+
+    ProductModel.objects.update(search_vector=SearchVector("name", weight="A", config="english") +
+                                              SearchVector(brand_name, weight="B", config="english") +
+                                              SearchVector(category_name, weight="B", config="english") +
+                                              SearchVector("slug", weight="C", config="english") +
+                                              SearchVector("description", weight="D", config="english"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_remove_productmodel_unique_product_name_per_brand_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmodel',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='productmodel',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
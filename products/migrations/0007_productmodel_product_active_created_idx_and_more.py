@@ -0,0 +1,21 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productmodel_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productmodel',
+            index=models.Index(fields=['is_active', '-created_at'], name='product_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productmodel',
+            index=models.Index(fields=['is_active', 'price'], name='product_active_price_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 6.0.9 on 2026-10-18 14:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# every existing product starts the ledger with its current stock as the opening balance
+def record_opening_balances(apps, schema_editor):
+    ProductModel       = apps.get_model("products", "ProductModel")
+    StockMovementModel = apps.get_model("products", "StockMovementModel")
+
+    StockMovementModel.objects.bulk_create([StockMovementModel(product_id=product_id, quantity=stock, reason="OPENING")
+                                            for product_id,stock in ProductModel.objects.filter(stock__gt=0).values_list("id","stock").iterator()
+                                           ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_orderitemmodel_restocked_at'),
+        ('products', '0007_productmodel_product_active_created_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovementModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(choices=[('OPENING', 'Opening Balance'), ('ADJUSTMENT', 'Admin Adjustment'), ('CHECKOUT', 'Checkout'), ('CANCELLATION', 'Cancellation'), ('RETURN', 'Return'), ('RESERVATION_EXPIRED', 'Reservation Expired')], max_length=30)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='orders.ordermodel')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='products.productmodel')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'created_at'], name='stockmovement_product_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshotModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.IntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='products.productmodel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'taken_at'), name='unique_snapshot_per_product_time')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
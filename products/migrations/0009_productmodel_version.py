@@ -0,0 +1,18 @@
+# Generated by Django 6.0.9 on 2026-10-18 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmodel',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -1,7 +1,11 @@
 from django.db import models
+from django.conf import settings
+from django.utils import timezone
 from django.utils.text import slugify
 from mptt.models import MPTTModel, TreeForeignKey
 from django.db.models.functions import Lower
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
 # Create your models here.
 
 class CategoryModel(MPTTModel):
@@ -84,6 +88,11 @@ class ProductModel(models.Model):
 
     is_active = models.BooleanField(default=True)
 
+    # bumped by every write that can change price, stock or is_active, cart lines keep the version they were priced at
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)   # maintained in save(), see products.helpers
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -99,10 +108,102 @@ class ProductModel(models.Model):
                                                 name="unique_slug_per_product"
                                               )
                       ]
+        indexes = [GinIndex(fields=["search_vector"], name="product_search_vector_gin"),
+                   models.Index(fields=["is_active","-created_at"], name="product_active_created_idx"),
+                   models.Index(fields=["is_active","price"], name="product_active_price_idx")
+                  ]
     
 
+    VERSIONED_FIELDS = {"price","stock","is_active"}
+
+    # an update is one UPDATE: version + 1 and, on postgres, the search document built from the new values are
+    # written as expressions and django reads them back with RETURNING. an insert refreshes its search document
+    # with a second UPDATE.
     def save(self,*args,**kwargs):
+        from products.helpers import refresh_search_vectors, search_document, full_text_search_enabled, SEARCHABLE_FIELDS
+
         if not self.slug:
             self.slug = slugify(self.name)
-        
-        return super().save(*args,**kwargs)
\ No newline at end of file
+
+        adding        = self._state.adding
+        update_fields = kwargs.get("update_fields")
+        expressions   = {}
+
+        if not adding and (update_fields is None or self.VERSIONED_FIELDS.intersection(update_fields)):
+            expressions["version"] = models.F("version") + 1
+
+        if not adding and full_text_search_enabled() and (update_fields is None or SEARCHABLE_FIELDS.intersection(update_fields)):
+            expressions["search_vector"] = search_document(self)
+
+        if expressions and update_fields is not None:
+            kwargs["update_fields"] = {*update_fields,*expressions}
+
+        previous = {name:self.__dict__[name] for name in expressions if name in self.__dict__}
+        self.__dict__.update(expressions)
+
+        try:
+            result = super().save(*args,**kwargs)
+        except Exception:
+            # the row was not written, the instance must not keep the expressions
+            for name in expressions:
+                self.__dict__.pop(name,None)
+            self.__dict__.update(previous)
+            raise
+
+        if adding:
+            refresh_search_vectors(ProductModel.objects.filter(pk=self.pk))
+
+        return result
+
+
+
+
+
+# append-only history of every change to ProductModel.stock, quantity is signed (negative when stock leaves).
+# the stock of a product is its latest snapshot plus the movements recorded since, see products.ledger
+
+class StockMovementModel(models.Model):
+
+    REASON_CHOICES = [("OPENING","Opening Balance"),
+                      ("ADJUSTMENT","Admin Adjustment"),
+                      ("CHECKOUT","Checkout"),
+                      ("CANCELLATION","Cancellation"),
+                      ("RETURN","Return"),
+                      ("RESERVATION_EXPIRED","Reservation Expired")
+                     ]
+
+    product = models.ForeignKey(ProductModel, related_name="stock_movements", on_delete=models.CASCADE, null=False, blank=False)
+    order   = models.ForeignKey("orders.OrderModel", related_name="stock_movements", on_delete=models.SET_NULL, null=True, blank=True)
+    user    = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="stock_movements", on_delete=models.SET_NULL, null=True, blank=True)
+
+    quantity = models.IntegerField(null=False, blank=False)
+    reason   = models.CharField(max_length=30, choices=REASON_CHOICES, null=False, blank=False)
+
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+
+    def __str__(self):
+        return f"{self.product_id} {self.quantity:+d} ({self.reason})"
+
+
+    class Meta:
+        indexes = [models.Index(fields=["product","created_at"], name="stockmovement_product_idx")]
+
+
+
+
+# ledger balance of a product covering every movement created before taken_at
+
+class StockSnapshotModel(models.Model):
+    product = models.ForeignKey(ProductModel, related_name="stock_snapshots", on_delete=models.CASCADE, null=False, blank=False)
+
+    stock    = models.IntegerField(null=False, blank=False)
+    taken_at = models.DateTimeField(null=False, blank=False)
+
+
+    def __str__(self):
+        return f"{self.product_id} = {self.stock} @ {self.taken_at}"
+
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["product","taken_at"], name="unique_snapshot_per_product_time")]
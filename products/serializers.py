@@ -4,6 +4,8 @@ import re
 from django.db import IntegrityError,transaction
 from rest_framework.validators import UniqueTogetherValidator
 from accounts.helpers import create_audit_log
+from products.helpers import refresh_search_vectors, invalidate_category_tree, invalidate_brands, invalidate_products
+from products.ledger import record_movements
 
 class CategoryCreateSerializer(serializers.ModelSerializer):
     name   = serializers.CharField(required=True)
@@ -43,6 +45,8 @@ class CategoryCreateSerializer(serializers.ModelSerializer):
                 category = super().create(validated_data)
                 create_audit_log(user=request.user,action=action,instance=category,message=message)
 
+                invalidate_category_tree()
+
                 return category
 
         except IntegrityError:
@@ -146,6 +150,11 @@ class CategoryUpdateSerializer(serializers.ModelSerializer):
             with transaction.atomic():
                 category = super().update(instance, validated_data)
 
+                invalidate_category_tree()
+
+                if "name" in changes:
+                    refresh_search_vectors(models.ProductModel.objects.filter(category=category))
+
                 if changes:
                     changes_message = ", ".join(f"{field} changed from {v['old']} -> {v['new']}" for field,v in changes.items())
                     message = f"{changes_message} by {request.user.username}"
@@ -200,6 +209,8 @@ class BrandCreateSerializer(serializers.ModelSerializer):
                 brand = super().create(validated_data)
                 create_audit_log(user=request.user,action=action,instance=brand,message=message)
 
+                invalidate_brands()
+
                 return brand
         except IntegrityError:
             raise serializers.ValidationError({"error_message":"Brand already exists.",
@@ -265,6 +276,11 @@ class BrandUpdateSerializer(serializers.ModelSerializer):
             with transaction.atomic():
                 brand = super().update(instance, validated_data)
 
+                invalidate_brands()
+
+                if "name" in changes:
+                    refresh_search_vectors(models.ProductModel.objects.filter(brand=brand))
+
                 if changes:
                     changes_message = ", ".join(f"{field} changed from {v['old']} -> {v['new']}" for field,v in changes.items())
                     message = f"{changes_message} by {request.user.username}"
@@ -348,6 +364,9 @@ class ProductCreateSerializer(serializers.ModelSerializer):
             with transaction.atomic():
                 product = super().create(validated_data)
                 create_audit_log(user=request.user,action=action,instance=product,message=message)
+                record_movements([(product.id,product.stock,None)], "OPENING", user=request.user)
+
+                invalidate_products()
 
                 return product
         except IntegrityError:
@@ -461,8 +480,18 @@ class ProductUpdateSerializer(serializers.ModelSerializer):
 
         try:
             with transaction.atomic():
+                # checkouts and cancels change stock underneath the form, read the live value under the row lock
+                # so the ledger records the real difference and a save without a stock change keeps it
+                current_stock  = models.ProductModel.objects.select_for_update().values_list("stock",flat=True).get(id=instance.id)
+                instance.stock = current_stock
+
                 product = super().update(instance, validated_data)
 
+                if product.stock != current_stock:
+                    record_movements([(product.id,product.stock - current_stock,None)], "ADJUSTMENT", user=request.user)
+
+                invalidate_products()
+
                 if changes:
                     changes_message = ", ".join(f"{field} changed from {v['old']} -> {v['new']}" for field,v in changes.items())
                     message = f"{changes_message} by {request.user.username}"
@@ -1,3 +1,91 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from unittest import skipUnless
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from products import models
+from products.filters.user_products import user_products_facets
+from products.helpers import refresh_search_vectors
 
-# Create your tests here.
+
+
+# facets cost one aggregate for total, price and stock plus one GROUP BY each for brands and categories,
+# whatever the number of brands and categories. each facet ignores only its own filter.
+
+class ProductFacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        acme   = models.BrandModel.objects.create(name="Acme", slug="acme")
+        globex = models.BrandModel.objects.create(name="Globex", slug="globex")
+
+        tools   = models.CategoryModel.objects.create(name="Tools", slug="tools")
+        hammers = models.CategoryModel.objects.create(name="Hammers", slug="hammers", parent=tools)
+        garden  = models.CategoryModel.objects.create(name="Garden", slug="garden")
+
+        for name,brand,category,price,stock in [("Claw Hammer",acme,hammers,300,5),
+                                                ("Wrench",acme,tools,800,0),
+                                                ("Sledge",globex,hammers,1200,2),
+                                                ("Rake",globex,garden,6000,1)
+                                               ]:
+            models.ProductModel.objects.create(name=name, slug=name.lower().replace(" ","-"), brand=brand,
+                                               category=category, price=price, stock=stock
+                                              )
+
+
+    def setUp(self):
+        cache.clear()
+
+
+    def facets(self,params):
+        request  = Request(APIRequestFactory().get("/api/products/",params))
+        products = models.ProductModel.objects.filter(is_active=True)
+
+        user_products_facets(request,products)     # brands and the category tree come from the cache afterwards
+
+        with self.assertNumQueries(3):
+            return user_products_facets(request,products)
+
+
+    def test_counts(self):
+        facets = self.facets({})
+
+        self.assertEqual(facets["total"],4)
+        self.assertEqual([(brand["slug"],brand["count"]) for brand in facets["brands"]],[("acme",2),("globex",2)])
+        self.assertEqual([(category["slug"],category["count"]) for category in facets["categories"]],[("garden",1),("tools",3)])
+        self.assertEqual([bucket["count"] for bucket in facets["price"]],[1,1,1,1])
+        self.assertEqual(facets["stock"],{"in_stock":3,"out_of_stock":1})
+
+
+    def test_facet_ignores_its_own_filter(self):
+        facets = self.facets({"brand":"acme","category":"tools","in_stock":"true"})
+
+        self.assertEqual(facets["total"],1)
+        self.assertEqual([(brand["slug"],brand["count"]) for brand in facets["brands"]],[("acme",1),("globex",1)])
+        self.assertEqual([(category["slug"],category["count"]) for category in facets["categories"]],[("hammers",1)])
+        self.assertEqual(facets["stock"],{"in_stock":1,"out_of_stock":1})
+
+
+
+
+# saving a product rebuilds its search document from the values being saved, in the same UPDATE
+
+@skipUnless(connection.vendor == "postgresql", "full text search is postgres only")
+class ProductSearchDocumentTests(TestCase):
+
+    def test_save_writes_the_new_document(self):
+        brand    = models.BrandModel.objects.create(name="Acme", slug="acme")
+        category = models.CategoryModel.objects.create(name="Tools", slug="tools")
+        product  = models.ProductModel.objects.create(name="Hammer", slug="hammer", brand=brand, category=category, price=100)
+
+        product.description = "Forged steel claw"
+        with self.assertNumQueries(1):
+            product.save()
+
+        saved = models.ProductModel.objects.get(pk=product.pk).search_vector
+        refresh_search_vectors(models.ProductModel.objects.filter(pk=product.pk))
+
+        self.assertIn("claw",saved)
+        self.assertEqual(saved,models.ProductModel.objects.get(pk=product.pk).search_vector)
+        self.assertEqual(product.version,2)
@@ -11,16 +11,19 @@ from django.db.models import Q
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.exceptions import NotFound
 from accounts.helpers import create_audit_log
+from products.helpers import invalidate_category_tree,invalidate_brands,invalidate_products,live_stock,PRODUCT_GENERATION,BRAND_GENERATION,CATEGORY_GENERATION
+from common.cache import cached_response
 from django.db import IntegrityError,transaction
-from common.swagger import CATEGORY_PARAM,BRAND_PARAM,SEARCH_PARAM,IS_ACTIVE_PARAM,PARENT_PARAM,MIN_PRICE_PARAM,MAX_PRICE_PARAM,SORT_PARAM,IN_STOCK_PARAM
+from common.swagger import CATEGORY_PARAM,BRAND_PARAM,SEARCH_PARAM,IS_ACTIVE_PARAM,PARENT_PARAM,MIN_PRICE_PARAM,MAX_PRICE_PARAM,SORT_PARAM,IN_STOCK_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM,FACETS_PARAM
 from common.pagination import DefaultPagination
 from products.filters.admin_categories import admin_category_list
 from products.filters.admin_brands import admin_brand_list
 from products.filters.admin_products import admin_products_list
-from products.filters.user_products import user_products_list
+from products.filters.user_products import user_products_list, user_products_facets
 from rest_framework import serializers as drf_serializers
 from rest_framework.permissions import IsAdminUser
 from common.helpers import success_response,error_response,normalize_validation_errors
+from common.instrumentation import timed_data
 from common.schemas import SuccessResponseSerializer,ErrorResponseSerializer,CategoryCreateSucccessResponseSerializer,AdminCategoryListSuccessResponseSerializer,CategoryListSuccessResponseSerializer,CategoryDetailSuccessResponseSerializer,CategoryUpdateSuccessResponseSerializer,CategoryDeletSuccessResponseSerializer,AdminCategoryDetailSuccessResponseSerializer,BrandCreateSuccessResponseSerializer,AdminBrandListSuccessResponseSerializer,BrandListSuccessResponseSerializer,BrandDetailSuccessResponseSerializer,BrandUpdateSuccessResponseSerializer,BrandDeleteSuccessResponseSerializer,AdminBrandDetailSuccessSerializer,ProductCreateSuccessResponseSerializer,AdminProductListSuccessResponseSerializer,ProductListSuccessResponseSerializer,ProductDetailSuccessResponseSerializer,ProductUpdateSuccessResponseSerializer,ProductDeleteSuccessResponseSerializer,AdminProductDetailSuccessResponseSerializer
 
 # Create your views here.
@@ -67,7 +70,7 @@ class AdminCategoryAPIView(GenericAPIView):
 
 
     @swagger_auto_schema(tags=["Admin - Categories"],
-                         manual_parameters=[IS_ACTIVE_PARAM,PARENT_PARAM,CATEGORY_PARAM,SEARCH_PARAM],
+                         manual_parameters=[IS_ACTIVE_PARAM,PARENT_PARAM,CATEGORY_PARAM,SEARCH_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          request_body = None,
                          responses = {200 : AdminCategoryListSuccessResponseSerializer,
                                       500 : ErrorResponseSerializer
@@ -83,11 +86,7 @@ class AdminCategoryAPIView(GenericAPIView):
 
         serializer = self.get_serializer(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
 
         return success_response(message = "Category list fetched successfuly",
                                 data    = paginated_data,
@@ -103,11 +102,13 @@ class CategoryListAPIView(GenericAPIView):
     pagination_class = DefaultPagination
 
     @swagger_auto_schema(tags=['Categories'], request_body=None, 
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          responses = {200 : CategoryListSuccessResponseSerializer,
                                       500 : ErrorResponseSerializer,
                                       400 : ErrorResponseSerializer
                                      }
                         )
+    @cached_response(CATEGORY_GENERATION)
     def get(self,request):
         categories = models.CategoryModel.objects.filter(is_active=True).select_related("parent").order_by('-created_at')
 
@@ -116,11 +117,7 @@ class CategoryListAPIView(GenericAPIView):
         
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Category list fetched successfuly.",
                                 data    = paginated_data,
@@ -140,6 +137,7 @@ class CategoryDetailAPIView(GenericAPIView):
                                                                            500 : ErrorResponseSerializer
                                                                           }
                         )
+    @cached_response(CATEGORY_GENERATION)
     def get(self,request,slug):
         try:
             category = models.CategoryModel.objects.get(slug=slug, is_active=True)
@@ -151,7 +149,7 @@ class CategoryDetailAPIView(GenericAPIView):
 
         serializer = self.serializer_class(category)
         return success_response(message = "Category detail fetched successfuly.",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     
@@ -228,6 +226,8 @@ class AdminCategoryDetailAPIView(GenericAPIView):
 
             create_audit_log(user=request.user,action=action,instance=category,message=message) 
 
+            invalidate_category_tree()
+
         return success_response(message = "Category deleted successfuly.",
                                 data    = {"category_id":id,
                                            "category_name":category.name
@@ -256,7 +256,7 @@ class AdminCategoryDetailAPIView(GenericAPIView):
         serializer = self.get_serializer(category)
 
         return success_response(message = "Category detail fetched successfuly.",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
 
@@ -301,7 +301,7 @@ class AdminBrandAPIView(GenericAPIView):
         
     
     @swagger_auto_schema(tags=["Admin - Brands"],
-                         manual_parameters=[IS_ACTIVE_PARAM,BRAND_PARAM,SEARCH_PARAM],
+                         manual_parameters=[IS_ACTIVE_PARAM,BRAND_PARAM,SEARCH_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          request_body=None,
                          responses = {200 : AdminBrandListSuccessResponseSerializer,
                                       400 : ErrorResponseSerializer,
@@ -319,11 +319,7 @@ class AdminBrandAPIView(GenericAPIView):
 
         serializer = self.get_serializer(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Brand list fetched successfuly.",
                                 data    = paginated_data,
@@ -338,11 +334,14 @@ class BrandListAPIView(GenericAPIView):
     serializer_class = serializers.BrandSerializer
     pagination_class = DefaultPagination
 
-    @swagger_auto_schema(tags=["Brands"], request_body=None, responses = {200 : BrandListSuccessResponseSerializer,
-                                                                          500 : ErrorResponseSerializer,
-                                                                          400 : ErrorResponseSerializer
-                                                                         }
+    @swagger_auto_schema(tags=["Brands"], request_body=None,
+                         manual_parameters=[PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
+                         responses = {200 : BrandListSuccessResponseSerializer,
+                                      500 : ErrorResponseSerializer,
+                                      400 : ErrorResponseSerializer
+                                     }
                         )
+    @cached_response(BRAND_GENERATION)
     def get(self,request):
         brands = models.BrandModel.objects.filter(is_active=True)
 
@@ -351,11 +350,7 @@ class BrandListAPIView(GenericAPIView):
 
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Brand list fetched successfuly.",
                                 data = paginated_data,
@@ -375,6 +370,7 @@ class BrandDetailAPIView(GenericAPIView):
                                                                           500 : ErrorResponseSerializer
                                                                          }
                         )
+    @cached_response(BRAND_GENERATION)
     def get(self,request,slug):
         try:
             brand = models.BrandModel.objects.get(slug=slug, is_active=True)
@@ -387,7 +383,7 @@ class BrandDetailAPIView(GenericAPIView):
 
         serializer = self.serializer_class(brand)
         return success_response(message = "Brand detail fetched successfuly",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
 
@@ -465,6 +461,8 @@ class AdminBrandDetailAPIView(GenericAPIView):
 
             create_audit_log(user=request.user,action=action,instance=brand,message=message)
 
+            invalidate_brands()
+
         return success_response(message="Brand deleted successfuly.",
                                 data={"brand_id":id,
                                       "brand_name":brand.name
@@ -491,7 +489,7 @@ class AdminBrandDetailAPIView(GenericAPIView):
         serializer = self.get_serializer(brand)
 
         return success_response(message = "Brand data fetched successfuly.",
-                                data    = serializer.data,
+                                data    = timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     
@@ -540,7 +538,7 @@ class AdminProductAPIView(GenericAPIView):
         
     
     @swagger_auto_schema(tags=["Admin - Products"],
-                         manual_parameters=[CATEGORY_PARAM,BRAND_PARAM,SEARCH_PARAM,MIN_PRICE_PARAM,MAX_PRICE_PARAM,IS_ACTIVE_PARAM],
+                         manual_parameters=[CATEGORY_PARAM,BRAND_PARAM,SEARCH_PARAM,MIN_PRICE_PARAM,MAX_PRICE_PARAM,IS_ACTIVE_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM],
                          responses = {200 : AdminProductListSuccessResponseSerializer,
                                       400 : ErrorResponseSerializer,
                                       500 : ErrorResponseSerializer
@@ -559,11 +557,7 @@ class AdminProductAPIView(GenericAPIView):
 
         serializer = self.get_serializer(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
         
         return success_response(message = "Product list fetched successfuly.",
                                 data    = paginated_data,
@@ -578,17 +572,19 @@ class ProductListAPIView(GenericAPIView):
     pagination_class = DefaultPagination
 
     @swagger_auto_schema(tags=["Products"],
-                         manual_parameters=[CATEGORY_PARAM,BRAND_PARAM,MIN_PRICE_PARAM,MAX_PRICE_PARAM,SEARCH_PARAM,SORT_PARAM,IN_STOCK_PARAM],
+                         manual_parameters=[CATEGORY_PARAM,BRAND_PARAM,MIN_PRICE_PARAM,MAX_PRICE_PARAM,SEARCH_PARAM,SORT_PARAM,IN_STOCK_PARAM,PAGINATION_PARAM,CURSOR_PARAM,WITH_COUNT_PARAM,FACETS_PARAM],
                          request_body = None,
                          responses = {200 : ProductListSuccessResponseSerializer,
                                       500 : ErrorResponseSerializer,
                                       400 : ErrorResponseSerializer
                                      }
                          )
+    @cached_response(PRODUCT_GENERATION,BRAND_GENERATION,CATEGORY_GENERATION,live=live_stock)
     def get(self,request):
         products = models.ProductModel.objects.filter(is_active=True).select_related('category','brand').order_by('-created_at')
 
         try:
+            facets   = user_products_facets(request,products) if request.query_params.get("facets","").lower() == "true" else None
             products = user_products_list(request,products)
         except drf_serializers.ValidationError as e:
             return Response({"detail":e.detail},status=status.HTTP_400_BAD_REQUEST)
@@ -599,11 +595,10 @@ class ProductListAPIView(GenericAPIView):
         
         serializer = self.serializer_class(page, many=True)
 
-        paginated_data = {"count":paginator.page.paginator.count,
-                          "next":paginator.get_next_link(),
-                          "previous":paginator.get_previous_link(),
-                          "results":serializer.data
-                         }
+        paginated_data = paginator.get_paginated_data(timed_data(serializer))
+
+        if facets is not None:
+            paginated_data["facets"] = facets
         
         return success_response(message = "Product list fetched successfuly.",
                                 data = paginated_data,
@@ -625,6 +620,7 @@ class ProductDetailAPIView(GenericAPIView):
                                       404 : ErrorResponseSerializer
                                      }
                         )
+    @cached_response(PRODUCT_GENERATION,BRAND_GENERATION,CATEGORY_GENERATION,live=live_stock)
     def get(self,request,slug):
         try:
             product = models.ProductModel.objects.get(slug=slug, is_active=True)
@@ -637,7 +633,7 @@ class ProductDetailAPIView(GenericAPIView):
 
         serializer = self.serializer_class(product)
         return success_response(message="Product data fetched successfuly.",
-                                data = serializer.data,
+                                data = timed_data(serializer),
                                 status_code =status.HTTP_200_OK
                                )
     
@@ -714,6 +710,8 @@ class AdminProductDetailAPIView(GenericAPIView):
 
             create_audit_log(user=request.user,action=action,instance=product,message=message)
 
+            invalidate_products()
+
         return success_response(message="Product deleted successfuly",
                                 data={"product_id":id,
                                       "product_name":product.name
@@ -742,7 +740,7 @@ class AdminProductDetailAPIView(GenericAPIView):
         serializer = self.get_serializer(product)
 
         return success_response(message="Product data fetched successfuly.",
-                                data =serializer.data,
+                                data =timed_data(serializer),
                                 status_code = status.HTTP_200_OK
                                )
     